@@ -0,0 +1,58 @@
+"""
+Compare the time taken to convert cells by looking up the schema type for
+every cell with convert_type, against using the converter that is looked up
+once per column with get_converter.
+
+    python benchmarks/bench_convert_type.py --cells 10000000
+
+"""
+
+import argparse
+import time
+
+import pytz
+
+from flattentool.input import convert_type, get_converter
+
+COLUMNS = [
+    ("number", "12.5"),
+    ("integer", "12"),
+    ("boolean", "True"),
+    ("string", "A string"),
+    ("date", "2020-01-01"),
+    ("string_array", "a;b;c"),
+    ("", "Untyped"),
+]
+
+
+def run_convert_type(cells, timezone):
+    start = time.perf_counter()
+    for num in range(cells):
+        type_string, value = COLUMNS[num % len(COLUMNS)]
+        convert_type(type_string, value, timezone, {})
+    return time.perf_counter() - start
+
+
+def run_converters(cells, timezone):
+    converters = [(get_converter(type_string), value) for type_string, value in COLUMNS]
+    start = time.perf_counter()
+    for num in range(cells):
+        converter, value = converters[num % len(converters)]
+        converter(value, timezone)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cells", type=int, default=10000000)
+    args = parser.parse_args()
+    timezone = pytz.timezone("UTC")
+    per_cell = run_convert_type(args.cells, timezone)
+    per_column = run_converters(args.cells, timezone)
+    print("convert_type: {:.2f}s".format(per_cell))
+    print("get_converter: {:.2f}s".format(per_column))
+    print("speedup: {:.2f}x".format(per_cell / per_column))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Compare the time taken to write flattened rows to an ODS file by streaming
+content.xml with ODSOutput, against building the whole document with
+odfpy's DOM, as ODSOutput used to.
+
+    python benchmarks/bench_ods_output.py --rows 20000
+
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import zipfile
+from decimal import Decimal
+
+import odf.table
+import odf.text
+from odf.opendocument import OpenDocumentSpreadsheet
+
+from flattentool.output import ODSOutput, SpreadsheetOutput, remove_illegal_characters
+from flattentool.sheet import Sheet
+
+HEADINGS = [
+    "ocid",
+    "id",
+    "date",
+    "tag",
+    "tender/id",
+    "tender/title",
+    "tender/value/amount",
+    "tender/value/currency",
+    "tender/numberOfTenderers",
+    "buyer/name",
+]
+
+
+class MockParser:
+    def __init__(self, rows):
+        self.main_sheet = Sheet(HEADINGS)
+        for num in range(rows):
+            self.main_sheet.append_line(make_line(num))
+        self.sub_sheets = {}
+
+
+class DOMODSOutput(SpreadsheetOutput):
+    """
+    Builds the whole spreadsheet as an odfpy DOM before saving it, as
+    ODSOutput did before it streamed content.xml.
+
+    """
+
+    def open(self):
+        self.workbook = OpenDocumentSpreadsheet()
+
+    def _make_cell(self, value):
+        if value:
+            try:
+                cell = odf.table.TableCell(valuetype="float", value=float(value))
+            except ValueError:
+                cell = odf.table.TableCell(valuetype="string")
+        else:
+            cell = odf.table.TableCell(valuetype="Nonetype")
+        cell.addElement(odf.text.P(text=value))
+        return cell
+
+    def _make_row(self, values):
+        row = odf.table.TableRow()
+        for value in values:
+            row.addElement(self._make_cell(value))
+        return row
+
+    def start_sheet(self, sheet_name, sheet_header):
+        self.worksheet = odf.table.Table(name=(self.sheet_prefix + sheet_name)[:31])
+        self.worksheet.addElement(self._make_row(sheet_header))
+
+    def write_row(self, values):
+        self.worksheet.addElement(
+            self._make_row([remove_illegal_characters(value) for value in values])
+        )
+
+    def end_sheet(self):
+        self.workbook.spreadsheet.addElement(self.worksheet)
+
+    def close(self):
+        self.workbook.save(self.output_name)
+
+
+def make_line(num):
+    return {
+        "ocid": "ocds-213czf-{}".format(num // 10),
+        "id": str(num),
+        "date": "2020-01-01T00:00:00Z",
+        "tag": "tender",
+        "tender/id": "tender-{}".format(num),
+        "tender/title": "A tender with a reasonably long title",
+        "tender/value/amount": Decimal(num) / 100,
+        "tender/value/currency": "GBP",
+        "tender/numberOfTenderers": num % 7,
+        "buyer/name": "Buyer {}".format(num % 1000),
+    }
+
+
+def read_entries(filename):
+    with zipfile.ZipFile(filename) as zip_file:
+        return [(name, zip_file.read(name)) for name in zip_file.namelist()]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    args = parser.parse_args()
+    mock_parser = MockParser(args.rows)
+    entries = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # odfpy declares every namespace it has seen so far in the process on
+        # each part's root element, so save a document first, for both
+        # writers to start with the same namespaces.
+        OpenDocumentSpreadsheet().save(os.path.join(tmpdir, "empty.ods"))
+        for label, output_class in (("dom", DOMODSOutput), ("stream", ODSOutput)):
+            output_name = os.path.join(tmpdir, label + ".ods")
+            start = time.perf_counter()
+            output_class(parser=mock_parser, output_name=output_name).write_sheets()
+            elapsed = time.perf_counter() - start
+            entries[label] = read_entries(output_name)
+            print("{}: {} rows: {:.2f}s".format(label, args.rows, elapsed))
+    print("Same zip entries: {}".format(entries["dom"] == entries["stream"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Compare the time taken to store and read back flattened rows using each of
+the sheet storages.
+
+    python benchmarks/bench_sheet_storage.py --rows 1000000
+
+"""
+
+import argparse
+import time
+from decimal import Decimal
+
+from flattentool.sheet import SHEET_STORAGES
+
+
+def make_line(num):
+    return {
+        "ocid": "ocds-213czf-{}".format(num // 10),
+        "id": str(num),
+        "date": "2020-01-01T00:00:00Z",
+        "tag": "tender",
+        "tender/id": "tender-{}".format(num),
+        "tender/title": "A tender with a reasonably long title",
+        "tender/value/amount": Decimal(num) / 100,
+        "tender/value/currency": "GBP",
+        "tender/numberOfTenderers": num % 7,
+        "buyer/name": "Buyer {}".format(num % 1000),
+    }
+
+
+def run(sheet_storage_name, rows):
+    sheet_storage = SHEET_STORAGES[sheet_storage_name]()
+    try:
+        sheet = sheet_storage.create_sheet("")
+        start = time.perf_counter()
+        for num in range(rows):
+            sheet.append_line(make_line(num))
+            if num % 2000 == 0 and num != 0:
+                sheet_storage.commit()
+        sheet_storage.commit()
+        written = time.perf_counter()
+        count = sum(1 for line in sheet.lines)
+        read = time.perf_counter()
+        assert count == rows
+    finally:
+        sheet_storage.close()
+    return written - start, read - written
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args()
+    for sheet_storage_name in sorted(SHEET_STORAGES):
+        write_time, read_time = run(sheet_storage_name, args.rows)
+        print(
+            "{}: write {:.2f}s, read {:.2f}s, total {:.2f}s".format(
+                sheet_storage_name, write_time, read_time, write_time + read_time
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Compare the time taken to unflatten wide rows when the plan for each column
+is compiled once per sheet, against compiling it again for every row.
+
+    python benchmarks/bench_unflatten_line.py --rows 2000 --columns 200
+
+"""
+
+import argparse
+import time
+from collections import OrderedDict
+
+import pytz
+
+from flattentool.input import Cell, unflatten_main_with_parser
+from flattentool.schema import SchemaParser
+
+
+def make_schema(columns):
+    return {
+        "properties": {
+            "ocid": {"type": "string"},
+            "id": {"type": "string"},
+            "parties": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "string"},
+                        "details": {
+                            "type": "object",
+                            "properties": {
+                                "field{}".format(num): {"type": "number"}
+                                for num in range(columns)
+                            },
+                        },
+                    },
+                },
+            },
+        }
+    }
+
+
+def make_headings(columns):
+    return ["ocid", "id", "parties/0/id"] + [
+        "parties/0/details/field{}".format(num) for num in range(columns)
+    ]
+
+
+def make_line(headings, num):
+    line = OrderedDict()
+    for col, heading in enumerate(headings):
+        line[heading] = Cell(str(num + col), ("", "", num + 2, heading))
+    return line
+
+
+def run(parser, headings, rows, share_path_plans):
+    timezone = pytz.timezone("UTC")
+    path_plans = {}
+    start = time.perf_counter()
+    for num in range(rows):
+        unflatten_main_with_parser(
+            parser,
+            make_line(headings, num),
+            timezone,
+            False,
+            "id",
+            {},
+            path_plans if share_path_plans else None,
+        )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--columns", type=int, default=200)
+    args = parser.parse_args()
+    schema_parser = SchemaParser(root_schema_dict=make_schema(args.columns))
+    schema_parser.parse()
+    headings = make_headings(args.columns)
+    per_row = run(schema_parser, headings, args.rows, False)
+    per_sheet = run(schema_parser, headings, args.rows, True)
+    print("compiled per row: {:.2f}s".format(per_row))
+    print("compiled per sheet: {:.2f}s".format(per_sheet))
+    print("speedup: {:.2f}x".format(per_row / per_sheet))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Time unflattening increasing numbers of distinct root ids, as unflatten does
+without streaming, to check that the time taken per root id stays about the
+same. The peak memory use of the process so far is also shown.
+
+    python benchmarks/bench_unflatten_root_ids.py --root-ids 10000 100000 1000000
+
+"""
+
+import argparse
+import gc
+import resource
+import time
+from collections import OrderedDict
+
+from flattentool.input import SpreadsheetInput
+
+
+class GeneratedInput(SpreadsheetInput):
+    def __init__(self, root_ids, **kwargs):
+        self.root_ids = root_ids
+        super().__init__(**kwargs)
+
+    def read_sheets(self):
+        self.sub_sheet_names = ["main"]
+
+    def get_sheet_headings(self, sheet_name):
+        return ["ocid", "id", "tender/id"]
+
+    def get_sheet_lines(self, sheet_name):
+        for num in range(self.root_ids):
+            yield OrderedDict(
+                [
+                    ("ocid", "ocds-213czf-{}".format(num)),
+                    ("id", str(num)),
+                    ("tender/id", "tender-{}".format(num)),
+                ]
+            )
+
+
+def run(root_ids):
+    spreadsheet_input = GeneratedInput(root_ids, root_id="ocid")
+    spreadsheet_input.read_sheets()
+    gc.collect()
+    start = time.perf_counter()
+    result, _, _ = spreadsheet_input.fancy_unflatten(
+        with_cell_source_map=False, with_heading_source_map=False, stream_result=True
+    )
+    count = sum(1 for _root_object in result)
+    taken = time.perf_counter() - start
+    assert count == root_ids
+    return taken
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--root-ids", type=int, nargs="+", default=[10000, 100000, 1000000]
+    )
+    args = parser.parse_args()
+    for root_ids in args.root_ids:
+        taken = run(root_ids)
+        print(
+            "{} root ids: {:.2f}s, {:.2f}us per root id, peak memory {}MB".format(
+                root_ids,
+                taken,
+                taken / root_ids * 1000000,
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
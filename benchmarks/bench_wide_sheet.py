@@ -0,0 +1,97 @@
+"""
+Compare the time taken to flatten JSON into a wide sheet, when the columns
+of each sheet are kept in a list (as they used to be), against keeping them
+as the keys of a dict, as Sheet does now.
+
+    python benchmarks/bench_wide_sheet.py --columns 5000 --rows 20
+
+"""
+
+import argparse
+import time
+
+import flattentool.json_input
+from flattentool.json_input import JSONParser
+from flattentool.sheet import MemorySheetStorage
+
+
+class ListSheet(object):
+    """
+    Sheet as it was, with its columns in lists, so that finding a column
+    means looking at every column before it.
+    """
+
+    def __init__(self, columns=None, root_id="", name=None):
+        self.id_columns = []
+        self.columns = columns if columns else []
+        self.titles = {}
+        self._lines = []
+        self.root_id = root_id
+        self.name = name
+
+    @property
+    def lines(self):
+        return self._lines
+
+    def add_field(self, field, id_field=False):
+        columns = self.id_columns if id_field else self.columns
+        if field not in columns:
+            columns.append(field)
+
+    def append(self, item):
+        self.add_field(item)
+
+    def __iter__(self):
+        if self.root_id:
+            yield self.root_id
+        for column in self.id_columns:
+            yield column
+        for column in self.columns:
+            yield column
+
+    def append_line(self, flattened_dict):
+        self._lines.append(flattened_dict)
+
+
+class ListSheetStorage(MemorySheetStorage):
+    def create_sheet(self, name):
+        return ListSheet(name=name)
+
+
+def make_data(columns, rows):
+    return {
+        "main": [
+            {"field{}".format(column): num for column in range(columns)}
+            for num in range(rows)
+        ]
+    }
+
+
+def run(sheet_storage_class, data):
+    flattentool.json_input.MemorySheetStorage = sheet_storage_class
+    try:
+        start = time.perf_counter()
+        parser = JSONParser(root_json_dict=data, root_list_path="main")
+        parser.parse()
+        elapsed = time.perf_counter() - start
+    finally:
+        flattentool.json_input.MemorySheetStorage = MemorySheetStorage
+    return elapsed, list(parser.main_sheet)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--columns", type=int, default=5000)
+    parser.add_argument("--rows", type=int, default=20)
+    args = parser.parse_args()
+    data = make_data(args.columns, args.rows)
+    list_time, list_columns = run(ListSheetStorage, data)
+    dict_time, dict_columns = run(MemorySheetStorage, data)
+    assert list_columns == dict_columns
+    print("list columns: {:.2f}s".format(list_time))
+    print("dict columns: {:.2f}s".format(dict_time))
+    print("speedup: {:.2f}x".format(list_time / dict_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -15,11 +15,13 @@
 # Thanks to grt for the fixes
 # https://github.com/marcoconti83/read-ods-with-odfpy
 
+import pickle
+import tempfile
+import zipfile
 from collections import OrderedDict
 from datetime import datetime
 
-import odf.opendocument
-from odf.table import Table, TableCell, TableRow
+from lxml import etree
 
 # Backport for datetime.fromisoformat, which is new in Python 3.7
 try:
@@ -30,89 +32,242 @@ except AttributeError:
     backports.datetime_fromisoformat.MonkeyPatch.patch_fromisoformat()
 
 
-# http://stackoverflow.com/a/4544699/1846474
-class GrowingList(list):
-    def __setitem__(self, index, value):
-        if index >= len(self):
-            self.extend([None] * (index + 1 - len(self)))
-        list.__setitem__(self, index, value)
+OFFICENS = "urn:oasis:names:tc:opendocument:xmlns:office:1.0"
+TABLENS = "urn:oasis:names:tc:opendocument:xmlns:table:1.0"
+
+TABLE = "{%s}table" % TABLENS
+TABLE_ROW = "{%s}table-row" % TABLENS
+TABLE_CELL = "{%s}table-cell" % TABLENS
+
+TABLE_NAME = "{%s}name" % TABLENS
+NUMBER_ROWS_REPEATED = "{%s}number-rows-repeated" % TABLENS
+NUMBER_COLUMNS_REPEATED = "{%s}number-columns-repeated" % TABLENS
+NUMBER_COLUMNS_SPANNED = "{%s}number-columns-spanned" % TABLENS
+VALUE_TYPE = "{%s}value-type" % OFFICENS
+VALUE = "{%s}value" % OFFICENS
+DATE_VALUE = "{%s}date-value" % OFFICENS
+
+# The number of rows at the start of each sheet that are kept in memory,
+# which is enough for the configuration and heading rows of most sheets.
+LEADING_ROWS = 2
+
+
+def expand_cells(cells):
+    """
+    Return the list of values for a row stored as (value, repeat) runs.
+
+    """
+    return [value for value, repeat in cells for _ in range(repeat)]
+
+
+class ODSSheet:
+    """
+    A sheet in an ODS file. Iterating over it reads its rows back from the
+    temporary file that the ODSReader wrote them to, one run of repeated rows
+    at a time, and expands each run as it's reached.
+
+    """
+
+    def __init__(self, reader, name, offset, record_count, row_count, leading_rows):
+        self.reader = reader
+        self.name = name
+        self.offset = offset
+        self.record_count = record_count
+        self.row_count = row_count
+        self.leading_rows = leading_rows
+
+    def __iter__(self):
+        for cells, repeat in self.reader.iter_row_records(
+            self.offset, self.record_count
+        ):
+            row = expand_cells(cells)
+            for _ in range(repeat):
+                yield list(row)
+
+    def get_row(self, index):
+        """
+        Return the row with the given (0-indexed) number, raising IndexError
+        if the sheet has fewer rows.
+
+        """
+        if index < len(self.leading_rows):
+            return self.leading_rows[index]
+        if index >= self.row_count:
+            raise IndexError(index)
+        end = 0
+        for cells, repeat in self.reader.iter_row_records(
+            self.offset, self.record_count
+        ):
+            end += repeat
+            if index < end:
+                return expand_cells(cells)
 
 
 class ODSReader:
+    """
+    Reads the sheets of an ODS file, by stream-parsing content.xml, rather
+    than loading the whole document into memory.
+
+    content.xml is only parsed once. The sheets are one after another in it,
+    but ODSInput reads them in a different order (the first rows of every
+    sheet for its configuration, then sub sheets alongside the main sheet),
+    so all of them are read when the reader is created, rather than as each
+    sheet is iterated over. The rows of every sheet are written to a temporary
+    file as they are read, so only one row at a time is kept in memory, and
+    read back from there when iterating over each sheet, so the sheets can be
+    read in any order, or at the same time.
 
-    # loads the file
+    Each run of repeated rows is written once, as a (cells, repeat) record,
+    with the cells of the row as (value, repeat) runs of repeated cells. They
+    are only expanded when the rows are read. Empty rows and cells at the end
+    of a sheet or row are dropped.
+
+    """
+
+    # reads the rows of every sheet into a temporary file
     def __init__(self, file, clonespannedcolumns=None):
+        self.file = file
         self.clonespannedcolumns = clonespannedcolumns
-        self.doc = odf.opendocument.load(file)
         self.SHEETS = OrderedDict()
-        for sheet in self.doc.spreadsheet.getElementsByType(Table):
-            self.readSheet(sheet)
-
-    # reads a sheet in the sheet dictionary, storing each sheet as an
-    # array (rows) of arrays (columns)
-    def readSheet(self, sheet):
-        name = sheet.getAttribute("name")
-        rows = sheet.getElementsByType(TableRow)
-        arrRows = []
-
-        # for each row
-        for row in rows:
-            row_comment = ""  # noqa
-            arrCells = GrowingList()
-            cells = row.getElementsByType(TableCell)
-
-            # for each cell
-            count = 0
-            for cell in cells:
-                # repeated value?
-                repeat = cell.getAttribute("numbercolumnsrepeated")
-                if not repeat:
-                    repeat = 1
-                    spanned = int(cell.getAttribute("numbercolumnsspanned") or 0)
-                    # clone spanned cells
-                    if self.clonespannedcolumns is not None and spanned > 1:
-                        repeat = spanned
-
-                for rr in range(int(repeat)):  # repeated?
-                    if str(cell):
-                        value_type = cell.attributes.get(
-                            (
-                                "urn:oasis:names:tc:opendocument:xmlns:office:1.0",
-                                "value-type",
-                            )
+        self.rows_file = tempfile.TemporaryFile()
+        try:
+            events = self.iterparse()
+            for event, element in events:
+                if event == "start" and element.tag == TABLE:
+                    name = element.get(TABLE_NAME)
+                    offset = self.rows_file.tell()
+                    leading_rows = []
+                    record_count = 0
+                    row_count = 0
+                    for cells, repeat in self.iter_table_rows(events):
+                        pickle.dump(
+                            (cells, repeat), self.rows_file, pickle.HIGHEST_PROTOCOL
                         )
-                        if value_type == "float":
-                            value = cell.attributes.get(
-                                (
-                                    "urn:oasis:names:tc:opendocument:xmlns:office:1.0",
-                                    "value",
-                                )
-                            )
-                            if "." in str(value):
-                                arrCells[count] = float(value)
-                            else:
-                                arrCells[count] = int(value)
-                        elif value_type == "date":
-                            date_value = cell.attributes.get(
-                                (
-                                    "urn:oasis:names:tc:opendocument:xmlns:office:1.0",
-                                    "date-value",
-                                )
-                            )
-                            # fromisoformat assumes microseconds appear as 3 or
-                            # 6 digits, whereas ods drops trailing 0s, so can
-                            # have 1-6 digits, so pad some extra 0s
-                            if "." in date_value:
-                                date_value = date_value.ljust(26, "0")
-                            arrCells[count] = datetime.fromisoformat(date_value)
-                        else:
-                            arrCells[count] = str(cell)
-                    count += 1
-
-            arrRows.append(arrCells)
-
-        self.SHEETS[name] = arrRows
+                        if len(leading_rows) < LEADING_ROWS:
+                            row = expand_cells(cells)
+                            for _ in range(min(repeat, LEADING_ROWS - row_count)):
+                                leading_rows.append(list(row))
+                        record_count += 1
+                        row_count += repeat
+                    self.SHEETS[name] = ODSSheet(
+                        self, name, offset, record_count, row_count, leading_rows
+                    )
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        """
+        Close (and so delete) the temporary file of rows.
+
+        """
+        self.rows_file.close()
+
+    def iterparse(self):
+        """
+        Yield the iterparse events for tables and rows in content.xml, freeing
+        each row once it has been handled.
+
+        """
+        with zipfile.ZipFile(self.file) as zip_file:
+            with zip_file.open("content.xml") as content:
+                for event, element in etree.iterparse(
+                    content,
+                    events=("start", "end"),
+                    tag=(TABLE, TABLE_ROW),
+                    resolve_entities=False,
+                    huge_tree=True,
+                ):
+                    yield event, element
+                    if event == "end":
+                        element.clear()
+                        while element.getprevious() is not None:
+                            del element.getparent()[0]
+
+    def iter_table_rows(self, events):
+        """
+        Yield the rows of the table whose start event has just been read from
+        events, as (cells, repeat) tuples for each run of repeated rows,
+        consuming events up to the end of the table.
+
+        """
+        empty_rows = 0
+        for event, element in events:
+            if element.tag == TABLE:
+                # Empty rows at the end of the table are dropped
+                return
+            if event != "end":
+                continue
+            repeat = int(element.get(NUMBER_ROWS_REPEATED) or 1)
+            cells = self.read_row(element)
+            if not cells:
+                # Count the empty rows, rather than yielding them, as the
+                # last row of a sheet is often repeated a million times.
+                empty_rows += repeat
+                continue
+            if empty_rows:
+                yield [], empty_rows
+                empty_rows = 0
+            yield cells, repeat
+
+    def read_row(self, row):
+        """
+        Return the values in a table-row element as a list of (value, repeat)
+        runs, with None for empty cells.
+
+        """
+        cells = []
+        length = 0
+        count = 0
+        for cell in row.iter(TABLE_CELL):
+            # repeated value?
+            repeat = cell.get(NUMBER_COLUMNS_REPEATED)
+            if not repeat:
+                repeat = 1
+                spanned = int(cell.get(NUMBER_COLUMNS_SPANNED) or 0)
+                # clone spanned cells
+                if self.clonespannedcolumns is not None and spanned > 1:
+                    repeat = spanned
+            repeat = int(repeat)
+
+            text = "".join(cell.itertext())
+            if text:
+                if length < count:
+                    cells.append((None, count - length))
+                cells.append((self.read_value(cell, text), repeat))
+                length = count + repeat
+            count += repeat
+        return cells
+
+    def read_value(self, cell, text):
+        value_type = cell.get(VALUE_TYPE)
+        if value_type == "float":
+            value = cell.get(VALUE)
+            if "." in str(value):
+                return float(value)
+            else:
+                return int(value)
+        elif value_type == "date":
+            date_value = cell.get(DATE_VALUE)
+            # fromisoformat assumes microseconds appear as 3 or
+            # 6 digits, whereas ods drops trailing 0s, so can
+            # have 1-6 digits, so pad some extra 0s
+            if "." in date_value:
+                date_value = date_value.ljust(26, "0")
+            return datetime.fromisoformat(date_value)
+        else:
+            return text
+
+    # yields the (cells, repeat) records of a sheet, from the temporary file
+    def iter_row_records(self, offset, record_count):
+        position = offset
+        for _ in range(record_count):
+            # Other sheets may have been read from the file in between records
+            self.rows_file.seek(position)
+            record = pickle.load(self.rows_file)
+            position = self.rows_file.tell()
+            yield record
 
     # returns a sheet as an array (rows) of arrays (columns)
     def getSheet(self, name):
-        return self.SHEETS[name]
+        return list(self.SHEETS[name])
@@ -1,7 +1,9 @@
 import codecs
 import datetime
+import itertools
 import json
 import sys
+import uuid
 from collections import OrderedDict
 from decimal import Decimal
 
@@ -10,9 +12,14 @@ from flattentool.input import FORMATS as INPUT_FORMATS
 from flattentool.json_input import JSONParser
 from flattentool.lib import parse_sheet_configuration
 from flattentool.output import FORMATS as OUTPUT_FORMATS
-from flattentool.output import FORMATS_SUFFIX, LINE_TERMINATORS
+from flattentool.output import (
+    FORMATS_SUFFIX,
+    LINE_TERMINATORS,
+    MultipleSpreadsheetOutput,
+)
 from flattentool.schema import SchemaParser
-from flattentool.xml_output import toxml
+from flattentool.sheet import SHEET_STORAGES
+from flattentool.xml_output import write_xml
 
 
 def create_template(
@@ -28,6 +35,7 @@ def create_template(
     no_deprecated_fields=False,
     line_terminator="CRLF",
     convert_wkt=False,
+    schema_cache_dir=None,
     **_,
 ):
     """
@@ -35,6 +43,9 @@ def create_template(
     This function is built to deal with commandline input and arguments
     but to also be called from elsewhere in future
 
+    If ``schema_cache_dir`` is given, the parsed schema is cached in that
+    directory.
+
     """
 
     if line_terminator not in LINE_TERMINATORS.keys():
@@ -51,30 +62,35 @@ def create_template(
         truncation_length=truncation_length,
         exclude_deprecated_fields=no_deprecated_fields,
         convert_flags=convert_flags,
+        cache_dir=schema_cache_dir,
     )
     parser.parse()
 
     def spreadsheet_output(spreadsheet_output_class, name):
-        spreadsheet_output = spreadsheet_output_class(
+        return spreadsheet_output_class(
             parser=parser,
             main_sheet_name=main_sheet_name,
             output_name=name,
             line_terminator=LINE_TERMINATORS[line_terminator],
         )
-        spreadsheet_output.write_sheets()
 
     if output_format == "all":
         if not output_name:
             output_name = "template"
-        for format_name, spreadsheet_output_class in OUTPUT_FORMATS.items():
-            spreadsheet_output(
-                spreadsheet_output_class, output_name + FORMATS_SUFFIX[format_name]
-            )
+        # Write all the formats in one pass over the lines of each sheet
+        MultipleSpreadsheetOutput(
+            [
+                spreadsheet_output(
+                    spreadsheet_output_class, output_name + FORMATS_SUFFIX[format_name]
+                )
+                for format_name, spreadsheet_output_class in OUTPUT_FORMATS.items()
+            ]
+        ).write_sheets()
 
     elif output_format in OUTPUT_FORMATS.keys():  # in dictionary of allowed formats
         if not output_name:
             output_name = "template" + FORMATS_SUFFIX[output_format]
-        spreadsheet_output(OUTPUT_FORMATS[output_format], output_name)
+        spreadsheet_output(OUTPUT_FORMATS[output_format], output_name).write_sheets()
 
     else:
         raise FlattenToolError("The requested format is not available")
@@ -102,11 +118,28 @@ def flatten(
     truncation_length=3,
     line_terminator="CRLF",
     convert_wkt=False,
+    workers=1,
+    sheet_storage="spill",
+    schema_cache_dir=None,
+    json_lines=False,
     **_,
 ):
     """
     Flatten a nested structure (JSON) to a flat structure (spreadsheet - csv or xlsx).
 
+    If ``json_lines`` is True, the input is read as JSON Lines, with one top
+    level object on each line (and ``root_list_path`` is ignored). It may be
+    compressed with gzip, if its name ends with ".gz".
+
+    If ``workers`` is more than 1, the top level objects are flattened in
+    chunks by a pool of that many processes. The output is the same.
+
+    ``sheet_storage`` chooses where the flattened rows are kept until they
+    are written out: "spill" (temporary files) or "zodb" (a ZODB database).
+
+    If ``schema_cache_dir`` is given, the parsed schema is cached in that
+    directory.
+
     """
 
     if (filter_field is None and filter_value is not None) or (
@@ -117,6 +150,12 @@ def flatten(
     if line_terminator not in LINE_TERMINATORS.keys():
         raise FlattenToolError(f"{line_terminator} is not a valid line terminator")
 
+    if sheet_storage not in SHEET_STORAGES:
+        raise FlattenToolError(f"{sheet_storage} is not a valid sheet storage")
+
+    if json_lines and xml:
+        raise FlattenToolError("Not allowed to use json_lines with xml")
+
     convert_flags = {"wkt": convert_wkt}
 
     if schema:
@@ -128,15 +167,16 @@ def flatten(
             disable_local_refs=disable_local_refs,
             truncation_length=truncation_length,
             convert_flags=convert_flags,
+            cache_dir=schema_cache_dir,
         )
         schema_parser.parse()
     else:
         schema_parser = None
 
-    # context manager to clean up ZODB database when it exits
+    # context manager to clean up the sheet storage when it exits
     with JSONParser(
         json_filename=input_name,
-        root_list_path=None if root_is_list else root_list_path,
+        root_list_path=None if root_is_list or json_lines else root_list_path,
         schema_parser=schema_parser,
         rollup=rollup,
         root_id=root_id,
@@ -149,62 +189,147 @@ def flatten(
         remove_empty_schema_columns=remove_empty_schema_columns,
         truncation_length=truncation_length,
         persist=True,
+        sheet_storage=sheet_storage,
         convert_flags=convert_flags,
+        workers=workers,
+        json_lines=json_lines,
     ) as parser:
 
         def spreadsheet_output(spreadsheet_output_class, name):
-            spreadsheet_output = spreadsheet_output_class(
+            return spreadsheet_output_class(
                 parser=parser,
                 main_sheet_name=main_sheet_name,
                 output_name=name,
                 sheet_prefix=sheet_prefix,
                 line_terminator=LINE_TERMINATORS[line_terminator],
             )
-            spreadsheet_output.write_sheets()
 
         if output_format == "all":
             if not output_name:
                 output_name = "flattened"
-            for format_name, spreadsheet_output_class in OUTPUT_FORMATS.items():
-                spreadsheet_output(
-                    spreadsheet_output_class, output_name + FORMATS_SUFFIX[format_name]
-                )
+            # Write all the formats in one pass over the lines of each sheet
+            MultipleSpreadsheetOutput(
+                [
+                    spreadsheet_output(
+                        spreadsheet_output_class,
+                        output_name + FORMATS_SUFFIX[format_name],
+                    )
+                    for format_name, spreadsheet_output_class in OUTPUT_FORMATS.items()
+                ]
+            ).write_sheets()
 
         elif output_format in OUTPUT_FORMATS.keys():  # in dictionary of allowed formats
             if not output_name:
                 output_name = "flattened" + FORMATS_SUFFIX[output_format]
-            spreadsheet_output(OUTPUT_FORMATS[output_format], output_name)
+            spreadsheet_output(
+                OUTPUT_FORMATS[output_format], output_name
+            ).write_sheets()
 
         else:
             raise FlattenToolError("The requested format is not available")
 
 
-# From http://bugs.python.org/issue16535
-class NumberStr(float):
-    def __init__(self, o):
-        # We don't call the parent here, since we're deliberately altering it's functionality
-        # pylint: disable=W0231
-        self.o = o
-
-    def __repr__(self):
-        return str(self.o)
-
-    # This is needed for this trick to work in python 3.4
-    def __float__(self):
-        return self
-
-
 def decimal_datetime_default(o):
     if isinstance(o, Decimal):
         if int(o) == o:
             return int(o)
         else:
-            return NumberStr(o)
+            return float(o)
     if isinstance(o, datetime.datetime):
         return str(o)
     raise TypeError(repr(o) + " is not JSON serializable")
 
 
+def dumps_json(o, compact=False):
+    """
+    Serialise ``o`` as JSON, in the format that unflatten writes: indented by
+    4 spaces, or with no whitespace at all if ``compact`` is True.
+    """
+    if compact:
+        return json.dumps(
+            o,
+            separators=(",", ":"),
+            default=decimal_datetime_default,
+            ensure_ascii=False,
+        )
+    return json.dumps(o, indent=4, default=decimal_datetime_default, ensure_ascii=False)
+
+
+def write_json_root_list(
+    fp, base, root_list_path, root_list, json_lines=False, compact=False
+):
+    """
+    Write ``base`` to ``fp`` as JSON, with the objects from the ``root_list``
+    iterable written one at a time as the value of ``root_list_path``. If
+    ``base`` is None, the root list is the whole document.
+
+    The output is the same as dumps_json, or one object per line if
+    ``json_lines`` is True.
+    """
+    if json_lines:
+        for item in root_list:
+            if compact:
+                fp.write(dumps_json(item, compact=True))
+            else:
+                fp.write(
+                    json.dumps(
+                        item, default=decimal_datetime_default, ensure_ascii=False
+                    )
+                )
+            fp.write("\n")
+        return
+
+    if base is None:
+        before, after = "", ""
+        indent = ""
+    else:
+        # Serialise everything else in base, and split it where the root
+        # list should go.
+        placeholder = "flattentool-" + str(uuid.uuid4())
+        base[root_list_path] = placeholder
+        before, after = dumps_json(base, compact).split(json.dumps(placeholder), 1)
+        indent = " " * 4
+
+    fp.write(before)
+    if compact:
+        fp.write("[")
+        for num, item in enumerate(root_list):
+            if num:
+                fp.write(",")
+            fp.write(dumps_json(item, compact=True))
+        fp.write("]")
+    else:
+        item_indent = indent + " " * 4
+        empty = True
+        for item in root_list:
+            fp.write("[\n" if empty else ",\n")
+            fp.write(item_indent)
+            fp.write(dumps_json(item).replace("\n", "\n" + item_indent))
+            empty = False
+        fp.write("[]" if empty else "\n" + indent + "]")
+    fp.write(after)
+
+
+def write_json_object(fp, items):
+    """
+    Write the (key, value) pairs from the ``items`` iterable to ``fp`` as a
+    JSON object, one at a time. The output is the same as json.dump with
+    indent=4.
+    """
+    empty = True
+    for key, value in items:
+        fp.write("{\n    " if empty else ",\n    ")
+        fp.write(json.dumps(key, ensure_ascii=False))
+        fp.write(": ")
+        fp.write(
+            json.dumps(
+                value, indent=4, default=decimal_datetime_default, ensure_ascii=False
+            ).replace("\n", "\n    ")
+        )
+        empty = False
+    fp.write("{}" if empty else "\n}")
+
+
 def unflatten(
     input_name,
     base_json=None,
@@ -232,11 +357,33 @@ def unflatten(
     xml_comment=None,
     truncation_length=3,
     convert_wkt=False,
+    streaming=False,
+    json_lines=False,
+    external_sort=False,
+    compact=False,
+    schema_cache_dir=None,
     **_,
 ):
     """
     Unflatten a flat structure (spreadsheet - csv or xlsx) into a nested structure (JSON).
 
+    If ``streaming`` is True, each root object is unflattened and written out
+    as soon as all of its rows have been read. This requires a ``root_id``,
+    and the rows in every sheet to be grouped by root id, in the same order.
+
+    If ``external_sort`` is True, the rows of every sheet are first sorted by
+    root id in temporary files, and then each root object is written out as
+    with ``streaming``, so the rows don't need to be grouped by root id.
+
+    If ``json_lines`` is True, each root object is written on its own line,
+    rather than in a single JSON document.
+
+    If ``compact`` is True, the JSON is written without any whitespace,
+    rather than indented.
+
+    If ``schema_cache_dir`` is given, the parsed schemas, and the order of
+    elements worked out from ``xml_schemas``, are cached in that directory.
+
     """
 
     if input_format is None:
@@ -247,6 +394,16 @@ def unflatten(
         raise FlattenToolError("The requested format is not available")
     if metatab_name and base_json:
         raise FlattenToolError("Not allowed to use base_json with metatab")
+    if json_lines and (xml or base_json or metatab_name):
+        raise FlattenToolError(
+            "Not allowed to use json_lines with xml, base_json or metatab"
+        )
+    if external_sort:
+        streaming = True
+    if streaming and not root_id:
+        raise FlattenToolError("You must specify a root_id to use streaming")
+    if streaming and (cell_source_map or heading_source_map):
+        raise FlattenToolError("Not allowed to use streaming with source maps")
 
     convert_flags = {"wkt": convert_wkt}
 
@@ -264,6 +421,9 @@ def unflatten(
 
     cell_source_map_data = OrderedDict()
     heading_source_map_data = OrderedDict()
+    # The source maps for the main sheets are only worked out as they are written
+    cell_source_map_items_main = None
+    heading_source_map_data_main = None
 
     if metatab_name and not root_is_list:
         spreadsheet_input_class = INPUT_FORMATS[input_format]
@@ -284,19 +444,23 @@ def unflatten(
                 schema_filename=metatab_schema,
                 disable_local_refs=disable_local_refs,
                 convert_flags=convert_flags,
+                cache_dir=schema_cache_dir,
             )
             parser.parse()
             spreadsheet_input.parser = parser
         spreadsheet_input.encoding = encoding
         spreadsheet_input.read_sheets()
-        (
-            result,
-            cell_source_map_data_meta,
-            heading_source_map_data_meta,
-        ) = spreadsheet_input.fancy_unflatten(
-            with_cell_source_map=cell_source_map,
-            with_heading_source_map=heading_source_map,
-        )
+        try:
+            (
+                result,
+                cell_source_map_data_meta,
+                heading_source_map_data_meta,
+            ) = spreadsheet_input.fancy_unflatten(
+                with_cell_source_map=cell_source_map,
+                with_heading_source_map=heading_source_map,
+            )
+        finally:
+            spreadsheet_input.close()
         for key, value in (cell_source_map_data_meta or {}).items():
             ## strip off meta/0/ from start of source map as actually data is at top level
             cell_source_map_data[key[7:]] = value
@@ -341,66 +505,90 @@ def unflatten(
                 disable_local_refs=disable_local_refs,
                 truncation_length=truncation_length,
                 convert_flags=convert_flags,
+                cache_dir=schema_cache_dir,
             )
             parser.parse()
             spreadsheet_input.parser = parser
         spreadsheet_input.encoding = encoding
         spreadsheet_input.read_sheets()
-        (
-            result,
-            cell_source_map_data_main,
-            heading_source_map_data_main,
-        ) = spreadsheet_input.fancy_unflatten(
-            with_cell_source_map=cell_source_map,
-            with_heading_source_map=heading_source_map,
-        )
-        cell_source_map_data.update(cell_source_map_data_main or {})
-        heading_source_map_data.update(heading_source_map_data_main or {})
-        if root_is_list:
-            base = list(result)
+        if streaming:
+            # This closes the input once every root object has been read
+            result = spreadsheet_input.stream_unflatten(external_sort=external_sort)
         else:
-            base[root_list_path] = list(result)
+            try:
+                (
+                    result,
+                    cell_source_map_items_main,
+                    heading_source_map_data_main,
+                ) = spreadsheet_input.fancy_unflatten(
+                    with_cell_source_map=cell_source_map,
+                    with_heading_source_map=heading_source_map,
+                    stream_source_maps=True,
+                    stream_result=True,
+                )
+            finally:
+                spreadsheet_input.close()
+    else:
+        result = None
 
     if xml:
+        if result is not None:
+            if root_is_list:
+                base = list(result)
+            else:
+                # Each root object is written as it is unflattened
+                base[root_list_path] = result
         xml_root_tag = base_configuration.get("XMLRootTag", "iati-activities")
-        xml_output = toxml(
-            base,
-            xml_root_tag,
-            xml_schemas=xml_schemas,
-            root_list_path=root_list_path,
-            xml_comment=xml_comment,
-        )
+
+        def write_xml_output(fp):
+            write_xml(
+                fp,
+                base,
+                xml_root_tag,
+                xml_schemas=xml_schemas,
+                root_list_path=root_list_path,
+                xml_comment=xml_comment,
+                schema_cache_dir=schema_cache_dir,
+            )
+
         if output_name is None:
-            sys.stdout.buffer.write(xml_output)
+            write_xml_output(sys.stdout.buffer)
         else:
             with codecs.open(output_name, "wb") as fp:
-                fp.write(xml_output)
+                write_xml_output(fp)
     else:
-        if output_name is None:
-            print(
-                json.dumps(
-                    base, indent=4, default=decimal_datetime_default, ensure_ascii=False
+
+        def write_json(fp):
+            if result is None:
+                fp.write(dumps_json(base, compact))
+            else:
+                # Write each root object as it is unflattened
+                write_json_root_list(
+                    fp,
+                    base,
+                    root_list_path,
+                    result,
+                    json_lines=json_lines,
+                    compact=compact,
                 )
-            )
+
+        if output_name is None:
+            write_json(sys.stdout)
+            if not json_lines:
+                sys.stdout.write("\n")
         else:
             with codecs.open(output_name, "w", encoding="utf-8") as fp:
-                json.dump(
-                    base,
-                    fp,
-                    indent=4,
-                    default=decimal_datetime_default,
-                    ensure_ascii=False,
-                )
+                write_json(fp)
     if cell_source_map:
         with codecs.open(cell_source_map, "w", encoding="utf-8") as fp:
-            json.dump(
-                cell_source_map_data,
+            write_json_object(
                 fp,
-                indent=4,
-                default=decimal_datetime_default,
-                ensure_ascii=False,
+                itertools.chain(
+                    cell_source_map_data.items(), cell_source_map_items_main or []
+                ),
             )
     if heading_source_map:
+        heading_source_map_data.update(heading_source_map_data_main or {})
         with codecs.open(heading_source_map, "w", encoding="utf-8") as fp:
             json.dump(
                 heading_source_map_data,
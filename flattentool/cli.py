@@ -8,6 +8,7 @@ from flattentool import create_template, flatten, unflatten
 from flattentool.input import FORMATS as INPUT_FORMATS
 from flattentool.json_input import BadlyFormedJSONError
 from flattentool.output import FORMATS as OUTPUT_FORMATS
+from flattentool.sheet import SHEET_STORAGES
 
 """
 This file does most of the work of the flatten-tool commandline command.
@@ -105,6 +106,10 @@ def create_parser():
         action="store_true",
         help="Enable conversion of WKT to geojson",
     )
+    parser_create_template.add_argument(
+        "--schema-cache-dir",
+        help="Directory to cache the parsed schema in, so that it is only parsed once.",
+    )
 
     parser_flatten = subparsers.add_parser("flatten", help="Flatten a JSON file")
     parser_flatten.add_argument("input_name", help="Name of the input JSON file.")
@@ -195,6 +200,25 @@ def create_parser():
         action="store_true",
         help="Enable conversion of geojson to WKT",
     )
+    parser_flatten.add_argument(
+        "--workers",
+        type=int,
+        help="Number of processes to use to flatten the input. Defaults to 1.",
+    )
+    parser_flatten.add_argument(
+        "--sheet-storage",
+        choices=sorted(SHEET_STORAGES),
+        help="Where to store flattened rows before they are written out. Defaults to spill (temporary files), or use zodb for a ZODB database.",
+    )
+    parser_flatten.add_argument(
+        "--schema-cache-dir",
+        help="Directory to cache the parsed schema in, so that it is only parsed once.",
+    )
+    parser_flatten.add_argument(
+        "--json-lines",
+        action="store_true",
+        help="Read the input as JSON Lines, with one top level object on each line. --root-list-path will be ignored. The input can be compressed with gzip, if its name ends with .gz.",
+    )
     parser_unflatten = subparsers.add_parser(
         "unflatten", help="Unflatten a spreadsheet"
     )
@@ -309,6 +333,30 @@ def create_parser():
         action="store_true",
         help="Enable conversion of WKT to geojson",
     )
+    parser_unflatten.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Unflatten and write out one root object at a time, to use less memory. Requires --root-id, and the rows in every sheet must be grouped by root id, in the same order.",
+    )
+    parser_unflatten.add_argument(
+        "--external-sort",
+        action="store_true",
+        help="Sort the rows of every sheet by root id in temporary files, then unflatten and write out one root object at a time. Use this instead of --streaming if the rows are not grouped by root id. Requires --root-id.",
+    )
+    parser_unflatten.add_argument(
+        "--json-lines",
+        action="store_true",
+        help="Write each root object on its own line (JSON Lines), rather than as a single JSON document.",
+    )
+    parser_unflatten.add_argument(
+        "--compact",
+        action="store_true",
+        help="Write the JSON without any whitespace, rather than indented.",
+    )
+    parser_unflatten.add_argument(
+        "--schema-cache-dir",
+        help="Directory to cache parsed schemas in, including the order of elements worked out from --xml-schema, so that they are only parsed once.",
+    )
 
     return parser
 
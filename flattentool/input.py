@@ -6,9 +6,11 @@ This file has classes describing input from spreadsheets.
 from __future__ import print_function, unicode_literals
 
 import datetime
+import heapq
+import itertools
+import operator
 import os
 from collections import OrderedDict, UserDict
-from csv import DictReader
 from csv import reader as csvreader
 from decimal import Decimal, InvalidOperation
 from warnings import warn
@@ -35,6 +37,7 @@ from flattentool.exceptions import (
 from flattentool.i18n import _
 from flattentool.lib import isint, parse_sheet_configuration
 from flattentool.ODSReader import ODSReader
+from flattentool.sheet import SpillSheetStorage
 
 try:
     from zipfile import BadZipFile
@@ -42,6 +45,12 @@ except ImportError:
     from zipfile import BadZipfile as BadZipFile
 
 
+# The number of rows sorted in memory at a time by do_sorted_unflatten
+EXTERNAL_SORT_RUN_SIZE = 10000
+# The most sorted runs that do_sorted_unflatten reads (with a file open for
+# each) at once
+EXTERNAL_SORT_MERGE_WIDTH = 64
+
 GEO_DEPENDENCIES_MESSAGE = "Install flattentool's optional geo dependencies to use geo features, for example pip install flattentool[geo]"
 
 
@@ -52,117 +61,172 @@ class Cell:
         self.sub_cells = []
 
 
+strip_null_characters = operator.methodcaller("replace", "\0", "")
+
+
 # Avoid _csv.Error "line contains NUL" in Python < 3.11.
 class NullCharacterFilter:
     def __init__(self, file):
         self.file = file
 
     def __iter__(self):
-        return self
+        # map with a methodcaller removes the null characters without running
+        # any Python code for each line.
+        return map(strip_null_characters, self.file)
 
     def __next__(self):
         """
         Remove null characters read from the file.
         """
-        return next(self.file).replace("\0", "")
+        return strip_null_characters(next(self.file))
 
 
-def convert_type(type_string, value, timezone=pytz.timezone("UTC"), convert_flags={}):
-    if value == "" or value is None:
-        return None
-    if type_string == "number":
-        try:
-            return Decimal(value)
-        except (TypeError, ValueError, InvalidOperation):
-            warn(
-                _(
-                    'Non-numeric value "{}" found in number column, returning as string instead.'
-                ).format(value),
-                DataErrorWarning,
-            )
-            return str(value)
-    elif type_string == "integer":
-        try:
-            return int(value)
-        except (TypeError, ValueError):
-            warn(
-                _(
-                    'Non-integer value "{}" found in integer column, returning as string instead.'
-                ).format(value),
-                DataErrorWarning,
-            )
-            return str(value)
-    elif type_string == "boolean":
-        value = str(value)
-        if value.lower() in ["true", "1"]:
-            return True
-        elif value.lower() in ["false", "0"]:
-            return False
-        else:
-            warn(
-                _(
-                    'Unrecognised value for boolean: "{}", returning as string instead'
-                ).format(value),
-                DataErrorWarning,
-            )
-            return str(value)
-    elif type_string in ("array", "array_array", "string_array", "number_array"):
-        value = str(value)
-        if type_string == "number_array":
-            try:
-                if "," in value:
-                    return [
-                        [Decimal(y) for y in x.split(",")] for x in value.split(";")
-                    ]
-                else:
-                    return [Decimal(x) for x in value.split(";")]
-            except (TypeError, ValueError, InvalidOperation):
-                warn(
-                    _(
-                        'Non-numeric value "{}" found in number array column, returning as string array instead).'
-                    ).format(value),
-                    DataErrorWarning,
-                )
-        if "," in value:
-            return [x.split(",") for x in value.split(";")]
-        else:
-            return value.split(";")
-    elif type_string == "string":
-        if type(value) == datetime.datetime:
-            return timezone.localize(value).isoformat()
+def convert_number(value, timezone):
+    try:
+        return Decimal(value)
+    except (TypeError, ValueError, InvalidOperation):
+        warn(
+            _(
+                'Non-numeric value "{}" found in number column, returning as string instead.'
+            ).format(value),
+            DataErrorWarning,
+        )
         return str(value)
-    elif type_string == "date":
-        if type(value) == datetime.datetime:
-            return value.date().isoformat()
+
+
+def convert_integer(value, timezone):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        warn(
+            _(
+                'Non-integer value "{}" found in integer column, returning as string instead.'
+            ).format(value),
+            DataErrorWarning,
+        )
         return str(value)
-    elif convert_flags.get("wkt") and type_string == "geojson":
-        if SHAPELY_AND_GEOJSON_LIBRARIES_AVAILABLE:
-            try:
-                geom = shapely.wkt.loads(value)
-            except shapely.errors.GEOSException as e:
-                warn(
-                    _(
-                        'An invalid WKT string was supplied "{value}", the message from the parser was: {parser_msg}'
-                    ).format(value=value, parser_msg=str(e)),
-                    DataErrorWarning,
-                )
-                return
-            feature = geojson.Feature(geometry=geom, properties={})
-            return feature.geometry
+
+
+BOOLEAN_VALUES = {"true": True, "1": True, "false": False, "0": False}
+
+
+def convert_boolean(value, timezone):
+    value = str(value)
+    try:
+        return BOOLEAN_VALUES[value.lower()]
+    except KeyError:
+        warn(
+            _(
+                'Unrecognised value for boolean: "{}", returning as string instead'
+            ).format(value),
+            DataErrorWarning,
+        )
+        return str(value)
+
+
+def convert_array(value, timezone):
+    value = str(value)
+    if "," in value:
+        return [x.split(",") for x in value.split(";")]
+    else:
+        return value.split(";")
+
+
+def convert_number_array(value, timezone):
+    value = str(value)
+    try:
+        if "," in value:
+            return [[Decimal(y) for y in x.split(",")] for x in value.split(";")]
         else:
+            return [Decimal(x) for x in value.split(";")]
+    except (TypeError, ValueError, InvalidOperation):
+        warn(
+            _(
+                'Non-numeric value "{}" found in number array column, returning as string array instead).'
+            ).format(value),
+            DataErrorWarning,
+        )
+    return convert_array(value, timezone)
+
+
+def convert_string(value, timezone):
+    if type(value) == datetime.datetime:
+        return timezone.localize(value).isoformat()
+    return str(value)
+
+
+def convert_date(value, timezone):
+    if type(value) == datetime.datetime:
+        return value.date().isoformat()
+    return str(value)
+
+
+def convert_geojson(value, timezone):
+    if SHAPELY_AND_GEOJSON_LIBRARIES_AVAILABLE:
+        try:
+            geom = shapely.wkt.loads(value)
+        except shapely.errors.GEOSException as e:
             warn(
-                GEO_DEPENDENCIES_MESSAGE,
-                FlattenToolWarning,
+                _(
+                    'An invalid WKT string was supplied "{value}", the message from the parser was: {parser_msg}'
+                ).format(value=value, parser_msg=str(e)),
+                DataErrorWarning,
             )
-            return str(value)
-    elif type_string == "":
-        if type(value) == datetime.datetime:
-            return timezone.localize(value).isoformat()
-        if type(value) == float and int(value) == value:
-            return int(value)
-        return value if type(value) in [int] else str(value)
+            return
+        feature = geojson.Feature(geometry=geom, properties={})
+        return feature.geometry
     else:
-        raise FlattenToolValueError('Unrecognised type: "{}"'.format(type_string))
+        warn(
+            GEO_DEPENDENCIES_MESSAGE,
+            FlattenToolWarning,
+        )
+        return str(value)
+
+
+def convert_untyped(value, timezone):
+    if type(value) == datetime.datetime:
+        return timezone.localize(value).isoformat()
+    if type(value) == float and int(value) == value:
+        return int(value)
+    return value if type(value) in [int] else str(value)
+
+
+CONVERTERS = {
+    "number": convert_number,
+    "integer": convert_integer,
+    "boolean": convert_boolean,
+    "array": convert_array,
+    "array_array": convert_array,
+    "string_array": convert_array,
+    "number_array": convert_number_array,
+    "string": convert_string,
+    "date": convert_date,
+    "": convert_untyped,
+}
+
+
+def get_converter(type_string, convert_flags={}):
+    """
+    Return the function used to convert a (non-blank) value of the given
+    schema type. The function takes the value and the timezone to use for
+    datetimes.
+    """
+    if convert_flags.get("wkt") and type_string == "geojson":
+        return convert_geojson
+    try:
+        return CONVERTERS[type_string]
+    except KeyError:
+
+        def unrecognised_type(value, timezone):
+            raise FlattenToolValueError('Unrecognised type: "{}"'.format(type_string))
+
+        return unrecognised_type
+
+
+def convert_type(type_string, value, timezone=pytz.timezone("UTC"), convert_flags={}):
+    if value == "" or value is None:
+        return None
+    return get_converter(type_string, convert_flags)(value, timezone)
 
 
 def warnings_for_ignored_columns(v, extra_message):
@@ -290,13 +354,17 @@ class SpreadsheetInput(object):
         """
         if self.parser:
             title_lookup = self.parser.title_lookup
+        if not title_lookup:
+            yield from dicts
+            return
+        # The keys are the headings of the sheet, so each is only looked up
+        # once, rather than for every line
+        fields = {}
         for d in dicts:
-            if title_lookup:
-                yield OrderedDict(
-                    [(title_lookup.lookup_header(k), v) for k, v in d.items()]
-                )
-            else:
-                yield d
+            for k in d:
+                if k not in fields:
+                    fields[k] = title_lookup.lookup_header(k)
+            yield OrderedDict([(fields[k], v) for k, v in d.items()])
 
     def __init__(
         self,
@@ -333,6 +401,12 @@ class SpreadsheetInput(object):
         self.use_configuration = use_configuration
         self.convert_flags = convert_flags
 
+    def close(self):
+        """
+        Close any file that is kept open to read the sheets.
+        """
+        pass
+
     def get_sub_sheets_lines(self):
         for sub_sheet_name in self.sub_sheet_names:
             if self.convert_titles:
@@ -363,251 +437,546 @@ class SpreadsheetInput(object):
     def read_sheets(self):
         raise NotImplementedError
 
-    def do_unflatten(self):
-        main_sheet_by_ocid = OrderedDict()
-        sheets = list(self.get_sub_sheets_lines())
-        for i, sheet in enumerate(sheets):
-            sheet_name, lines = sheet
-            try:
-                actual_headings = self.get_sheet_headings(sheet_name)
-                # If sheet is empty or too many lines have been skipped
-                if not actual_headings:
-                    continue
-                found = OrderedDict()
-                last_col = len(actual_headings)
-                # We want to ignore data in earlier columns, so we look
-                # through the data backwards
-                for i, actual_heading in enumerate(reversed(actual_headings)):
-                    if actual_heading is None:
-                        continue
-                    if actual_heading in found:
-                        found[actual_heading].append((last_col - i) - 1)
-                    else:
-                        found[actual_heading] = [i]
-                for actual_heading in reversed(found):
-                    if len(found[actual_heading]) > 1:
-                        keeping = found[actual_heading][0]  # noqa
-                        ignoring = found[actual_heading][1:]
-                        ignoring.reverse()
-                        if len(ignoring) >= 3:
-                            warn(
-                                (
-                                    _(
-                                        'Duplicate heading "{}" found, ignoring '
-                                        'the data in columns {} and {} (sheet: "{}").'
-                                    )
-                                ).format(
-                                    actual_heading,
-                                    ", ".join(
-                                        [
-                                            get_column_letter(x + 1)
-                                            for x in ignoring[:-1]
-                                        ]
-                                    ),
-                                    get_column_letter(ignoring[-1] + 1),
-                                    sheet_name,
-                                ),
-                                DataErrorWarning,
+    def get_checked_headings(self, sheet_name):
+        """
+        Return the headings of the given sheet, warning about any duplicates.
+
+        Returns None if the input type doesn't support getting headings.
+        """
+        try:
+            actual_headings = self.get_sheet_headings(sheet_name)
+        except NotImplementedError:
+            # The ListInput type used in the tests doesn't support getting headings.
+            return None
+        # If sheet is empty or too many lines have been skipped
+        if not actual_headings:
+            return actual_headings
+        found = OrderedDict()
+        last_col = len(actual_headings)
+        # We want to ignore data in earlier columns, so we look
+        # through the data backwards
+        for i, actual_heading in enumerate(reversed(actual_headings)):
+            if actual_heading is None:
+                continue
+            if actual_heading in found:
+                found[actual_heading].append((last_col - i) - 1)
+            else:
+                found[actual_heading] = [i]
+        for actual_heading in reversed(found):
+            if len(found[actual_heading]) > 1:
+                keeping = found[actual_heading][0]  # noqa
+                ignoring = found[actual_heading][1:]
+                ignoring.reverse()
+                if len(ignoring) >= 3:
+                    warn(
+                        (
+                            _(
+                                'Duplicate heading "{}" found, ignoring '
+                                'the data in columns {} and {} (sheet: "{}").'
                             )
-                        elif len(found[actual_heading]) == 3:
-                            warn(
-                                (
-                                    _(
-                                        'Duplicate heading "{}" found, ignoring '
-                                        'the data in columns {} and {} (sheet: "{}").'
-                                    )
-                                ).format(
-                                    actual_heading,
-                                    get_column_letter(ignoring[0] + 1),
-                                    get_column_letter(ignoring[1] + 1),
-                                    sheet_name,
-                                ),
-                                DataErrorWarning,
+                        ).format(
+                            actual_heading,
+                            ", ".join(
+                                [get_column_letter(x + 1) for x in ignoring[:-1]]
+                            ),
+                            get_column_letter(ignoring[-1] + 1),
+                            sheet_name,
+                        ),
+                        DataErrorWarning,
+                    )
+                elif len(found[actual_heading]) == 3:
+                    warn(
+                        (
+                            _(
+                                'Duplicate heading "{}" found, ignoring '
+                                'the data in columns {} and {} (sheet: "{}").'
                             )
-                        else:
-                            warn(
-                                (
-                                    _(
-                                        'Duplicate heading "{}" found, ignoring '
-                                        'the data in column {} (sheet: "{}").'
-                                    )
-                                ).format(
-                                    actual_heading,
-                                    get_column_letter(ignoring[0] + 1),
-                                    sheet_name,
-                                ),
-                                DataErrorWarning,
+                        ).format(
+                            actual_heading,
+                            get_column_letter(ignoring[0] + 1),
+                            get_column_letter(ignoring[1] + 1),
+                            sheet_name,
+                        ),
+                        DataErrorWarning,
+                    )
+                else:
+                    warn(
+                        (
+                            _(
+                                'Duplicate heading "{}" found, ignoring '
+                                'the data in column {} (sheet: "{}").'
                             )
-            except NotImplementedError:
-                # The ListInput type used in the tests doesn't support getting headings.
-                actual_headings = None
-            for j, line in enumerate(lines):
-                if all(x is None or x == "" for x in line.values()):
-                    # if all(x == '' for x in line.values()):
-                    continue
-                root_id_or_none = line.get(self.root_id) if self.root_id else None
-                cells = OrderedDict()
-                for k, header in enumerate(line):
-                    heading = actual_headings[k] if actual_headings else header
-                    if self.vertical_orientation:
-                        # This is misleading as it specifies the row number as the distance vertically
-                        # and the horizontal 'letter' as a number.
-                        # https://github.com/OpenDataServices/flatten-tool/issues/153
-                        cells[header] = Cell(
-                            line[header], (sheet_name, str(k + 1), j + 2, heading)
-                        )
-                    else:
-                        cells[header] = Cell(
-                            line[header],
-                            (sheet_name, get_column_letter(k + 1), j + 2, heading),
-                        )
-                unflattened = unflatten_main_with_parser(
-                    self.parser,
-                    cells,
-                    self.timezone,
-                    self.xml,
-                    self.id_name,
-                    self.convert_flags,
-                )
-                if root_id_or_none not in main_sheet_by_ocid:
-                    main_sheet_by_ocid[root_id_or_none] = TemporaryDict(
-                        self.id_name, xml=self.xml
+                        ).format(
+                            actual_heading,
+                            get_column_letter(ignoring[0] + 1),
+                            sheet_name,
+                        ),
+                        DataErrorWarning,
                     )
+        return actual_headings
 
-                def inthere(unflattened, id_name):
-                    if self.xml and not isinstance(unflattened.get(self.id_name), Cell):
-                        # For an XML tag
-                        return unflattened[id_name]["text()"].cell_value
-                    else:
-                        # For a JSON, or an XML attribute
-                        return unflattened[id_name].cell_value
+    def get_sheets_with_lines(self):
+        """
+        Yield the name, headings and non-empty lines of each sheet that has
+        data. The lines are pairs of the line's number (counting from 0 for
+        the first line after the headings) and the line itself.
+        """
+        for sheet_name, lines in list(self.get_sub_sheets_lines()):
+            actual_headings = self.get_checked_headings(sheet_name)
+            if actual_headings is not None and not actual_headings:
+                continue
+            yield sheet_name, actual_headings, (
+                (j, line)
+                for j, line in enumerate(lines)
+                if not all(x is None or x == "" for x in line.values())
+            )
 
-                if (
-                    self.id_name in unflattened
-                    and inthere(unflattened, self.id_name)
-                    in main_sheet_by_ocid[root_id_or_none]
+    def get_root_id(self, line):
+        return line.get(self.root_id) if self.root_id else None
+
+    def unflatten_line(
+        self, main_sheet_by_ocid, sheet_name, actual_headings, j, line, path_plans
+    ):
+        """
+        Unflatten one line of a sheet, and merge it into main_sheet_by_ocid.
+
+        ``path_plans`` caches how to unflatten each column of the sheet, see
+        compile_path_plan.
+        """
+        root_id_or_none = self.get_root_id(line)
+        cells = OrderedDict()
+        for k, header in enumerate(line):
+            heading = actual_headings[k] if actual_headings else header
+            if self.vertical_orientation:
+                # This is misleading as it specifies the row number as the distance vertically
+                # and the horizontal 'letter' as a number.
+                # https://github.com/OpenDataServices/flatten-tool/issues/153
+                cells[header] = Cell(
+                    line[header], (sheet_name, str(k + 1), j + 2, heading)
+                )
+            else:
+                cells[header] = Cell(
+                    line[header],
+                    (sheet_name, get_column_letter(k + 1), j + 2, heading),
+                )
+        unflattened = unflatten_main_with_parser(
+            self.parser,
+            cells,
+            self.timezone,
+            self.xml,
+            self.id_name,
+            self.convert_flags,
+            path_plans,
+        )
+        if root_id_or_none not in main_sheet_by_ocid:
+            main_sheet_by_ocid[root_id_or_none] = TemporaryDict(
+                self.id_name, xml=self.xml
+            )
+
+        def inthere(unflattened, id_name):
+            if self.xml and not isinstance(unflattened.get(self.id_name), Cell):
+                # For an XML tag
+                return unflattened[id_name]["text()"].cell_value
+            else:
+                # For a JSON, or an XML attribute
+                return unflattened[id_name].cell_value
+
+        if (
+            self.id_name in unflattened
+            and inthere(unflattened, self.id_name)
+            in main_sheet_by_ocid[root_id_or_none]
+        ):
+            if self.xml and not isinstance(unflattened.get(self.id_name), Cell):
+                unflattened_id = unflattened.get(self.id_name)["text()"].cell_value
+            else:
+                unflattened_id = unflattened.get(self.id_name).cell_value
+            merge(
+                main_sheet_by_ocid[root_id_or_none][unflattened_id],
+                unflattened,
+                {
+                    "sheet_name": sheet_name,
+                    "root_id": self.root_id,
+                    "root_id_or_none": root_id_or_none,
+                    "id_name": self.id_name,
+                    self.id_name: unflattened_id,
+                },
+            )
+        else:
+            main_sheet_by_ocid[root_id_or_none].append(unflattened)
+
+    def unflatten_sheets(self):
+        """
+        Unflatten every line of every sheet, and return an OrderedDict of
+        root id to the list of cell trees for that root id. See
+        iter_root_cell_trees.
+        """
+        main_sheet_by_ocid = OrderedDict()
+        for sheet_name, actual_headings, lines in self.get_sheets_with_lines():
+            path_plans = {}
+            for j, line in lines:
+                self.unflatten_line(
+                    main_sheet_by_ocid, sheet_name, actual_headings, j, line, path_plans
+                )
+        temporarydicts_to_lists(main_sheet_by_ocid)
+        return main_sheet_by_ocid
+
+    def do_unflatten(self):
+        return list(iter_root_cell_trees(self.unflatten_sheets()))
+
+    def do_stream_unflatten(self):
+        """
+        Like do_unflatten, but yields the cell tree of each root object as
+        soon as all of its rows have been read, instead of building the
+        whole tree.
+
+        This requires the rows of every sheet to be grouped by root id, with
+        the groups in the same order in each sheet.
+        """
+        sheets = []
+        for sheet_name, actual_headings, lines in self.get_sheets_with_lines():
+            sheets.append([sheet_name, actual_headings, {}, lines, next(lines, None)])
+        seen_root_ids = set()
+        while True:
+            pending = [sheet for sheet in sheets if sheet[4] is not None]
+            if not pending:
+                break
+            root_id_or_none = self.get_root_id(pending[0][4][1])
+            main_sheet_by_ocid = OrderedDict()
+            for sheet in pending:
+                sheet_name, actual_headings, path_plans, lines, next_line = sheet
+                while (
+                    next_line is not None
+                    and self.get_root_id(next_line[1]) == root_id_or_none
                 ):
-                    if self.xml and not isinstance(unflattened.get(self.id_name), Cell):
-                        unflattened_id = unflattened.get(self.id_name)[
-                            "text()"
-                        ].cell_value
-                    else:
-                        unflattened_id = unflattened.get(self.id_name).cell_value
-                    merge(
-                        main_sheet_by_ocid[root_id_or_none][unflattened_id],
-                        unflattened,
-                        {
-                            "sheet_name": sheet_name,
-                            "root_id": self.root_id,
-                            "root_id_or_none": root_id_or_none,
-                            "id_name": self.id_name,
-                            self.id_name: unflattened_id,
-                        },
+                    j, line = next_line
+                    self.unflatten_line(
+                        main_sheet_by_ocid,
+                        sheet_name,
+                        actual_headings,
+                        j,
+                        line,
+                        path_plans,
                     )
-                else:
-                    main_sheet_by_ocid[root_id_or_none].append(unflattened)
-        temporarydicts_to_lists(main_sheet_by_ocid)
-        return sum(main_sheet_by_ocid.values(), [])
+                    next_line = next(lines, None)
+                sheet[4] = next_line
+            if root_id_or_none in seen_root_ids:
+                warn(
+                    _(
+                        'The rows for {} "{}" are not grouped together in every sheet, so they have been output as more than one object.'
+                    ).format(self.root_id, root_id_or_none),
+                    DataErrorWarning,
+                )
+            seen_root_ids.add(root_id_or_none)
+            temporarydicts_to_lists(main_sheet_by_ocid)
+            for cell_tree in main_sheet_by_ocid[root_id_or_none]:
+                yield cell_tree
+
+    def do_sorted_unflatten(self, run_size=None):
+        """
+        Like do_stream_unflatten, but the rows don't need to be grouped by
+        root id.
+
+        The rows of every sheet are sorted into runs of ``run_size`` rows,
+        which are written to temporary files, and then merged so that the rows
+        for each root id can be unflattened together. If there are more than
+        EXTERNAL_SORT_MERGE_WIDTH runs, they are first merged in groups into
+        longer runs. Root objects are yielded
+        in the same order as do_unflatten, and the rows are unflattened in the
+        same order with the same row numbers.
+        """
+        if run_size is None:
+            run_size = EXTERNAL_SORT_RUN_SIZE
+        storage = SpillSheetStorage()
+        try:
+            # Only the position of each root id is kept in memory, which is
+            # used to order the root objects by where they are first seen.
+            root_id_positions = {}
+            sheets = []
+            runs = []
+            run = []
+
+            def sort_key(row):
+                return row[:3]
+
+            def write_run(rows):
+                run_sheet = storage.create_sheet("run")
+                for row in rows:
+                    run_sheet.append_record(row)
+                # Only keep the file open while the run is being read
+                run_sheet.close()
+                return run_sheet
+
+            def merge_runs(run_sheets):
+                if len(run_sheets) == 1:
+                    return run_sheets[0]
+                merged_run_sheet = write_run(
+                    heapq.merge(
+                        *(run_sheet.records for run_sheet in run_sheets),
+                        key=sort_key,
+                    )
+                )
+                for run_sheet in run_sheets:
+                    os.remove(run_sheet.filename)
+                return merged_run_sheet
+
+            for sheet_name, actual_headings, lines in self.get_sheets_with_lines():
+                sheet_index = len(sheets)
+                sheets.append((sheet_name, actual_headings, {}))
+                for j, line in lines:
+                    root_id_or_none = self.get_root_id(line)
+                    if root_id_or_none not in root_id_positions:
+                        root_id_positions[root_id_or_none] = len(root_id_positions)
+                    run.append(
+                        (root_id_positions[root_id_or_none], sheet_index, j, line)
+                    )
+                    if len(run) >= run_size:
+                        run.sort(key=sort_key)
+                        runs.append(write_run(run))
+                        del run[:]
+            root_id_positions = None
+            # Merge the runs in more than one pass if there are too many to
+            # read at once
+            while len(runs) > EXTERNAL_SORT_MERGE_WIDTH - 1:
+                runs = [
+                    merge_runs(runs[i : i + EXTERNAL_SORT_MERGE_WIDTH])
+                    for i in range(0, len(runs), EXTERNAL_SORT_MERGE_WIDTH)
+                ]
+            # The last run doesn't need to be written to disk
+            run.sort(key=sort_key)
+
+            rows = heapq.merge(
+                *(run_sheet.records for run_sheet in runs), run, key=sort_key
+            )
+            for _position, root_rows in itertools.groupby(rows, key=lambda row: row[0]):
+                main_sheet_by_ocid = OrderedDict()
+                for _position, sheet_index, j, line in root_rows:
+                    sheet_name, actual_headings, path_plans = sheets[sheet_index]
+                    self.unflatten_line(
+                        main_sheet_by_ocid,
+                        sheet_name,
+                        actual_headings,
+                        j,
+                        line,
+                        path_plans,
+                    )
+                temporarydicts_to_lists(main_sheet_by_ocid)
+                yield from iter_root_cell_trees(main_sheet_by_ocid)
+        finally:
+            storage.close()
 
     def unflatten(self):
-        result = self.do_unflatten()
-        result = extract_list_to_value(result)
-        return result
+        return extract_list_to_value(iter_root_cell_trees(self.unflatten_sheets()))
 
-    def fancy_unflatten(self, with_cell_source_map, with_heading_source_map):
-        cell_tree = self.do_unflatten()
-        result = extract_list_to_value(cell_tree)
-        ordered_cell_source_map = None
-        heading_source_map = None
+    def stream_unflatten(self, external_sort=False):
+        """
+        Yield each unflattened root object in turn. See do_stream_unflatten,
+        or do_sorted_unflatten if ``external_sort`` is True. The input is
+        closed once every object has been read.
+        """
+        try:
+            if external_sort:
+                cell_trees = self.do_sorted_unflatten()
+            else:
+                cell_trees = self.do_stream_unflatten()
+            for cell_tree in cell_trees:
+                yield extract_dict_to_value(cell_tree)
+        finally:
+            # Every sheet has been read
+            self.close()
+
+    def fancy_unflatten(
+        self,
+        with_cell_source_map,
+        with_heading_source_map,
+        stream_source_maps=False,
+        stream_result=False,
+    ):
+        """
+        Unflatten, and also return the cell source map and the heading source
+        map if asked for.
+
+        If ``stream_source_maps`` is True, the cell source map is returned as
+        an iterator of its items, which is worked out as it is consumed,
+        rather than as an OrderedDict. The heading source map is then only
+        complete once the cell source map has been consumed.
+
+        If ``stream_result`` is True, the result is returned as an iterator of
+        the root objects, which are converted from their cell trees as it is
+        consumed, rather than as a list. Every sheet has still been read by
+        the time this returns. If there are no source maps, each cell tree is
+        dropped once its root object has been yielded.
+        """
+        cell_trees = iter_root_cell_trees(self.unflatten_sheets())
         if with_cell_source_map or with_heading_source_map:
-            cell_source_map = extract_list_to_error_path(
-                [] if self.root_is_list else [self.root_list_path], cell_tree
+            # The cell trees are walked again for the source maps
+            cell_trees = list(cell_trees)
+        result = iter_list_to_value(cell_trees)
+        if not stream_result:
+            result = list(result)
+        if not with_cell_source_map and not with_heading_source_map:
+            return result, None, None
+        heading_source_map = OrderedDict() if with_heading_source_map else None
+        cell_source_map_items = iter_cell_source_map(
+            [] if self.root_is_list else [self.root_list_path],
+            cell_trees,
+            heading_source_map,
+        )
+        if stream_source_maps and with_cell_source_map:
+            return (
+                result,
+                iter_unique_cell_source_map(cell_source_map_items),
+                heading_source_map,
             )
-            ordered_items = sorted(cell_source_map.items())
-            row_source_map = OrderedDict()
-            heading_source_map = OrderedDict()
-            for path, _unused in ordered_items:
-                cells = cell_source_map[path]
-                # Prepare row_source_map key
-                key = "/".join(str(x) for x in path[:-1])
-                if not key in row_source_map:
-                    row_source_map[key] = []
-                if with_heading_source_map:
-                    # Prepare header_source_map key
-                    header_path_parts = []
-                    for x in path:
-                        try:
-                            int(x)
-                        except:
-                            header_path_parts.append(x)
-                    header_path = "/".join(header_path_parts)
-                    if header_path not in heading_source_map:
-                        heading_source_map[header_path] = []
-                # Populate the row and header source maps
-                for cell in cells:
-                    sheet, col, row, header = cell
-                    if (sheet, row) not in row_source_map[key]:
-                        row_source_map[key].append((sheet, row))
-                    if with_heading_source_map:
-                        if (sheet, header) not in heading_source_map[header_path]:
-                            heading_source_map[header_path].append((sheet, header))
+        ordered_cell_source_map = None
         if with_cell_source_map:
             ordered_cell_source_map = OrderedDict(
-                ("/".join(str(x) for x in path), location)
-                for path, location in ordered_items
+                iter_unique_cell_source_map(cell_source_map_items)
             )
-            for key in row_source_map:
-                assert key not in ordered_cell_source_map, _(
-                    "Row/cell collision: {}"
-                ).format(key)
-                ordered_cell_source_map[key] = row_source_map[key]
+        else:
+            for _item in cell_source_map_items:
+                pass
         return result, ordered_cell_source_map, heading_source_map
 
 
-def extract_list_to_error_path(path, input):
-    output = {}
-    for i, item in enumerate(input):
-        res = extract_dict_to_error_path(path + [i], item)
-        for p in res:
-            assert p not in output, _("Already have key {}").format(p)
-            output[p] = res[p]
-    return output
+def iter_root_cell_trees(main_sheet_by_ocid):
+    """
+    Yield the cell tree of each root object from ``main_sheet_by_ocid``, an
+    OrderedDict of root id to a list of cell trees, in order.
 
+    Each root id is removed from ``main_sheet_by_ocid`` as its cell trees are
+    yielded, so that they can be freed once the caller has finished with them.
+    """
+    while main_sheet_by_ocid:
+        root_id_or_none, cell_trees = main_sheet_by_ocid.popitem(last=False)
+        yield from cell_trees
 
-def extract_dict_to_error_path(path, input):
-    output = {}
-    for k in input:
-        if isinstance(input[k], list):
-            res = extract_list_to_error_path(path + [k], input[k])
-            for p in res:
-                assert p not in output, _("Already have key {}").format(p)
-                output[p] = res[p]
-        elif isinstance(input[k], dict):
-            res = extract_dict_to_error_path(path + [k], input[k])
-            for p in res:
-                assert p not in output, _("Already have key {}").format(p)
-                output[p] = res[p]
-        elif isinstance(input[k], Cell):
-            p = tuple(path + [k])
-            assert p not in output, _("Already have key {}").format(p)
-            output[p] = [input[k].cell_location]
-            for sub_cell in input[k].sub_cells:
-                assert sub_cell.cell_value == input[k].cell_value, _(
+
+def iter_list_cell_locations(path, input):
+    """
+    Yield a tuple of the path and a list of locations for each cell in the
+    list of cell trees ``input``, in order of path.
+
+    ``path`` is the path to ``input``, as a list, which is added to and
+    removed from while walking the tree.
+    """
+    for i, item in enumerate(input):
+        path.append(i)
+        yield from iter_dict_cell_locations(path, item)
+        path.pop()
+
+
+def iter_dict_cell_locations(path, input):
+    # Sorting the keys means the paths come out in sorted order
+    for k in sorted(input):
+        value = input[k]
+        path.append(k)
+        if isinstance(value, list):
+            yield from iter_list_cell_locations(path, value)
+        elif isinstance(value, dict):
+            yield from iter_dict_cell_locations(path, value)
+        elif isinstance(value, Cell):
+            locations = [value.cell_location]
+            for sub_cell in value.sub_cells:
+                assert sub_cell.cell_value == value.cell_value, _(
                     "Two sub-cells have different values: {}, {}"
-                ).format(input[k].cell_value, sub_cell.cell_value)
-                output[p].append(sub_cell.cell_location)
+                ).format(value.cell_value, sub_cell.cell_value)
+                locations.append(sub_cell.cell_location)
+            yield tuple(path), locations
         else:
             raise FlattenToolError(
-                _("Unexpected result type in the JSON cell tree: {}").format(input[k])
+                _("Unexpected result type in the JSON cell tree: {}").format(value)
             )
-    return output
+        path.pop()
 
 
-def extract_list_to_value(input):
-    output = []
+def iter_cell_source_map(path, cell_trees, heading_source_map=None):
+    """
+    Yield the items of the cell source map for the list of ``cell_trees``:
+    first one for each cell, then one for each row, i.e. each object that
+    has cells.
+
+    If ``heading_source_map`` is given, the heading source map is added to it
+    as the items are yielded.
+    """
+    # Dicts with None values are used as ordered sets
+    row_source_map = OrderedDict()
+    headings = OrderedDict()
+    path_items_are_ints = {}
+
+    def is_int(path_item):
+        try:
+            return path_items_are_ints[path_item]
+        except KeyError:
+            path_items_are_ints[path_item] = isint(path_item)
+            return path_items_are_ints[path_item]
+
+    parent_path = None
+    for cell_path, locations in iter_list_cell_locations(list(path), cell_trees):
+        # The cells of an object come out together, so only work out the
+        # parts of the keys that come from the parent path when it changes
+        if cell_path[:-1] != parent_path:
+            parent_path = cell_path[:-1]
+            row_key = "/".join(str(x) for x in parent_path)
+            rows = row_source_map.get(row_key)
+            if rows is None:
+                rows = row_source_map[row_key] = OrderedDict()
+            header_path_prefix = "/".join(x for x in parent_path if not is_int(x))
+        path_item = cell_path[-1]
+        for sheet, col, row, header in locations:
+            rows[(sheet, row)] = None
+        if heading_source_map is not None:
+            if is_int(path_item):
+                header_path = header_path_prefix
+            elif header_path_prefix:
+                header_path = header_path_prefix + "/" + path_item
+            else:
+                header_path = path_item
+            sheet_headers = headings.get(header_path)
+            if sheet_headers is None:
+                sheet_headers = headings[header_path] = OrderedDict()
+                heading_source_map[header_path] = []
+            for sheet, col, row, header in locations:
+                if (sheet, header) not in sheet_headers:
+                    sheet_headers[(sheet, header)] = None
+                    heading_source_map[header_path].append((sheet, header))
+        if row_key:
+            yield row_key + "/" + str(path_item), locations
+        else:
+            yield str(path_item), locations
+    for key, rows in row_source_map.items():
+        yield key, list(rows)
+
+
+def iter_unique_cell_source_map(cell_source_map_items):
+    """
+    Yield each of the items of a cell source map, checking that no key is
+    repeated.
+    """
+    seen_keys = set()
+    for key, value in cell_source_map_items:
+        assert key not in seen_keys, _("Row/cell collision: {}").format(key)
+        seen_keys.add(key)
+        yield key, value
+
+
+def extract_list_to_error_path(path, input):
+    return OrderedDict(iter_list_cell_locations(list(path), input))
+
+
+def extract_dict_to_error_path(path, input):
+    return OrderedDict(iter_dict_cell_locations(list(path), input))
+
+
+def iter_list_to_value(input):
+    """
+    Yield the value of each cell tree in the iterable ``input`` in turn.
+    """
     for item in input:
-        output.append(extract_dict_to_value(item))
-    return output
+        yield extract_dict_to_value(item)
+
+
+def extract_list_to_value(input):
+    return list(iter_list_to_value(input))
 
 
 def extract_dict_to_value(input):
@@ -629,25 +998,36 @@ def extract_dict_to_value(input):
 class CSVInput(SpreadsheetInput):
     encoding = "utf-8"
 
-    def get_sheet_headings(self, sheet_name):
-        sheet_configuration = self.sheet_configuration[self.sheet_names_map[sheet_name]]
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sheet_headings = {}
+
+    def open_sheet(self, sheet_name):
+        return open(
+            os.path.join(self.input_name, sheet_name + ".csv"), encoding=self.encoding
+        )
+
+    def get_sheet_layout(self, sheet_configuration):
+        """
+        Return the number of the headings row, the number of header rows, and
+        whether to ignore the sheet, for a sheet with the given (parsed)
+        configuration.
+        """
         configuration_line = 1 if sheet_configuration else 0
         if not sheet_configuration:
             sheet_configuration = self.base_configuration
         if not self.use_configuration:
             sheet_configuration = {}
-        skip_rows = sheet_configuration.get("skipRows", 0)
-        if sheet_configuration.get("ignore"):
-            # returning empty headers is a proxy for no data in the sheet.
-            return []
+        return (
+            configuration_line + sheet_configuration.get("skipRows", 0),
+            sheet_configuration.get("headerRows", 1),
+            sheet_configuration.get("ignore"),
+        )
 
-        with open(
-            os.path.join(self.input_name, sheet_name + ".csv"), encoding=self.encoding
-        ) as main_sheet_file:
-            r = csvreader(NullCharacterFilter(main_sheet_file))
-            for num, row in enumerate(r):
-                if num == (skip_rows + configuration_line):
-                    return row
+    def get_sheet_headings(self, sheet_name):
+        if sheet_name not in self.sheet_headings:
+            self.get_sheet_configuration(sheet_name)
+        return self.sheet_headings[sheet_name]
 
     def read_sheets(self):
         sheet_file_names = os.listdir(self.input_name)
@@ -669,42 +1049,52 @@ class CSVInput(SpreadsheetInput):
         )
         self.configure_sheets()
 
-    def generate_rows(self, dictreader, sheet_name):
-        sheet_configuration = self.sheet_configuration[self.sheet_names_map[sheet_name]]
-        configuration_line = 1 if sheet_configuration else 0
-        if not sheet_configuration:
-            sheet_configuration = self.base_configuration
-        if not self.use_configuration:
-            sheet_configuration = {}
-
-        skip_rows = sheet_configuration.get("skipRows", 0)
-        header_rows = sheet_configuration.get("headerRows", 1)
-        for i in range(0, configuration_line + skip_rows):
-            previous_row = next(dictreader.reader)  # noqa
-        fieldnames = dictreader.fieldnames
-        for i in range(0, header_rows - 1):
-            next(dictreader.reader)
-        for line in dictreader:
-            yield OrderedDict((fieldname, line[fieldname]) for fieldname in fieldnames)
-
     def get_sheet_configuration(self, sheet_name):
-        with open(
-            os.path.join(self.input_name, sheet_name + ".csv"), encoding=self.encoding
-        ) as main_sheet_file:
-            r = csvreader(NullCharacterFilter(main_sheet_file))
+        with self.open_sheet(sheet_name) as sheet_file:
+            r = csvreader(NullCharacterFilter(sheet_file))
             heading_row = next(r)
-        if len(heading_row) > 0 and heading_row[0] == "#":
-            return heading_row[1:]
-        return []
+            if len(heading_row) > 0 and heading_row[0] == "#":
+                configuration = heading_row[1:]
+            else:
+                configuration = []
+            # Read the headings while we have the file open, so that
+            # get_sheet_headings doesn't need to read it again.
+            headings_line, _header_rows, ignore = self.get_sheet_layout(
+                parse_sheet_configuration(configuration)
+            )
+            if ignore:
+                # returning empty headers is a proxy for no data in the sheet.
+                self.sheet_headings[sheet_name] = []
+            elif headings_line == 0:
+                self.sheet_headings[sheet_name] = heading_row
+            else:
+                self.sheet_headings[sheet_name] = next(
+                    itertools.islice(r, headings_line - 1, None), None
+                )
+        return configuration
 
     def get_sheet_lines(self, sheet_name):
-        # Pass the encoding to the open function
-        with open(
-            os.path.join(self.input_name, sheet_name + ".csv"), encoding=self.encoding
-        ) as main_sheet_file:
-            dictreader = DictReader(NullCharacterFilter(main_sheet_file))
-            for row in self.generate_rows(dictreader, sheet_name):
-                yield row
+        headings_line, header_rows, _ignore = self.get_sheet_layout(
+            self.sheet_configuration[self.sheet_names_map[sheet_name]]
+        )
+        with self.open_sheet(sheet_name) as sheet_file:
+            r = csvreader(NullCharacterFilter(sheet_file))
+            for _row in itertools.islice(r, headings_line):
+                pass
+            fieldnames = next(r, None)
+            if fieldnames is None:
+                return
+            for _row in itertools.islice(r, header_rows - 1):
+                pass
+            missing = [None] * len(fieldnames)
+            for row in r:
+                # Skip blank lines, and fill in missing cells with None, like
+                # csv.DictReader
+                if not row:
+                    continue
+                if len(row) < len(fieldnames):
+                    row += missing[len(row) :]
+                yield OrderedDict(zip(fieldnames, row))
 
 
 class BadXLSXZipFile(BadZipFile, FlattenToolError):
@@ -712,28 +1102,85 @@ class BadXLSXZipFile(BadZipFile, FlattenToolError):
 
 
 class XLSXInput(SpreadsheetInput):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sheet_leading_rows = {}
+        self.sheet_widths = {}
+        self.workbook = None
+
     def read_sheets(self):
         try:
-            self.workbook = openpyxl.load_workbook(self.input_name, data_only=True)
+            # Read-only mode reads rows lazily as we iterate over them, rather
+            # than loading every cell in the workbook up front. It doesn't
+            # support reading by column, so vertical orientation falls back
+            # to loading the whole workbook.
+            self.workbook = openpyxl.load_workbook(
+                self.input_name,
+                read_only=not self.vertical_orientation,
+                data_only=True,
+            )
         except BadZipFile as e:  # noqa
             # TODO when we have python3 only add 'from e' to show exception chain
             raise BadXLSXZipFile(
                 _("The supplied file has extension .xlsx but isn't an XLSX file.")
             )
 
-        self.sheet_names_map = OrderedDict(
-            (sheet_name, sheet_name) for sheet_name in self.workbook.sheetnames
-        )
-        if self.include_sheets:
-            for sheet in list(self.sheet_names_map):
-                if sheet not in self.include_sheets:
-                    self.sheet_names_map.pop(sheet)
-        for sheet in self.exclude_sheets or []:
-            self.sheet_names_map.pop(sheet, None)
+        try:
+            if self.workbook.read_only:
+                for worksheet in self.workbook.worksheets:
+                    # Read-only worksheets only read as far as the size
+                    # recorded in the file, which can be wrong, so read every
+                    # row instead. The recorded width is still used to pad
+                    # the heading row, as it is when not in read-only mode.
+                    self.sheet_widths[worksheet.title] = worksheet.max_column or 0
+                    worksheet.reset_dimensions()
+
+            self.sheet_names_map = OrderedDict(
+                (sheet_name, sheet_name) for sheet_name in self.workbook.sheetnames
+            )
+            if self.include_sheets:
+                for sheet in list(self.sheet_names_map):
+                    if sheet not in self.include_sheets:
+                        self.sheet_names_map.pop(sheet)
+            for sheet in self.exclude_sheets or []:
+                self.sheet_names_map.pop(sheet, None)
+
+            sheet_names = list(self.sheet_names_map.keys())
+            self.sub_sheet_names = sheet_names
+            self.configure_sheets()
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self.workbook is not None:
+            # Closes the file, which read-only workbooks keep open
+            self.workbook.close()
+
+    def get_leading_row(self, sheet_name, row_number):
+        """
+        Return the values in the given (1-indexed) row of a sheet, or None if
+        the sheet has fewer rows.
 
-        sheet_names = list(self.sheet_names_map.keys())
-        self.sub_sheet_names = sheet_names
-        self.configure_sheets()
+        Rows are read from the start of the sheet as they're needed, and
+        cached, so that the configuration and heading rows are only read once.
+        """
+        leading_rows = self.sheet_leading_rows.setdefault(sheet_name, [])
+        if len(leading_rows) < row_number:
+            worksheet = self.workbook[self.sheet_names_map[sheet_name]]
+            width = self.sheet_widths.get(self.sheet_names_map[sheet_name], 0)
+            for row in worksheet.iter_rows(
+                min_row=len(leading_rows) + 1,
+                max_row=row_number,
+                values_only=True,
+            ):
+                row = tuple(row)
+                if len(row) < width:
+                    row += (None,) * (width - len(row))
+                leading_rows.append(row)
+        if len(leading_rows) < row_number:
+            return None
+        return leading_rows[row_number - 1]
 
     def get_sheet_headings(self, sheet_name):
         worksheet = self.workbook[self.sheet_names_map[sheet_name]]
@@ -759,22 +1206,22 @@ class XLSXInput(SpreadsheetInput):
                 ]
             ]
 
-        try:
-            return [
-                cell.value for cell in worksheet[skip_rows + configuration_line + 1]
-            ]
-        except IndexError:
+        heading_row = self.get_leading_row(
+            sheet_name, skip_rows + configuration_line + 1
+        )
+        if heading_row is None:
             # If the heading line is after data in the spreadsheet. i.e when skipRows
             return []
+        return list(heading_row)
 
     def get_sheet_configuration(self, sheet_name):
-        worksheet = self.workbook[self.sheet_names_map[sheet_name]]
-        if worksheet["A1"].value == "#":
-            return [
-                cell.value
-                for num, cell in enumerate(worksheet[1])
-                if num != 0 and cell.value
-            ]
+        if self.vertical_orientation:
+            worksheet = self.workbook[self.sheet_names_map[sheet_name]]
+            first_row = [cell.value for cell in worksheet[1]]
+        else:
+            first_row = self.get_leading_row(sheet_name, 1) or []
+        if first_row and first_row[0] == "#":
+            return [value for value in first_row[1:] if value]
         else:
             return []
 
@@ -792,42 +1239,53 @@ class XLSXInput(SpreadsheetInput):
         worksheet = self.workbook[self.sheet_names_map[sheet_name]]
         if self.vertical_orientation:
             header_row = worksheet[get_column_letter(skip_rows + 1)]
-            remaining_rows = worksheet.iter_cols(min_col=skip_rows + header_rows + 1)
+            remaining_rows = worksheet.iter_cols(
+                min_col=skip_rows + header_rows + 1, values_only=True
+            )
             if configuration_line:
                 header_row = header_row[1:]
                 remaining_rows = worksheet.iter_cols(
-                    min_col=skip_rows + header_rows + 1, min_row=2
+                    min_col=skip_rows + header_rows + 1, min_row=2, values_only=True
                 )
+            header_row = [cell.value for cell in header_row]
         else:
-            header_row = worksheet[skip_rows + configuration_line + 1]
+            header_row = (
+                self.get_leading_row(sheet_name, skip_rows + configuration_line + 1)
+                or ()
+            )
             remaining_rows = worksheet.iter_rows(
-                min_row=skip_rows + configuration_line + header_rows + 1
+                min_row=skip_rows + configuration_line + header_rows + 1,
+                values_only=True,
             )
 
-        coli_to_header = {}
-        for i, header in enumerate(header_row):
-            coli_to_header[i] = header.value
+        # None means that the cell will be ignored
+        ignored = [
+            not header
+            or (
+                sheet_configuration.get("hashcomments")
+                and isinstance(header, str)
+                and header.startswith("#")
+            )
+            for header in header_row
+        ]
+        width = len(header_row)
 
         for row in remaining_rows:
+            if len(row) < width:
+                # Read-only worksheets (with their size reset) don't pad
+                # short rows out to the width of the sheet.
+                row = tuple(row) + (None,) * (width - len(row))
             output_row = OrderedDict()
-            for i, x in enumerate(row):
-                header = coli_to_header[i]
-                value = x.value
-                if not header:
-                    # None means that the cell will be ignored
-                    value = None
-                elif (
-                    sheet_configuration.get("hashcomments")
-                    and isinstance(header, str)
-                    and header.startswith("#")
-                ):
-                    # None means that the cell will be ignored
-                    value = None
-                output_row[header] = value
+            for header, ignore, value in zip(header_row, ignored, row):
+                output_row[header] = None if ignore else value
             yield output_row
 
 
 class ODSInput(SpreadsheetInput):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.workbook = None
+
     def read_sheets(self):
         self.workbook = ODSReader(self.input_name)
         self.sheet_names_map = self.workbook.SHEETS
@@ -841,7 +1299,16 @@ class ODSInput(SpreadsheetInput):
             self.sheet_names_map.pop(sheet, None)
 
         self.sub_sheet_names = self.sheet_names_map.keys()
-        self.configure_sheets()
+        try:
+            self.configure_sheets()
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self.workbook is not None:
+            # Deletes the temporary file of rows
+            self.workbook.close()
 
     def _resolve_sheet_configuration(self, sheet_name):
         sheet_configuration = self.sheet_configuration[sheet_name]
@@ -873,12 +1340,12 @@ class ODSInput(SpreadsheetInput):
         if self.vertical_orientation:
             return [
                 row[skip_rows]
-                for row in worksheet[configuration_line:]
+                for row in list(worksheet)[configuration_line:]
                 if len(row) > skip_rows
             ]
 
         try:
-            return [cell for cell in worksheet[skip_rows + configuration_line]]
+            return list(worksheet.get_row(skip_rows + configuration_line))
         except IndexError:
             # If the heading line is after data in the spreadsheet. i.e when skipRows
             return []
@@ -890,8 +1357,9 @@ class ODSInput(SpreadsheetInput):
 
         try:
             # cell A1
-            if worksheet[0][0] == "#":
-                return worksheet[0]
+            first_row = worksheet.get_row(0)
+            if first_row[0] == "#":
+                return first_row
 
         except IndexError:
             pass
@@ -916,25 +1384,19 @@ class ODSInput(SpreadsheetInput):
 
         worksheet = self.sheet_names_map[sheet_name]
         if self.vertical_orientation:
-            header_row = [
-                row[skip_rows]
-                for row in worksheet[configuration_line:]
-                if len(row) > skip_rows
-            ]
-            longest_horizontal_row = max(
-                len(row) for row in worksheet[configuration_line:]
-            )
+            # Each record is a column, so all the rows have to be read first
+            rows = list(worksheet)[configuration_line:]
+            header_row = [row[skip_rows] for row in rows if len(row) > skip_rows]
+            longest_horizontal_row = max(len(row) for row in rows)
             remaining_rows = [
-                [
-                    row[i] if len(row) > i else None
-                    for row in worksheet[configuration_line:]
-                    if row
-                ]
+                [row[i] if len(row) > i else None for row in rows if row]
                 for i in range(1, longest_horizontal_row)
             ]
         else:
-            header_row = worksheet[skip_rows + configuration_line]
-            remaining_rows = worksheet[(skip_rows + configuration_line + header_rows) :]
+            header_row = worksheet.get_row(skip_rows + configuration_line)
+            remaining_rows = itertools.islice(
+                worksheet, skip_rows + configuration_line + header_rows, None
+            )
 
         coli_to_header = {}
         for i, header in enumerate(header_row):
@@ -984,53 +1446,137 @@ def list_as_dicts_to_temporary_dicts(unflattened, id_name, xml):
     return unflattened
 
 
-def unflatten_main_with_parser(parser, line, timezone, xml, id_name, convert_flags={}):
+def compile_path_plan(parser, path, xml, convert_flags={}):
+    """
+    Work out how to unflatten a cell in the column with the heading ``path``.
+
+    This only depends on the heading, so is done once per column rather than
+    once per cell. Returns a tuple of whether the heading starts with a number
+    (so should be ignored), and a list of steps, one for each path item that
+    isn't a number. Each step is a tuple of:
+
+    * ``path_item``
+    * ``path_till_now``, the path up to this item, without any numbers
+    * ``current_type``, the schema type of ``path_till_now``
+    * ``next_path_item``, or "" if this is the last path item
+    * ``list_index``, if ``next_path_item`` is a number, otherwise -1
+    * ``continue_array``, whether to carry on to the next path item after
+      going into an array
+    * ``date_if_datetime``, whether to use the "date" type if the cell is a
+      datetime (only for XML)
+    * ``error``, a message to raise as a FlattenToolValueError if the cell
+      reaches this step
+    * ``converter``, the function from get_converter used to convert the
+      value, if the cell's value is set at this step
+    """
+    path_list = [item.rstrip("[]") for item in str(path).split("/")]
+    path_items_till_now = []
+    steps = []
+    for num, path_item in enumerate(path_list):
+        if isint(path_item):
+            continue
+        path_items_till_now.append(path_item)
+        path_till_now = "/".join(path_items_till_now)
+        current_type = None
+        if parser:
+            current_type = parser.flattened.get(path_till_now)
+        try:
+            next_path_item = path_list[num + 1]
+        except IndexError:
+            next_path_item = ""
+
+        # Quick solution to avoid casting of date as datetime in spreadsheet > xml
+        date_if_datetime = xml and not next_path_item and "datetime" not in str(path)
+
+        error = None
+        list_index = -1
+        if isint(next_path_item):
+            if current_type and current_type != "array":
+                error = _(
+                    "There is an array at '{}' when the schema says there should be a '{}'"
+                ).format(path_till_now, current_type)
+            list_index = int(next_path_item)
+            current_type = "array"
+        elif (
+            current_type and current_type not in ["object", "array"] and next_path_item
+        ):
+            error = _(
+                "There is an object or list at '{}' but it should be an {}"
+            ).format(path_till_now, current_type)
+
+        if xml and current_type == "array":
+            # In xml "arrays" can have text values, if they're the final element
+            # However the type of the text value itself should not be "array",
+            # as that would split the text on commas, which we don't want.
+            # https://github.com/OpenDataServices/cove/issues/1030
+            converter = get_converter("", convert_flags)
+        else:
+            converter = get_converter(current_type or "", convert_flags)
+
+        steps.append(
+            (
+                path_item,
+                path_till_now,
+                current_type,
+                next_path_item,
+                list_index,
+                not xml or num < len(path_list) - 2,
+                date_if_datetime,
+                error,
+                converter,
+            )
+        )
+    return isint(path_list[0]), steps
+
+
+def unflatten_main_with_parser(
+    parser, line, timezone, xml, id_name, convert_flags={}, path_plans=None
+):
+    """
+    Unflatten a line (a dict of headings to cells) into a cell tree.
+
+    ``path_plans`` is a dict that is used to cache the result of
+    compile_path_plan for each heading, and can be shared between lines that
+    have the same parser, xml and convert_flags arguments.
+    """
+    if path_plans is None:
+        path_plans = {}
     unflattened = OrderedDict()
     for path, cell in line.items():
         # Skip blank cells
         if cell.cell_value is None or cell.cell_value == "":
             continue
-        current_path = unflattened
-        path_list = [item.rstrip("[]") for item in str(path).split("/")]
-        for num, path_item in enumerate(path_list):
-            if isint(path_item):
-                if num == 0:
-                    warn(
-                        _(
-                            'Column "{}" has been ignored because it is a number.'
-                        ).format(path),
-                        DataErrorWarning,
-                    )
-                continue
-            current_type = None
-            path_till_now = "/".join(
-                [item for item in path_list[: num + 1] if not isint(item)]
+        try:
+            starts_with_number, steps = path_plans[path]
+        except KeyError:
+            starts_with_number, steps = path_plans[path] = compile_path_plan(
+                parser, path, xml, convert_flags
             )
-            if parser:
-                current_type = parser.flattened.get(path_till_now)
-            try:
-                next_path_item = path_list[num + 1]
-            except IndexError:
-                next_path_item = ""
-
-            # Quick solution to avoid casting of date as datetime in spreadsheet > xml
-            if xml:
-                if type(cell.cell_value) == datetime.datetime and not next_path_item:
-                    if "datetime" not in str(path):
-                        current_type = "date"
+        if starts_with_number:
+            warn(
+                _('Column "{}" has been ignored because it is a number.').format(path),
+                DataErrorWarning,
+            )
+        current_path = unflattened
+        for (
+            path_item,
+            path_till_now,
+            current_type,
+            next_path_item,
+            list_index,
+            continue_array,
+            date_if_datetime,
+            error,
+            converter,
+        ) in steps:
+            if error:
+                raise FlattenToolValueError(error)
+
+            if date_if_datetime and type(cell.cell_value) == datetime.datetime:
+                current_type = "date"
+                converter = convert_date
 
             ## Array
-            list_index = -1
-            if isint(next_path_item):
-                if current_type and current_type != "array":
-                    raise FlattenToolValueError(
-                        _(
-                            "There is an array at '{}' when the schema says there should be a '{}'"
-                        ).format(path_till_now, current_type)
-                    )
-                list_index = int(next_path_item)
-                current_type = "array"
-
             if current_type == "array":
                 list_as_dict = current_path.get(path_item)
                 if list_as_dict is None:
@@ -1049,7 +1595,7 @@ def unflatten_main_with_parser(parser, line, timezone, xml, id_name, convert_fla
                     new_path = OrderedDict()
                     list_as_dict[list_index] = new_path
                 current_path = new_path
-                if not xml or num < len(path_list) - 2:
+                if continue_array:
                     # In xml "arrays" can have text values, if they're the final element
                     # This corresponds to a tag with text, but also possibly attributes
                     continue
@@ -1070,16 +1616,6 @@ def unflatten_main_with_parser(parser, line, timezone, xml, id_name, convert_fla
                     break
                 current_path = new_path
                 continue
-            if (
-                current_type
-                and current_type not in ["object", "array"]
-                and next_path_item
-            ):
-                raise FlattenToolValueError(
-                    _(
-                        "There is an object or list at '{}' but it should be an {}"
-                    ).format(path_till_now, current_type)
-                )
 
             ## Other Types
             current_path_value = current_path.get(path_item)
@@ -1097,17 +1633,7 @@ def unflatten_main_with_parser(parser, line, timezone, xml, id_name, convert_fla
                 )
                 continue
 
-            value = cell.cell_value
-            if xml and current_type == "array":
-                # In xml "arrays" can have text values, if they're the final element
-                # However the type of the text value itself should not be "array",
-                # as that would split the text on commas, which we don't want.
-                # https://github.com/OpenDataServices/cove/issues/1030
-                converted_value = convert_type("", value, timezone, convert_flags)
-            else:
-                converted_value = convert_type(
-                    current_type or "", value, timezone, convert_flags
-                )
+            converted_value = converter(cell.cell_value, timezone)
             cell.cell_value = converted_value
             if converted_value is not None and converted_value != "":
                 if xml:
@@ -7,14 +7,18 @@ JSON schema, for that see schema.py).
 
 import codecs
 import copy
+import gzip
+import json
 import os
-import tempfile
-import uuid
-from collections import OrderedDict
+import pickle
+import warnings
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 from decimal import Decimal
+from itertools import islice
 from warnings import warn
+from xml.parsers import expat
 
-import BTrees.OOBTree
 import ijson
 
 try:
@@ -23,10 +27,6 @@ try:
     SHAPELY_LIBRARY_AVAILABLE = True
 except ImportError:
     SHAPELY_LIBRARY_AVAILABLE = False
-import transaction
-import xmltodict
-import zc.zlibstorage
-import ZODB.FileStorage
 
 from flattentool.exceptions import (
     DataErrorWarning,
@@ -37,7 +37,7 @@ from flattentool.exceptions import (
 from flattentool.i18n import _
 from flattentool.input import GEO_DEPENDENCIES_MESSAGE, path_search
 from flattentool.schema import make_sub_sheet_name
-from flattentool.sheet import PersistentSheet
+from flattentool.sheet import SHEET_STORAGES, MemorySheetStorage
 
 BASIC_TYPES = [str, bool, int, Decimal, type(None)]
 
@@ -76,6 +76,114 @@ def sheet_key_title(sheet, key):
         return key
 
 
+def preserved_keys(preserve_fields):
+    """
+    Return the keys to keep in each object, for the given JSON paths of the
+    fields to preserve.
+
+    The result is a dict of parent paths (with a trailing "/", or "" for the
+    top level) to the set of keys that are preserved, or are the parent of a
+    preserved field. All the keys of objects whose path isn't in the dict
+    are kept, e.g. the children of a preserved field.
+
+    """
+    keys = {}
+    for field in preserve_fields:
+        parent_path = ""
+        for key in field.split("/"):
+            keys.setdefault(parent_path, set()).add(key)
+            parent_path += key + "/"
+    return keys
+
+
+def iter_filtered_items(items, filter_field, filter_value):
+    """
+    Yield each of the given top level items, or None instead of each object
+    whose ``filter_field`` isn't ``filter_value``, so that the indexes of the
+    items are the same.
+
+    """
+    for item in items:
+        if isinstance(item, dict) and (
+            filter_field not in item or item[filter_field] != filter_value
+        ):
+            yield None
+        else:
+            yield item
+
+
+def project_json_dict(json_dict, preserve_fields, keep_keys, parent_name=""):
+    """
+    Return a copy of a JSON object with the values of the keys that aren't
+    preserved (see preserved_keys) replaced by None, as JSONParser never
+    looks at them. The keys are left in, as they are still counted as seen.
+    The values of ``keep_keys`` are always kept.
+
+    """
+    preserved = preserve_fields.get(parent_name.replace("/0", ""))
+    projected = OrderedDict()
+    for key, value in json_dict.items():
+        if preserved is not None and key not in preserved and key not in keep_keys:
+            value = None
+        elif isinstance(value, dict):
+            value = project_json_dict(
+                value, preserve_fields, keep_keys, parent_name + key + "/"
+            )
+        elif isinstance(value, list) and any(isinstance(x, dict) for x in value):
+            value = [
+                project_json_dict(
+                    x, preserve_fields, keep_keys, parent_name + key + "/0/"
+                )
+                if isinstance(x, dict)
+                else x
+                for x in value
+            ]
+        projected[key] = value
+    return projected
+
+
+def iter_json_lines(json_lines_file, start=0):
+    """
+    Yield the JSON value on each line of a JSON Lines file (or an iterable of
+    lines), or None for a blank line.
+
+    ``start`` is the index of the first line in the whole file, used in
+    errors.
+
+    """
+    for line_number, line in enumerate(json_lines_file, start + 1):
+        if not line.strip():
+            yield None
+            continue
+        try:
+            yield json.loads(line, object_pairs_hook=OrderedDict, parse_float=Decimal)
+        except ValueError as err:
+            raise BadlyFormedJSONError(
+                _("Line {} of the JSON Lines input is not valid JSON: {}").format(
+                    line_number, err
+                )
+            )
+
+
+def iter_json_lines_ranges(json_lines_filename, lines_per_range):
+    """
+    Yield the byte offset, length and index of the first line of each range
+    of ``lines_per_range`` lines of a JSON Lines file.
+
+    """
+    with open(json_lines_filename, "rb") as json_lines_file:
+        offset = 0
+        start = 0
+        while True:
+            lengths = [len(line) for line in islice(json_lines_file, lines_per_range)]
+            if not lengths:
+                break
+            length = sum(lengths)
+            yield offset, length, start
+            offset += length
+            start += len(lengths)
+
+
 def lists_of_dicts_paths(xml_dict):
     for key, value in xml_dict.items():
         if isinstance(value, list) and value and isinstance(value[0], dict):
@@ -115,6 +223,141 @@ def list_dict_consistency(xml_dict):
     dicts_to_list_of_dicts(lists_of_dicts_paths_set, xml_dict)
 
 
+class XMLRootListHandler(object):
+    """
+    Expat handlers that build the same dict for each element at
+    ``root_list_path`` as xmltodict.parse(force_list=(root_list_path,),
+    force_cdata=True) would, adding each to ``self.items`` as soon as it
+    ends.
+
+    The rest of the file isn't kept.
+
+    """
+
+    def __init__(self, root_list_path):
+        self.root_list_path = tuple(root_list_path.split("/"))
+        # xmltodict's force_list compares against the name of each element
+        self.force_list_name = root_list_path
+        # Include the root element of the file
+        self.item_depth = len(self.root_list_path) + 1
+        # The names of the open elements
+        self.path = []
+        # The dict (or None) and the text of each open element in the current
+        # item
+        self.stack = []
+        self.items = deque()
+
+    def start_element(self, name, attrs):
+        self.path.append(name)
+        if not self.stack and (
+            len(self.path) != self.item_depth
+            or tuple(self.path[1:]) != self.root_list_path
+        ):
+            # Not in an item
+            return
+        # attrs is a list of names and values, as ordered_attributes is set
+        item = {"@" + key: value for key, value in zip(attrs[0::2], attrs[1::2])}
+        self.stack.append([item or None, []])
+
+    def characters(self, data):
+        if self.stack:
+            self.stack[-1][1].append(data)
+
+    def end_element(self, name):
+        self.path.pop()
+        if not self.stack:
+            return
+        item, data = self.stack.pop()
+        data = "".join(data).strip()
+        if data:
+            # As with force_cdata, text is always under "#text"
+            if item is None:
+                item = {}
+            item["#text"] = data
+        if self.stack:
+            parent = self.stack[-1]
+            parent[0] = self.push_data(parent[0], name, item)
+        else:
+            self.items.append(item)
+
+    def push_data(self, item, key, data):
+        if item is None:
+            item = {}
+        if key in item:
+            value = item[key]
+            if isinstance(value, list):
+                value.append(data)
+            else:
+                item[key] = [value, data]
+        elif key == self.force_list_name:
+            item[key] = [data]
+        else:
+            item[key] = data
+        return item
+
+
+def iter_xml_items(xml_filename, root_list_path, read_size=65536):
+    """
+    Yield the dict for each element at ``root_list_path`` in an XML file, as
+    it would be in the output of xmltodict.parse, reading the file
+    incrementally.
+
+    """
+    handler = XMLRootListHandler(root_list_path)
+    parser = expat.ParserCreate()
+    parser.ordered_attributes = True
+    parser.StartElementHandler = handler.start_element
+    parser.EndElementHandler = handler.end_element
+    parser.CharacterDataHandler = handler.characters
+    parser.buffer_text = True
+
+    def forbid_entities(*args, **kwargs):
+        raise ValueError("entities are disabled")
+
+    parser.EntityDeclHandler = forbid_entities
+
+    with open(xml_filename, "rb") as xml_file:
+        while True:
+            data = xml_file.read(read_size)
+            parser.Parse(data, not data)
+            while handler.items:
+                yield handler.items.popleft()
+            if not data:
+                break
+
+
+def iter_consistent_xml_items(xml_filename, root_list_path):
+    """
+    Yield the dicts for each element at ``root_list_path`` in an XML file,
+    with the same list/dict consistency as ``list_dict_consistency`` would
+    give for the whole file.
+
+    The file is read twice: first to find which paths have lists of dicts,
+    and then to yield each element. Only one element is held in memory at a
+    time.
+
+    """
+    path = tuple(root_list_path.split("/"))
+    lists_of_dicts_paths_set = set()
+    for num, item in enumerate(iter_xml_items(xml_filename, root_list_path)):
+        if not isinstance(item, dict):
+            if num == 0:
+                # lists_of_dicts_paths only looks in a list if its first item
+                # is a dict
+                break
+            continue
+        if num == 0:
+            lists_of_dicts_paths_set.add(path)
+        lists_of_dicts_paths_set.update(
+            path + item_path for item_path in lists_of_dicts_paths(item)
+        )
+
+    for item in iter_xml_items(xml_filename, root_list_path):
+        if isinstance(item, dict):
+            dicts_to_list_of_dicts(lists_of_dicts_paths_set, item, path)
+        yield item
+
+
 class JSONParser(object):
     # Named for consistency with schema.SchemaParser, but not sure it's the most appropriate name.
     # Similarly with methods like parse_json_dict
@@ -136,31 +379,24 @@ class JSONParser(object):
         rollup=False,
         truncation_length=3,
         persist=False,
+        sheet_storage="spill",
         convert_flags={},
+        workers=1,
+        chunk_size=1000,
+        json_lines=False,
     ):
         if persist:
-            # Use temp directories in OS agnostic way
-            self.zodb_db_location = (
-                tempfile.gettempdir() + "/flattentool-" + str(uuid.uuid4())
-            )
-            # zlibstorage lowers disk usage by a lot at very small performance cost
-            zodb_storage = zc.zlibstorage.ZlibStorage(
-                ZODB.FileStorage.FileStorage(self.zodb_db_location)
-            )
-            self.db = ZODB.DB(zodb_storage)
+            # Store the lines of each sheet on disk, rather than in memory
+            if sheet_storage not in SHEET_STORAGES:
+                raise FlattenToolValueError(
+                    _("{} is not a valid sheet storage").format(sheet_storage)
+                )
+            self.sheet_storage = SHEET_STORAGES[sheet_storage]()
         else:
-            # If None, in memory storage is used.
-            self.db = ZODB.DB(None)
-
-        self.connection = self.db.open()
-
-        # ZODB root, only objects attached here will be persisted
-        root = self.connection.root
-        # OOBTree means a btree with keys and values are objects (including strings)
-        root.sheet_store = BTrees.OOBTree.BTree()
+            self.sheet_storage = MemorySheetStorage()
 
         self.sub_sheets = {}
-        self.main_sheet = PersistentSheet(connection=self.connection, name="")
+        self.main_sheet = self.sheet_storage.create_sheet("")
         self.root_list_path = root_list_path
         self.root_id = root_id
         self.use_titles = use_titles
@@ -173,19 +409,16 @@ class JSONParser(object):
         self.seen_paths = set()
         self.persist = persist
         self.convert_flags = convert_flags
+        self.workers = workers
+        self.chunk_size = chunk_size
 
         if schema_parser:
-            # schema parser does not make sheets that are persistent,
-            # so use from_sheets which deep copies everything in it.
-            self.main_sheet = PersistentSheet.from_sheet(
-                schema_parser.main_sheet, self.connection
-            )
-            for sheet_name, sheet in list(self.sub_sheets.items()):
-                self.sub_sheets[sheet_name] = PersistentSheet.from_sheet(
-                    sheet, self.connection
-                )
+            # schema parser does not make sheets that are stored,
+            # so use sheet_from which deep copies everything in it.
+            self.main_sheet = self.sheet_storage.sheet_from(schema_parser.main_sheet)
+            for sheet_name, sheet in schema_parser.sub_sheets.items():
+                self.sub_sheets[sheet_name] = self.sheet_storage.sheet_from(sheet)
 
-            self.sub_sheets = copy.deepcopy(schema_parser.sub_sheets)
             if remove_empty_schema_columns:
                 # Don't use columns from the schema parser
                 # (avoids empty columns)
@@ -235,30 +468,30 @@ class JSONParser(object):
                     )
                 )
 
+        # The JSON Lines file that can be split into byte ranges for workers
+        self.json_lines_filename = None
+
+        if json_lines and (self.xml or root_list_path is not None):
+            raise FlattenToolValueError(
+                _("Not allowed to use json_lines with xml or root_list_path")
+            )
+
         if self.xml:
-            with codecs.open(json_filename, "rb") as xml_file:
-                top_dict = xmltodict.parse(
-                    xml_file,
-                    force_list=(root_list_path,),
-                    force_cdata=True,
-                )
-                # AFAICT, this should be true for *all* XML files
-                assert len(top_dict) == 1
-                root_json_dict = list(top_dict.values())[0]
-                list_dict_consistency(root_json_dict)
+            # Read one root_list_path element at a time, rather than the
+            # whole file
+            self.root_json_list = iter_consistent_xml_items(
+                json_filename, root_list_path
+            )
             json_filename = None
-
-        if json_filename is None and root_json_dict is None:
+        elif json_filename is None and root_json_dict is None:
             raise FlattenToolValueError(
                 _("Either json_filename or root_json_dict must be supplied")
             )
-
-        if json_filename is not None and root_json_dict is not None:
+        elif json_filename is not None and root_json_dict is not None:
             raise FlattenToolValueError(
                 _("Only one of json_file or root_json_dict should be supplied")
             )
-
-        if not json_filename:
+        elif not json_filename:
             if self.root_list_path is None:
                 self.root_json_list = root_json_dict
             else:
@@ -268,19 +501,11 @@ class JSONParser(object):
 
         if preserve_fields:
             # Extract fields to be preserved from input file (one path per line)
-            preserve_fields_all = []
-            preserve_fields_input = []
+            self.preserve_fields_input = set()
             with open(preserve_fields) as preserve_fields_file:
                 for line in preserve_fields_file:
-                    line = line.strip()
-                    path_fields = line.rsplit("/", 1)
-                    preserve_fields_all = (
-                        preserve_fields_all + path_fields + [line.rstrip("/")]
-                    )
-                    preserve_fields_input = preserve_fields_input + [line.rstrip("/")]
-
-            self.preserve_fields = set(preserve_fields_all)
-            self.preserve_fields_input = set(preserve_fields_input)
+                    self.preserve_fields_input.add(line.strip().rstrip("/"))
+            self.preserve_fields = preserved_keys(self.preserve_fields_input)
 
             try:
                 input_not_in_schema = set()
@@ -300,7 +525,16 @@ class JSONParser(object):
             self.preserve_fields = None
             self.preserve_fields_input = None
 
-        if json_filename:
+        if json_filename and json_lines:
+            if json_filename.endswith(".gz"):
+                json_file = gzip.open(json_filename, "rb")
+            else:
+                json_file = open(json_filename, "rb")
+                # Workers can read their own ranges of lines from the file,
+                # which isn't possible if it's compressed
+                self.json_lines_filename = json_filename
+            self.root_json_list = iter_json_lines(json_file)
+        elif json_filename:
             if self.root_list_path is None:
                 path = "item"
             else:
@@ -310,6 +544,13 @@ class JSONParser(object):
 
             self.root_json_list = ijson.items(json_file, path, map_type=OrderedDict)
 
+        if self.filter_field and self.filter_value:
+            # Skip the objects that don't match before they are flattened,
+            # or sent to a worker process
+            self.root_json_list = iter_filtered_items(
+                self.root_json_list, self.filter_field, self.filter_value
+            )
+
         try:
             self.parse()
         except ijson.common.IncompleteJSONError as err:
@@ -319,33 +560,19 @@ class JSONParser(object):
                 json_file.close()
 
     def parse(self):
-        for num, json_dict in enumerate(self.root_json_list):
-            if json_dict is None:
-                # This is particularly useful for IATI XML, in order to not
-                # fall over on empty activity, e.g. <iati-activity/>
-                continue
-
-            if not isinstance(json_dict, dict):
-                warn(
-                    _(f"The value at index {num} is not a JSON object"),
-                    DataErrorWarning,
-                )
-                continue
-
-            self.parse_json_dict(json_dict, sheet=self.main_sheet)
-            # only persist every 2000 objects. persisting more often slows down storing.
-            # 2000 top level objects normally not too much to store in memory.
-            if num % 2000 == 0 and num != 0:
-                transaction.commit()
+        if self.workers > 1:
+            self.parse_parallel()
+        else:
+            self.parse_json_list(self.root_json_list)
 
         # This commit could be removed which would mean that upto 2000 objects
         # could be stored in memory without anything being persisted.
-        transaction.commit()
+        self.sheet_storage.commit()
 
         if self.remove_empty_schema_columns:
             # Remove sheets with no lines of data
             for sheet_name, sheet in list(self.sub_sheets.items()):
-                if not sheet.lines:
+                if next(iter(sheet.lines), None) is None:
                     del self.sub_sheets[sheet_name]
 
         if self.preserve_fields_input:
@@ -361,6 +588,115 @@ class JSONParser(object):
                     FlattenToolWarning,
                 )
 
+    def parse_json_list(self, json_list, start=0):
+        """
+        Flatten each top level object of ``json_list`` into the sheets.
+
+        ``start`` is the index of the first object in the whole input, used
+        in warnings.
+        """
+        for num, json_dict in enumerate(json_list, start):
+            if json_dict is None:
+                # This is particularly useful for IATI XML, in order to not
+                # fall over on empty activity, e.g. <iati-activity/>
+                continue
+
+            if not isinstance(json_dict, dict):
+                warn(
+                    _(f"The value at index {num} is not a JSON object"),
+                    DataErrorWarning,
+                )
+                continue
+
+            self.parse_json_dict(json_dict, sheet=self.main_sheet)
+            # only persist every 2000 objects. persisting more often slows down storing.
+            # 2000 top level objects normally not too much to store in memory.
+            if num % 2000 == 0 and num != 0:
+                self.sheet_storage.commit()
+
+    def parse_parallel(self):
+        """
+        Flatten the top level objects in chunks of ``chunk_size``, using a
+        pool of ``workers`` processes.
+
+        Each worker flattens a chunk into its own sheets. The results are
+        merged back in input order, so the columns and rows are the same as
+        when flattening in a single process.
+        """
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_chunk_worker,
+            # Pickled explicitly, so that __getstate__ is used even when
+            # worker processes are forked.
+            initargs=(pickle.dumps(self),),
+        ) as executor:
+            pending = deque()
+            for chunk_job in self.iter_chunk_jobs():
+                pending.append(executor.submit(*chunk_job))
+                # Limit how many chunks are held in memory at once
+                if len(pending) >= 2 * self.workers:
+                    self.merge_chunk(*pending.popleft().result())
+            while pending:
+                self.merge_chunk(*pending.popleft().result())
+
+    def iter_chunk_jobs(self):
+        """
+        Yield the function and arguments to flatten each chunk of
+        ``chunk_size`` top level objects in a worker process.
+
+        Each worker reads its own range of lines of a JSON Lines file.
+        Otherwise, the objects are read here and sent to the workers.
+        """
+        if self.json_lines_filename:
+            for offset, length, start in iter_json_lines_ranges(
+                self.json_lines_filename, self.chunk_size
+            ):
+                yield (
+                    _parse_json_lines_chunk,
+                    self.json_lines_filename,
+                    offset,
+                    length,
+                    start,
+                )
+            return
+
+        start = 0
+        json_list = iter(self.root_json_list)
+        if self.preserve_fields:
+            # Don't send the parts of each object that aren't preserved
+            # to the workers
+            keep_keys = {self.root_id, self.id_name}
+            if self.convert_flags.get("wkt"):
+                keep_keys.update(["type", "coordinates"])
+            json_list = (
+                project_json_dict(json_dict, self.preserve_fields, keep_keys)
+                if isinstance(json_dict, dict)
+                else json_dict
+                for json_dict in json_list
+            )
+        while True:
+            chunk = list(islice(json_list, self.chunk_size))
+            if not chunk:
+                break
+            yield _parse_chunk, chunk, start
+            start += len(chunk)
+
+    def merge_chunk(self, main_sheet, sub_sheets, seen_paths, caught_warnings):
+        """
+        Merge the output of ``_parse_chunk`` into this parser's sheets.
+        """
+        for message, category in caught_warnings:
+            warn(message, category)
+        merge_sheet(self.main_sheet, *main_sheet)
+        for sub_sheet_name, columns, lines in sub_sheets:
+            if sub_sheet_name not in self.sub_sheets:
+                self.sub_sheets[sub_sheet_name] = self.sheet_storage.create_sheet(
+                    sub_sheet_name
+                )
+            merge_sheet(self.sub_sheets[sub_sheet_name], columns, lines)
+        self.seen_paths.update(seen_paths)
+        self.sheet_storage.commit()
+
     def parse_json_dict(
         self,
         json_dict,
@@ -422,12 +758,6 @@ class JSONParser(object):
         else:
             top = False
 
-        if parent_name == "" and self.filter_field and self.filter_value:
-            if self.filter_field not in json_dict:
-                return
-            if json_dict[self.filter_field] != self.filter_value:
-                return
-
         if top_level_of_sub_sheet:
             # Add the IDs for the top level of object in an array
             for k, v in parent_id_fields.items():
@@ -444,24 +774,22 @@ class JSONParser(object):
                 self.id_name
             ]
 
+        parent_path = parent_name.replace("/0", "")
+        if self.preserve_fields:
+            preserved = self.preserve_fields.get(parent_path)
+        else:
+            preserved = None
+
         for key, value in json_dict.items():
 
             if skip_type_and_coordinates and key in ["type", "coordinates"]:
                 continue
 
             # Keep a unique list of all the JSON paths in the data that have been seen.
-            parent_path = parent_name.replace("/0", "")
-            full_path = parent_path + key
-            self.seen_paths.add(full_path)
-
-            if self.preserve_fields:
+            self.seen_paths.add(parent_path + key)
 
-                siblings = False
-                for field in self.preserve_fields:
-                    if parent_path in field:
-                        siblings = True
-                if siblings and full_path not in self.preserve_fields:
-                    continue
+            if preserved is not None and key not in preserved:
+                continue
 
             if type(value) in BASIC_TYPES:
                 if self.xml and key == "#text":
@@ -510,13 +838,19 @@ class JSONParser(object):
                                 )
                             )
 
+                        if self.preserve_fields:
+                            preserved_rollup = self.preserve_fields.get(
+                                parent_name + key + "/"
+                            )
+                        else:
+                            preserved_rollup = None
+
                         if len(value) == 1:
                             for k, v in value[0].items():
 
                                 if (
-                                    self.preserve_fields
-                                    and parent_name + key + "/" + k
-                                    not in self.preserve_fields
+                                    preserved_rollup is not None
+                                    and k not in preserved_rollup
                                 ):
                                     continue
 
@@ -593,9 +927,8 @@ class JSONParser(object):
                             for k in set(sum((list(x.keys()) for x in value), [])):
 
                                 if (
-                                    self.preserve_fields
-                                    and parent_name + key + "/" + k
-                                    not in self.preserve_fields
+                                    preserved_rollup is not None
+                                    and k not in preserved_rollup
                                 ):
                                     continue
 
@@ -648,9 +981,9 @@ class JSONParser(object):
                             parent_name, key, truncation_length=self.truncation_length
                         )
                     if sub_sheet_name not in self.sub_sheets:
-                        self.sub_sheets[sub_sheet_name] = PersistentSheet(
-                            name=sub_sheet_name, connection=self.connection
-                        )
+                        self.sub_sheets[
+                            sub_sheet_name
+                        ] = self.sheet_storage.create_sheet(sub_sheet_name)
 
                     for json_dict in value:
                         if json_dict is None:
@@ -671,14 +1004,110 @@ class JSONParser(object):
         if top:
             sheet.append_line(flattened_dict)
 
+    def __getstate__(self):
+        """
+        Pickle the configuration of this parser, for use in worker processes.
+
+        The sheet storage and any rows are left out, and the sheets are
+        replaced by empty copies.
+        """
+        state = self.__dict__.copy()
+        for key in ("sheet_storage", "root_json_list"):
+            state.pop(key, None)
+        memory_storage = MemorySheetStorage()
+        state["main_sheet"] = memory_storage.sheet_from(self.main_sheet)
+        state["sub_sheets"] = {
+            sheet_name: memory_storage.sheet_from(sheet)
+            for sheet_name, sheet in self.sub_sheets.items()
+        }
+        if self.schema_parser:
+            # Only the parsed sheets and lookups are needed, not the schema
+            schema_parser = copy.copy(self.schema_parser)
+            schema_parser.root_schema_dict = None
+            state["schema_parser"] = schema_parser
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.persist = False
+        self.sheet_storage = MemorySheetStorage()
+
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
-        if self.persist:
-            self.connection.close()
-            self.db.close()
-            os.remove(self.zodb_db_location)
-            os.remove(self.zodb_db_location + ".lock")
-            os.remove(self.zodb_db_location + ".index")
-            os.remove(self.zodb_db_location + ".tmp")
+        self.sheet_storage.close()
+
+
+def merge_sheet(sheet, columns, lines):
+    """
+    Add any new columns, in order, and then the rows to the given sheet.
+    """
+    for column in columns:
+        if column not in sheet:
+            sheet.append(column)
+    for line in lines:
+        sheet.append_line(line)
+
+
+# The parser used by each worker process of JSONParser.parse_parallel
+_chunk_parser = None
+
+
+def _init_chunk_worker(pickled_parser):
+    global _chunk_parser
+    _chunk_parser = pickle.loads(pickled_parser)
+    _chunk_parser.sheet_templates = (
+        _chunk_parser.main_sheet,
+        _chunk_parser.sub_sheets,
+    )
+
+
+def _parse_json_lines_chunk(json_lines_filename, offset, length, start):
+    """
+    Flatten the objects on one range of lines of a JSON Lines file in a
+    worker process. See _parse_chunk.
+    """
+    with open(json_lines_filename, "rb") as json_lines_file:
+        json_lines_file.seek(offset)
+        # Split on "\n" only, as iterating over the file does
+        lines = json_lines_file.read(length).split(b"\n")
+    if not lines[-1]:
+        # The range ends with a newline
+        del lines[-1]
+    json_list = iter_json_lines(lines, start)
+    if _chunk_parser.filter_field and _chunk_parser.filter_value:
+        json_list = iter_filtered_items(
+            json_list, _chunk_parser.filter_field, _chunk_parser.filter_value
+        )
+    return _parse_chunk(json_list, start)
+
+
+def _parse_chunk(json_list, start):
+    """
+    Flatten one chunk of top level objects in a worker process.
+
+    Returns the columns and rows of each sheet in the order they were first
+    seen, the JSON paths seen, and any warnings raised, so that they can be
+    merged by JSONParser.merge_chunk.
+    """
+    parser = _chunk_parser
+    main_sheet_template, sub_sheet_templates = parser.sheet_templates
+    parser.main_sheet = parser.sheet_storage.sheet_from(main_sheet_template)
+    parser.sub_sheets = {
+        sheet_name: parser.sheet_storage.sheet_from(sheet)
+        for sheet_name, sheet in sub_sheet_templates.items()
+    }
+    parser.seen_paths = set()
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        parser.parse_json_list(json_list, start)
+    return (
+        (parser.main_sheet.columns, list(parser.main_sheet.lines)),
+        [
+            (sheet_name, sheet.columns, list(sheet.lines))
+            for sheet_name, sheet in parser.sub_sheets.items()
+        ],
+        parser.seen_paths,
+        [(w.message, w.category) for w in caught],
+    )
@@ -1,3 +1,15 @@
+import importlib.metadata
+import os
+import tempfile
+
+try:
+    # Part of the key of cached schemas, so that they aren't used by a
+    # different version
+    FLATTENTOOL_VERSION = importlib.metadata.version("flattentool")
+except importlib.metadata.PackageNotFoundError:
+    FLATTENTOOL_VERSION = None
+
+
 def isint(string):
     try:
         int(string)
@@ -25,3 +37,17 @@ def parse_sheet_configuration(configuration_list):
         if len(parts) == 2 and parts[0].lower() == "idname":
             configuration["IDName"] = parts[1]
     return configuration
+
+
+def write_cache_file(cache_dir, filename, data):
+    """
+    Write the bytes ``data`` to ``filename`` in ``cache_dir``, creating the
+    directory if necessary.
+
+    The data is written to a temporary file first, and then moved into place,
+    so that a partly written cache file is never read.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as fp:
+        fp.write(data)
+    os.replace(fp.name, os.path.join(cache_dir, filename))
@@ -5,11 +5,16 @@ formats.
 """
 
 import csv
+import io
 import os
+import re
+import time
+import zipfile
 from warnings import warn
+from xml.sax.saxutils import escape, quoteattr
 
+import odf.manifest
 import odf.table
-import odf.text
 import openpyxl
 from odf.opendocument import OpenDocumentSpreadsheet
 from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
@@ -18,6 +23,25 @@ from flattentool.exceptions import DataErrorWarning
 from flattentool.i18n import _
 
 
+def remove_illegal_characters(value):
+    """
+    Remove characters that aren't allowed in a spreadsheet cell from a string
+    value, with a warning.
+
+    """
+    if isinstance(value, str):
+        new_value = ILLEGAL_CHARACTERS_RE.sub("", value)
+        if new_value != value:
+            warn(
+                _(
+                    "Character(s) in '{}' are not allowed in a spreadsheet cell. Those character(s) will be removed"
+                ).format(value),
+                DataErrorWarning,
+            )
+        return new_value
+    return value
+
+
 class SpreadsheetOutput(object):
     # output_name is given a default here, partly to help with tests,
     # but should have been defined by the time we get here.
@@ -38,48 +62,94 @@ class SpreadsheetOutput(object):
     def open(self):
         pass
 
-    def write_sheet(self, sheet_name, sheet_header, sheet_lines=None):
+    def start_sheet(self, sheet_name, sheet_header):
+        raise NotImplementedError
+
+    def write_row(self, values):
         raise NotImplementedError
 
+    def end_sheet(self):
+        pass
+
+    def write_sheet(self, sheet_name, sheet):
+        sheet_header = list(sheet)
+        self.start_sheet(sheet_name, sheet_header)
+        for values in sheet.rows(sheet_header):
+            self.write_row(values)
+        self.end_sheet()
+
     def write_sheets(self):
         self.open()
+        try:
+            self.write_sheet(self.main_sheet_name, self.parser.main_sheet)
+            for sheet_name, sub_sheet in sorted(self.parser.sub_sheets.items()):
+                self.write_sheet(sheet_name, sub_sheet)
 
-        self.write_sheet(self.main_sheet_name, self.parser.main_sheet)
-        for sheet_name, sub_sheet in sorted(self.parser.sub_sheets.items()):
-            self.write_sheet(sheet_name, sub_sheet)
-
-        self.close()
+            self.close()
+        except BaseException:
+            self.abort()
+            raise
 
     def close(self):
         pass
 
+    def abort(self):
+        """
+        Clean up after an error while writing the sheets.
+        """
+        pass
+
+
+class MultipleSpreadsheetOutput(SpreadsheetOutput):
+    """
+    Writes the same sheets to several outputs at once, so that the lines of
+    each sheet are only read (from the sheet storage) once.
+
+    """
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+        super().__init__(
+            parser=outputs[0].parser, main_sheet_name=outputs[0].main_sheet_name
+        )
+
+    def open(self):
+        for output in self.outputs:
+            output.open()
+
+    def start_sheet(self, sheet_name, sheet_header):
+        for output in self.outputs:
+            output.start_sheet(sheet_name, sheet_header)
+
+    def write_row(self, values):
+        for output in self.outputs:
+            output.write_row(values)
+
+    def end_sheet(self):
+        for output in self.outputs:
+            output.end_sheet()
+
+    def close(self):
+        for output in self.outputs:
+            output.close()
+
+    def abort(self):
+        for output in self.outputs:
+            output.abort()
+
 
 class XLSXOutput(SpreadsheetOutput):
     def open(self):
         # write only means that the output will be streamed
         self.workbook = openpyxl.Workbook(write_only=True)
 
-    def write_sheet(self, sheet_name, sheet):
-        sheet_header = list(sheet)
-        worksheet = self.workbook.create_sheet()
-        worksheet.title = (self.sheet_prefix + sheet_name)[:31]
-        worksheet.append(sheet_header)
-        for sheet_line in sheet.lines:
-            line = []
-            for header in sheet_header:
-                value = sheet_line.get(header)
-                if isinstance(value, str):
-                    new_value = ILLEGAL_CHARACTERS_RE.sub("", value)
-                    if new_value != value:
-                        warn(
-                            _(
-                                "Character(s) in '{}' are not allowed in a spreadsheet cell. Those character(s) will be removed"
-                            ).format(value),
-                            DataErrorWarning,
-                        )
-                    value = new_value
-                line.append(value)
-            worksheet.append(line)
+    def start_sheet(self, sheet_name, sheet_header):
+        self.worksheet = self.workbook.create_sheet()
+        self.worksheet.title = (self.sheet_prefix + sheet_name)[:31]
+        self.worksheet.append(sheet_header)
+
+    def write_row(self, values):
+        self.worksheet.append([remove_illegal_characters(value) for value in values])
 
     def close(self):
         self.workbook.save(self.output_name)
@@ -92,76 +162,182 @@ class CSVOutput(SpreadsheetOutput):
         except OSError:
             pass
 
-    def write_sheet(self, sheet_name, sheet):
-        sheet_header = list(sheet)
-        with open(
+    def start_sheet(self, sheet_name, sheet_header):
+        self.csv_file = open(
             os.path.join(self.output_name, self.sheet_prefix + sheet_name + ".csv"),
             "w",
             newline="",
             encoding="utf-8",
-        ) as csv_file:
-            dictwriter = csv.DictWriter(
-                csv_file, sheet_header, lineterminator=self.line_terminator
-            )
-            dictwriter.writeheader()
-            for sheet_line in sheet.lines:
-                dictwriter.writerow(sheet_line)
+        )
+        self.writer = csv.writer(self.csv_file, lineterminator=self.line_terminator)
+        self.writer.writerow(sheet_header)
+
+    def write_row(self, values):
+        self.writer.writerow(values)
+
+    def end_sheet(self):
+        self.csv_file.close()
+
+
+# Characters that aren't allowed in XML, which odfpy replaces
+XML_ILLEGAL_CHARACTERS_RE = re.compile(
+    "[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]"
+)
+
+XML_PROLOGUE = "<?xml version='1.0' encoding='UTF-8'?>\n"
+
+# A regular file that can be read and written by its owner and read by others,
+# in the external attributes of a zip file entry
+ZIP_FILE_PERMISSIONS = 0o100644 << 16
+
+
+def xml_text(value):
+    return escape(XML_ILLEGAL_CHARACTERS_RE.sub("\ufffd", value))
+
+
+def xml_attribute(value):
+    return quoteattr(XML_ILLEGAL_CHARACTERS_RE.sub("\ufffd", value))
 
 
 class ODSOutput(SpreadsheetOutput):
+    """
+    Writes an ODS file, streaming each row into content.xml as it's written,
+    rather than building the whole document in memory with odfpy.
+
+    odfpy is still used for the other parts of the file, and the file is the
+    same as odfpy's save() would write for the same document. If writing
+    fails, the partly written file is removed.
+
+    """
+
+    placeholder_table_name = "flattentool-placeholder"
+
     def open(self):
         self.workbook = OpenDocumentSpreadsheet()
+        self.content = None
+        self.zip_file = zipfile.ZipFile(self.output_name, "w")
+        self.now = time.localtime()[:6]
+        # The mimetype must be the first file, and not compressed
+        self._write_zip_file(
+            "mimetype", self.workbook.mimetype.encode("utf-8"), zipfile.ZIP_STORED
+        )
+
+        # Write the parts in the same order as odfpy's save(). odfpy declares
+        # every namespace it has seen so far on each part's root element, so
+        # the table (used as a placeholder below) and the manifest are created
+        # before styles.xml is written, as they would be by save().
+        placeholder = odf.table.Table(name=self.placeholder_table_name)
+        self.manifest = odf.manifest.Manifest()
+        self._add_manifest_entry("/", self.workbook.mimetype)
+        self._add_manifest_entry("styles.xml")
+        self._write_zip_file("styles.xml", self.workbook.stylesxml().encode("utf-8"))
+
+        # Use odfpy to write content.xml with an empty table, and split it
+        # where the tables will go.
+        self._add_manifest_entry("content.xml")
+        self.workbook.spreadsheet.addElement(placeholder)
+        content_start, content_end = (
+            self.workbook.contentxml()
+            .decode("utf-8")
+            .split(
+                "<table:table table:name={}/>".format(
+                    xml_attribute(self.placeholder_table_name)
+                )
+            )
+        )
+        self.workbook.spreadsheet.removeChild(placeholder)
+        self.content_end = content_end
+
+        self.content = io.TextIOWrapper(
+            self.zip_file.open(self._zip_info("content.xml"), "w"), encoding="utf-8"
+        )
+        self.content.write(content_start)
+
+    def _add_manifest_entry(self, fullpath, mediatype="text/xml"):
+        self.manifest.addElement(
+            odf.manifest.FileEntry(fullpath=fullpath, mediatype=mediatype)
+        )
+
+    def _zip_info(self, filename, compress_type=zipfile.ZIP_DEFLATED):
+        zip_info = zipfile.ZipInfo(filename, self.now)
+        zip_info.compress_type = compress_type
+        zip_info.external_attr = ZIP_FILE_PERMISSIONS
+        return zip_info
+
+    def _write_zip_file(self, filename, data, compress_type=zipfile.ZIP_DEFLATED):
+        self.zip_file.writestr(self._zip_info(filename, compress_type), data)
 
     def _make_cell(self, value):
-        """Util for creating an ods cell"""
+        """Util for creating the XML for an ods cell"""
 
         if value:
             try:
                 # See if value parses as a float
-                cell = odf.table.TableCell(valuetype="float", value=float(value))
+                cell = '<table:table-cell office:value-type="float" office:value={}>'.format(
+                    xml_attribute(str(float(value)))
+                )
             except ValueError:
-                cell = odf.table.TableCell(valuetype="string")
+                cell = '<table:table-cell office:value-type="string">'
         else:
-            cell = odf.table.TableCell(valuetype="Nonetype")
+            cell = '<table:table-cell office:value-type="Nonetype">'
 
-        p = odf.text.P(text=value)
-        cell.addElement(p)
+        if value is None or value == "":
+            return cell + "<text:p/></table:table-cell>"
+        elif not value:
+            # odfpy writes falsy values, like 0, as empty text
+            return cell + "<text:p></text:p></table:table-cell>"
+        else:
+            return (
+                cell
+                + "<text:p>"
+                + xml_text(str(value))
+                + "</text:p></table:table-cell>"
+            )
 
-        return cell
+    def _write_row(self, values):
+        if values:
+            self.content.write(
+                "<table:table-row>"
+                + "".join(self._make_cell(value) for value in values)
+                + "</table:table-row>"
+            )
+        else:
+            self.content.write("<table:table-row/>")
 
-    def write_sheet(self, sheet_name, sheet):
+    def start_sheet(self, sheet_name, sheet_header):
+        self.content.write(
+            "<table:table table:name={}>".format(
+                xml_attribute((self.sheet_prefix + sheet_name)[:31])
+            )
+        )
+        self._write_row(sheet_header)
 
-        worksheet = odf.table.Table(name=(self.sheet_prefix + sheet_name)[:31])
-        sheet_header = list(sheet)
+    def write_row(self, values):
+        self._write_row([remove_illegal_characters(value) for value in values])
 
-        header_row = odf.table.TableRow()
+    def end_sheet(self):
+        self.content.write("</table:table>")
 
-        for header in sheet_header:
-            header_row.addElement(self._make_cell(header))
+    def close(self):
+        self.content.write(self.content_end)
+        self.content.close()
 
-        worksheet.addElement(header_row)
+        self._add_manifest_entry("meta.xml")
+        self._write_zip_file("meta.xml", self.workbook.metaxml().encode("utf-8"))
 
-        for sheet_line in sheet.lines:
-            row = odf.table.TableRow()
-            for header in sheet_header:
-                value = sheet_line.get(header)
-                if isinstance(value, str):
-                    new_value = ILLEGAL_CHARACTERS_RE.sub("", value)
-                    if new_value != value:
-                        warn(
-                            _(
-                                "Character(s) in '{}' are not allowed in a spreadsheet cell. Those character(s) will be removed"
-                            ).format(value),
-                            DataErrorWarning,
-                        )
-                    value = new_value
-                row.addElement(self._make_cell(value))
-            worksheet.addElement(row)
+        manifest_xml = io.StringIO()
+        manifest_xml.write(XML_PROLOGUE)
+        self.manifest.toXml(0, manifest_xml)
+        self._write_zip_file("META-INF/manifest.xml", manifest_xml.getvalue())
 
-        self.workbook.spreadsheet.addElement(worksheet)
+        self.zip_file.close()
 
-    def close(self):
-        self.workbook.save(self.output_name)
+    def abort(self):
+        # Don't leave a truncated file behind
+        if self.content is not None:
+            self.content.close()
+        self.zip_file.close()
+        os.remove(self.output_name)
 
 
 FORMATS = {"xlsx": XLSXOutput, "csv": CSVOutput, "ods": ODSOutput}
@@ -2,24 +2,32 @@
 
 from __future__ import print_function, unicode_literals
 
+import builtins
 import codecs
+import hashlib
+import json
 import os
 import sys
+import warnings
 from collections import OrderedDict, UserDict
 from warnings import warn
 
 import jsonref
 
+from flattentool import exceptions
 from flattentool.exceptions import (
     FlattenToolError,
     FlattenToolValueError,
     FlattenToolWarning,
 )
 from flattentool.i18n import _
+from flattentool.lib import FLATTENTOOL_VERSION, write_cache_file
 from flattentool.sheet import Sheet
 
 if sys.version_info[:2] > (3, 0):
     import pathlib
+    from urllib.parse import urlsplit
+    from urllib.request import url2pathname
 else:
     import urllib
 
@@ -98,6 +106,17 @@ class TitleLookup(UserDict):
             return key.replace(" ", "").lower() in self.data
 
 
+def copy_title_lookup(source, target):
+    """
+    Add a copy of each title in the TitleLookup ``source`` to ``target``.
+    """
+    for key, value in source.data.items():
+        title_lookup = TitleLookup()
+        title_lookup.property_name = value.property_name
+        copy_title_lookup(value, title_lookup)
+        target.data[key] = title_lookup
+
+
 class JsonLoaderLocalRefUsedWhenLocalRefsDisabled(FlattenToolError):
     pass
 
@@ -114,8 +133,86 @@ def is_ref_local(uri):
     return uri[:7].lower() != "http://" and uri[:8].lower() != "https://"
 
 
+# Increase this if the parsed state stored in the cache changes. The version
+# of flattentool is also part of the cache key.
+SCHEMA_CACHE_VERSION = 3
+
+
+def get_file_hash(path):
+    with open(path, "rb") as fp:
+        return hashlib.sha256(fp.read()).hexdigest()
+
+
+def title_lookup_to_json(title_lookup):
+    return [
+        title_lookup.property_name,
+        {key: title_lookup_to_json(value) for key, value in title_lookup.data.items()},
+    ]
+
+
+def title_lookup_from_json(data):
+    property_name, children = data
+    title_lookup = TitleLookup()
+    title_lookup.property_name = property_name
+    for key, child in children.items():
+        title_lookup.data[key] = title_lookup_from_json(child)
+    return title_lookup
+
+
+def sheet_to_json(sheet):
+    data = {
+        "name": sheet.name,
+        "root_id": sheet.root_id,
+        "id_columns": list(sheet.id_columns),
+        "columns": list(sheet.columns),
+        "titles": sheet.titles,
+    }
+    # Sub sheets have the title lookup for their part of the schema
+    if hasattr(sheet, "title_lookup"):
+        data["title_lookup"] = (
+            None
+            if sheet.title_lookup is None
+            else title_lookup_to_json(sheet.title_lookup)
+        )
+    return data
+
+
+def sheet_from_json(data):
+    sheet = Sheet(columns=data["columns"], root_id=data["root_id"], name=data["name"])
+    sheet.id_columns = data["id_columns"]
+    sheet.titles = dict(data["titles"])
+    if "title_lookup" in data:
+        sheet.title_lookup = (
+            None
+            if data["title_lookup"] is None
+            else title_lookup_from_json(data["title_lookup"])
+        )
+    return sheet
+
+
+def get_warning_category(name):
+    """
+    Return the warning class with the given name from flattentool.exceptions,
+    or the builtins, or UserWarning if there isn't one.
+    """
+    category = getattr(exceptions, name, None) or getattr(builtins, name, None)
+    if isinstance(category, type) and issubclass(category, Warning):
+        return category
+    return UserWarning
+
+
 class SchemaParser(object):
-    """Parse the fields of a JSON schema into a flattened structure."""
+    """
+    Parse the fields of a JSON schema into a flattened structure.
+
+    If ``cache_dir`` is given, the result of ``parse`` is stored in that
+    directory as JSON, keyed by the content of the schema file and the
+    options that affect parsing. The hash of each local file that the schema
+    references with $ref is stored with it. The next time the same schema is
+    parsed with the same options, and those files haven't changed, the schema
+    isn't loaded, and the result is read from the cache. Remote files that
+    the schema references aren't checked.
+    """
 
     def __init__(
         self,
@@ -128,6 +225,7 @@ class SchemaParser(object):
         truncation_length=3,
         exclude_deprecated_fields=False,
         convert_flags={},
+        cache_dir=None,
     ):
         self.sub_sheets = {}
         self.main_sheet = Sheet()
@@ -151,24 +249,28 @@ class SchemaParser(object):
             raise FlattenToolValueError(
                 _("Only one of schema_filename or root_schema_dict should be supplied")
             )
-        if schema_filename:
-            if isinstance(schema_filename, dict):
-                self.root_schema_dict = schema_filename
-            elif schema_filename.startswith("http"):
+        self.cache_dir = cache_dir
+        self.cache_filename = None
+        self.cached_state = None
+        # The hash of each local file loaded for a $ref, by path
+        self.ref_file_hashes = {}
+        if not schema_filename:
+            self.root_schema_dict = root_schema_dict
+        elif isinstance(schema_filename, dict):
+            self.root_schema_dict = schema_filename
+        else:
+            load_kwargs = {}
+            self.ref_loader = jsonref.jsonloader
+            if schema_filename.startswith("http"):
                 import requests
 
                 r = requests.get(schema_filename)
-                self.root_schema_dict = jsonref.loads(
-                    r.text, object_pairs_hook=OrderedDict
-                )
+                schema_text = r.text
             else:
+                with codecs.open(schema_filename, encoding="utf-8") as schema_file:
+                    schema_text = schema_file.read()
                 if disable_local_refs:
-                    with codecs.open(schema_filename, encoding="utf-8") as schema_file:
-                        self.root_schema_dict = jsonref.load(
-                            schema_file,
-                            object_pairs_hook=OrderedDict,
-                            loader=jsonloader_local_refs_disabled,
-                        )
+                    self.ref_loader = jsonloader_local_refs_disabled
                 else:
                     if sys.version_info[:2] > (3, 0):
                         base_uri = pathlib.Path(
@@ -179,17 +281,146 @@ class SchemaParser(object):
                             "file:",
                             urllib.pathname2url(os.path.abspath(schema_filename)),
                         )
-                    with codecs.open(schema_filename, encoding="utf-8") as schema_file:
-                        self.root_schema_dict = jsonref.load(
-                            schema_file,
-                            object_pairs_hook=OrderedDict,
-                            base_uri=base_uri,
+                    load_kwargs["base_uri"] = base_uri
+
+            if cache_dir is not None:
+                self.cache_filename = self.get_cache_filename(
+                    schema_text, load_kwargs.get("base_uri"), disable_local_refs
+                )
+                try:
+                    with open(
+                        os.path.join(cache_dir, self.cache_filename), encoding="utf-8"
+                    ) as cache_file:
+                        self.cached_state = self.cached_state_from_json(
+                            json.load(cache_file, object_pairs_hook=OrderedDict)
                         )
+                except Exception:
+                    # A missing or unreadable cache file (including one
+                    # written by an incompatible version) is a cache miss
+                    pass
 
-        else:
-            self.root_schema_dict = root_schema_dict
+            if self.cached_state is None:
+                self.root_schema_dict = jsonref.loads(
+                    schema_text,
+                    object_pairs_hook=OrderedDict,
+                    loader=self.load_ref,
+                    **load_kwargs
+                )
+            else:
+                # The schema itself isn't needed if it's already been parsed
+                self.root_schema_dict = None
+
+    def get_cache_filename(self, schema_text, base_uri, disable_local_refs):
+        """
+        Return the name of the cache file for the given schema, and the options
+        that affect parsing it.
+        """
+        key = hashlib.sha256(schema_text.encode("utf-8"))
+        key.update(
+            json.dumps(
+                [
+                    SCHEMA_CACHE_VERSION,
+                    FLATTENTOOL_VERSION,
+                    # Relative $refs are resolved from the schema's location
+                    base_uri,
+                    disable_local_refs,
+                    repr(self.do_rollup),
+                    self.root_id,
+                    self.use_titles,
+                    self.truncation_length,
+                    self.exclude_deprecated_fields,
+                    sorted(self.convert_flags.items()),
+                ]
+            ).encode("utf-8")
+        )
+        return "json-schema-{}.json".format(key.hexdigest())
+
+    def load_ref(self, uri, **kwargs):
+        """
+        Load a document that the schema references with $ref, and record the
+        hash of it if it's a local file, so that the cache can be checked.
+        """
+        if self.cache_filename is not None and urlsplit(uri).scheme == "file":
+            path = url2pathname(urlsplit(uri).path)
+            self.ref_file_hashes[path] = get_file_hash(path)
+        return self.ref_loader(uri, **kwargs)
+
+    def cached_state_to_json(self, caught_warnings):
+        """
+        Return the parsed state, the warnings and the hashes of the local
+        files that the schema references, to store in the cache file.
+        """
+        return {
+            "flattened": self.flattened,
+            "main_sheet": sheet_to_json(self.main_sheet),
+            "sub_sheets": [
+                [name, sheet_to_json(sheet)] for name, sheet in self.sub_sheets.items()
+            ],
+            "sub_sheet_titles": [
+                [list(key), value] for key, value in self.sub_sheet_titles.items()
+            ],
+            "title_lookup": title_lookup_to_json(self.title_lookup),
+            "rollup": sorted(self.rollup),
+            "warnings": [
+                [str(message), category.__name__]
+                for message, category in caught_warnings
+            ],
+            "ref_file_hashes": self.ref_file_hashes,
+        }
+
+    def cached_state_from_json(self, data):
+        """
+        Return the parsed state and warnings from the cache file ``data``, or
+        None if any local file that the schema references has changed.
+        """
+        for path, file_hash in data["ref_file_hashes"].items():
+            if not os.path.exists(path) or get_file_hash(path) != file_hash:
+                return None
+        state = {
+            "flattened": dict(data["flattened"]),
+            "main_sheet": sheet_from_json(data["main_sheet"]),
+            "sub_sheets": {
+                name: sheet_from_json(sheet) for name, sheet in data["sub_sheets"]
+            },
+            "sub_sheet_titles": {
+                tuple(key): value for key, value in data["sub_sheet_titles"]
+            },
+            "title_lookup": title_lookup_from_json(data["title_lookup"]),
+            "rollup": set(data["rollup"]),
+        }
+        caught_warnings = [
+            (message, get_warning_category(category))
+            for message, category in data["warnings"]
+        ]
+        return state, caught_warnings
 
     def parse(self):
+        if self.cached_state is not None:
+            state, caught_warnings = self.cached_state
+            self.__dict__.update(state)
+            for message, category in caught_warnings:
+                warn(message, category)
+            return
+
+        if self.cache_filename is None:
+            self.parse_fields()
+            return
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            self.parse_fields()
+        caught_warnings = [(w.message, w.category) for w in caught]
+        for message, category in caught_warnings:
+            warn(message, category)
+        write_cache_file(
+            self.cache_dir,
+            self.cache_filename,
+            json.dumps(self.cached_state_to_json(caught_warnings)).encode("utf-8"),
+        )
+
+    def parse_fields(self):
+        # The fields of each $ref target that can be reused, see get_ref_fields
+        self.ref_fields = {}
         fields = self.parse_schema_dict("", self.root_schema_dict)
         for field, title in fields:
             if self.use_titles:
@@ -203,6 +434,144 @@ class SchemaParser(object):
                     self.main_sheet.titles[field] = title
             else:
                 self.main_sheet.append(field)
+        # This refers to the schema, which isn't needed after parsing
+        self.ref_fields = {}
+
+    def is_plain_object_schema(self, schema_dict):
+        """
+        Return whether parsing an object's schema only adds fields, flattened
+        types and titles under the object, i.e. it has no sub sheets or
+        rollup, doesn't warn or raise, and doesn't add titles to the top
+        level title lookup.
+        """
+        if "properties" not in schema_dict:
+            return False
+        for property_name, property_schema_dict in schema_dict["properties"].items():
+            if property_name == "0":
+                # This would be removed from paths under an array
+                return False
+            property_type_set = get_property_type_set(property_schema_dict)
+            if "object" in property_type_set:
+                properties = property_schema_dict.get("properties", {})
+                if (
+                    self.convert_flags.get("wkt")
+                    and "type" in properties
+                    and "coordinates" in properties
+                ):
+                    continue
+                if (
+                    hasattr(property_schema_dict, "__reference__")
+                    and "title" in property_schema_dict.__reference__
+                ):
+                    title = property_schema_dict.__reference__["title"]
+                else:
+                    title = property_schema_dict.get("title")
+                # The titles under an object with no title are added to the
+                # top level title lookup
+                if not title:
+                    return False
+                if hasattr(property_schema_dict, "__reference__"):
+                    if self.get_ref_fields(property_schema_dict) is None:
+                        return False
+                elif not self.is_plain_object_schema(property_schema_dict):
+                    return False
+            elif "array" in property_type_set:
+                if "items" not in property_schema_dict:
+                    return False
+                type_set = get_property_type_set(property_schema_dict["items"])
+                if "string" in type_set or not type_set or "number" in type_set:
+                    continue
+                if (
+                    "array" not in type_set
+                    or "items" not in property_schema_dict["items"]
+                ):
+                    return False
+                nested_type_set = get_property_type_set(
+                    property_schema_dict["items"]["items"]
+                )
+                if "string" not in nested_type_set and "number" not in nested_type_set:
+                    return False
+            elif not property_type_set or property_type_set & {
+                "string",
+                "number",
+                "integer",
+                "boolean",
+            }:
+                continue
+            else:
+                return False
+        return True
+
+    def get_ref_fields(self, schema_dict):
+        """
+        If ``schema_dict`` is a $ref to an object's schema, and
+        is_plain_object_schema is true for it, return its fields, flattened
+        types and title lookup, worked out with no parent path. Otherwise,
+        return None.
+
+        These are worked out once for each $ref target.
+        """
+        if not hasattr(schema_dict, "__reference__"):
+            return None
+        # jsonref resolves each $ref to the same target to the same object
+        subject = schema_dict.__subject__
+        try:
+            return self.ref_fields[id(subject)][1]
+        except KeyError:
+            pass
+        ref_fields = None
+        if self.is_plain_object_schema(schema_dict):
+            flattened = {}
+            title_lookup = TitleLookup()
+            fields = list(
+                self.parse_schema_dict(
+                    "", schema_dict, title_lookup=title_lookup, flattened=flattened
+                )
+            )
+            ref_fields = (fields, flattened, title_lookup)
+        # The target is kept, so that its id isn't reused
+        self.ref_fields[id(subject)] = (subject, ref_fields)
+        return ref_fields
+
+    def parse_object_schema_dict(
+        self,
+        parent_path,
+        schema_dict,
+        parent_id_fields=None,
+        title_lookup=None,
+        parent_title="",
+        flattened=None,
+    ):
+        """
+        Return the fields of an object's schema, as parse_schema_dict does.
+
+        If get_ref_fields returns the fields of the schema, they are reused,
+        rather than parsing the schema again.
+        """
+        ref_fields = self.get_ref_fields(schema_dict)
+        if ref_fields is None:
+            return self.parse_schema_dict(
+                parent_path,
+                schema_dict,
+                parent_id_fields=parent_id_fields,
+                title_lookup=title_lookup,
+                parent_title=parent_title,
+                flattened=flattened,
+            )
+        fields, ref_flattened, ref_title_lookup = ref_fields
+        flattened = self.flattened if flattened is None else flattened
+        for key, value in ref_flattened.items():
+            # As in parse_schema_dict, "0"s are only removed from the paths of
+            # fields that aren't objects
+            if value == "object":
+                flattened[parent_path + "/" + key] = value
+            else:
+                flattened[(parent_path + "/").replace("/0/", "/") + key] = value
+        copy_title_lookup(
+            ref_title_lookup,
+            self.title_lookup if title_lookup is None else title_lookup,
+        )
+        return fields
 
     def parse_schema_dict(
         self,
@@ -211,11 +580,13 @@ class SchemaParser(object):
         parent_id_fields=None,
         title_lookup=None,
         parent_title="",
+        flattened=None,
     ):
         if parent_path:
             parent_path = parent_path + "/"
         parent_id_fields = parent_id_fields or []
         title_lookup = self.title_lookup if title_lookup is None else title_lookup
+        flattened = self.flattened if flattened is None else flattened
 
         if (
             "type" in schema_dict
@@ -231,6 +602,7 @@ class SchemaParser(object):
                         parent_id_fields=parent_id_fields,
                         title_lookup=title_lookup,
                         parent_title=parent_title,
+                        flattened=flattened,
                     ):
                         yield (field, child_title)
 
@@ -280,13 +652,13 @@ class SchemaParser(object):
                         and "type" in property_schema_dict.get("properties", {})
                         and "coordinates" in property_schema_dict.get("properties", {})
                     ):
-                        self.flattened[
+                        flattened[
                             parent_path.replace("/0/", "/") + property_name
                         ] = "geojson"
                         yield (property_name, title)
                         continue
-                    self.flattened[parent_path + property_name] = "object"
-                    for field, child_title in self.parse_schema_dict(
+                    flattened[parent_path + property_name] = "object"
+                    for field, child_title in self.parse_object_schema_dict(
                         parent_path + property_name,
                         property_schema_dict,
                         parent_id_fields=id_fields,
@@ -294,6 +666,7 @@ class SchemaParser(object):
                         parent_title=parent_title + title + ":"
                         if parent_title is not None and title
                         else None,
+                        flattened=flattened,
                     ):
                         yield (
                             property_name + "/" + field,
@@ -307,16 +680,16 @@ class SchemaParser(object):
 
                 elif "array" in property_type_set:
                     flattened_key = parent_path.replace("/0/", "/") + property_name
-                    self.flattened[flattened_key] = "array"
+                    flattened[flattened_key] = "array"
                     type_set = get_property_type_set(property_schema_dict["items"])
                     if "string" in type_set or not type_set:
-                        self.flattened[flattened_key] = "string_array"
+                        flattened[flattened_key] = "string_array"
                         yield property_name, title
                     elif "number" in type_set:
-                        self.flattened[flattened_key] = "number_array"
+                        flattened[flattened_key] = "number_array"
                         yield property_name, title
                     elif "array" in type_set:
-                        self.flattened[flattened_key] = "array_array"
+                        flattened[flattened_key] = "array_array"
                         nested_type_set = get_property_type_set(
                             property_schema_dict["items"]["items"]
                         )
@@ -367,6 +740,7 @@ class SchemaParser(object):
                             parent_title=parent_title + title + ":"
                             if parent_title is not None and title
                             else None,
+                            flattened=flattened,
                         )
 
                         rollup_fields = set()
@@ -432,26 +806,26 @@ class SchemaParser(object):
                     # We only check for date here, because its the only format
                     # for which we need to specially transform the input
                     if property_schema_dict.get("format") == "date":
-                        self.flattened[
+                        flattened[
                             parent_path.replace("/0/", "/") + property_name
                         ] = "date"
                     else:
-                        self.flattened[
+                        flattened[
                             parent_path.replace("/0/", "/") + property_name
                         ] = "string"
                     yield property_name, title
                 elif "number" in property_type_set:
-                    self.flattened[
+                    flattened[
                         parent_path.replace("/0/", "/") + property_name
                     ] = "number"
                     yield property_name, title
                 elif "integer" in property_type_set:
-                    self.flattened[
+                    flattened[
                         parent_path.replace("/0/", "/") + property_name
                     ] = "integer"
                     yield property_name, title
                 elif "boolean" in property_type_set:
-                    self.flattened[
+                    flattened[
                         parent_path.replace("/0/", "/") + property_name
                     ] = "boolean"
                     yield property_name, title
@@ -1,6 +1,15 @@
 import copy
+import os
+import pickle
+import shutil
+import tempfile
+import uuid
 
 import BTrees.IOBTree
+import BTrees.OOBTree
+import transaction
+import zc.zlibstorage
+import ZODB.FileStorage
 
 
 class Sheet(object):
@@ -10,6 +19,10 @@ class Sheet(object):
     """
 
     def __init__(self, columns=None, root_id="", name=None):
+        # The columns are kept as the keys of dicts with None values, which
+        # are in insertion order, so that finding a column doesn't get slower
+        # as the sheet gets wider. columns and id_columns are tuples, so use
+        # add_field (or assign a new list) to change them.
         self.id_columns = []
         self.columns = columns if columns else []
         self.titles = {}
@@ -17,14 +30,34 @@ class Sheet(object):
         self.root_id = root_id
         self.name = name
 
+    @property
+    def id_columns(self):
+        return tuple(self._id_columns)
+
+    @id_columns.setter
+    def id_columns(self, id_columns):
+        self._id_columns = {}
+        for column in id_columns:
+            self.add_field(column, id_field=True)
+
+    @property
+    def columns(self):
+        return tuple(self._columns)
+
+    @columns.setter
+    def columns(self, columns):
+        self._columns = {}
+        for column in columns:
+            self.add_field(column)
+
     @property
     def lines(self):
         return self._lines
 
     def add_field(self, field, id_field=False):
-        columns = self.id_columns if id_field else self.columns
+        columns = self._id_columns if id_field else self._columns
         if field not in columns:
-            columns.append(field)
+            columns[field] = None
 
     def append(self, item):
         self.add_field(item)
@@ -32,16 +65,94 @@ class Sheet(object):
     def __iter__(self):
         if self.root_id:
             yield self.root_id
-        for column in self.id_columns:
-            yield column
-        for column in self.columns:
-            yield column
+        yield from self._id_columns
+        yield from self._columns
+
+    def __contains__(self, column):
+        return (
+            (self.root_id and column == self.root_id)
+            or column in self._id_columns
+            or column in self._columns
+        )
 
     def append_line(self, flattened_dict):
         self._lines.append(flattened_dict)
 
+    def rows(self, header):
+        """
+        Yield a list of the values of each line, in the order of the given
+        header, with None for missing values.
+        """
+        for line in self.lines:
+            yield [line.get(column) for column in header]
+
+    def copy_columns_from(self, sheet):
+        self._id_columns = dict(sheet._id_columns)
+        self._columns = dict(sheet._columns)
+        self.titles = copy.deepcopy(sheet.titles)
+        self.root_id = sheet.root_id
+        if hasattr(sheet, "title_lookup"):
+            self.title_lookup = sheet.title_lookup
+
+
+class CompactSheet(Sheet):
+    """
+    A sheet that stores each line as the index of its keys (which are
+    usually the same for many lines) and a tuple of its values, rather than
+    as a dict, which is much smaller to pickle. Subclasses store and read
+    back these compact lines.
 
-class PersistentSheet(Sheet):
+    """
+
+    def __init__(self, columns=None, root_id="", name=None):
+        super().__init__(columns=columns, root_id=root_id, name=name)
+        # Each distinct tuple of keys of the lines, and the index of each
+        self.line_keys = []
+        self.line_keys_indexes = {}
+
+    def append_compact_line(self, compact_line):
+        raise NotImplementedError
+
+    @property
+    def compact_lines(self):
+        raise NotImplementedError
+
+    def append_line(self, flattened_dict):
+        keys = tuple(flattened_dict)
+        index = self.line_keys_indexes.get(keys)
+        if index is None:
+            index = self.line_keys_indexes[keys] = len(self.line_keys)
+            self.line_keys.append(keys)
+        self.append_compact_line((index, tuple(flattened_dict.values())))
+
+    @property
+    def lines(self):
+        line_keys = self.line_keys
+        for index, values in self.compact_lines:
+            yield dict(zip(line_keys[index], values))
+
+    def rows(self, header):
+        header_positions = {}
+        for position, column in enumerate(header):
+            header_positions.setdefault(column, []).append(position)
+        # The positions in the header of the values of the lines with each
+        # tuple of keys, worked out when first needed
+        keys_positions = {}
+        for index, values in self.compact_lines:
+            positions = keys_positions.get(index)
+            if positions is None:
+                positions = keys_positions[index] = [
+                    (value_index, position)
+                    for value_index, key in enumerate(self.line_keys[index])
+                    for position in header_positions.get(key, ())
+                ]
+            row = [None] * len(header)
+            for value_index, position in positions:
+                row[position] = values[value_index]
+            yield row
+
+
+class PersistentSheet(CompactSheet):
     """
     A sheet that is persisted in ZODB database.
 
@@ -55,7 +166,7 @@ class PersistentSheet(Sheet):
         connection.root.sheet_store[self.name] = BTrees.IOBTree.BTree()
 
     @property
-    def lines(self):
+    def compact_lines(self):
         # btrees iterate in key order.
         for key, value in self.connection.root.sheet_store[self.name].items():
             # 5000 chosen by trial and error.  The written row
@@ -65,15 +176,157 @@ class PersistentSheet(Sheet):
                 self.connection.cacheMinimize()
             yield value
 
-    def append_line(self, flattened_dict):
-        self.connection.root.sheet_store[self.name][self.index] = flattened_dict
+    def append_compact_line(self, compact_line):
+        self.connection.root.sheet_store[self.name][self.index] = compact_line
         self.index += 1
 
     @classmethod
     def from_sheet(cls, sheet, connection):
         instance = cls(name=sheet.name, connection=connection)
-        instance.id_columns = copy.deepcopy(sheet.id_columns)
-        instance.columns = copy.deepcopy(sheet.columns)
-        instance.titles = copy.deepcopy(sheet.titles)
-        instance.root_id = sheet.root_id
+        instance.copy_columns_from(sheet)
         return instance
+
+
+class SpillSheet(CompactSheet):
+    """
+    A sheet whose lines are appended to a file as pickle records, and read
+    back sequentially.
+
+    Other records (not lines) can be stored with append_record, and read
+    back from records.
+
+    """
+
+    def __init__(self, columns=None, root_id="", name=None, directory=None):
+        super().__init__(columns=columns, root_id=root_id, name=name)
+        self.index = 0
+        self.filename = os.path.join(directory, str(uuid.uuid4()))
+        self.file = open(self.filename, "wb")
+
+    @property
+    def records(self):
+        if not self.file.closed:
+            self.file.flush()
+        with open(self.filename, "rb") as lines_file:
+            # Only read the records that had been written when we started
+            for _ in range(self.index):
+                yield pickle.load(lines_file)
+
+    def append_record(self, record):
+        pickle.dump(record, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.index += 1
+
+    compact_lines = records
+    append_compact_line = append_record
+
+    def close(self):
+        self.file.close()
+
+    @classmethod
+    def from_sheet(cls, sheet, directory):
+        instance = cls(name=sheet.name, directory=directory)
+        instance.copy_columns_from(sheet)
+        return instance
+
+
+class MemorySheetStorage(object):
+    """
+    Keeps the lines of every sheet in memory.
+
+    """
+
+    def create_sheet(self, name):
+        return Sheet(name=name)
+
+    def sheet_from(self, sheet):
+        instance = Sheet(name=sheet.name)
+        instance.copy_columns_from(sheet)
+        return instance
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SpillSheetStorage(object):
+    """
+    Appends the lines of each sheet to its own temporary file.
+
+    """
+
+    def __init__(self):
+        # Use temp directories in OS agnostic way
+        self.directory = tempfile.mkdtemp(prefix="flattentool-")
+        self.sheets = []
+
+    def create_sheet(self, name):
+        sheet = SpillSheet(name=name, directory=self.directory)
+        self.sheets.append(sheet)
+        return sheet
+
+    def sheet_from(self, sheet):
+        instance = SpillSheet.from_sheet(sheet, self.directory)
+        self.sheets.append(instance)
+        return instance
+
+    def commit(self):
+        pass
+
+    def close(self):
+        for sheet in self.sheets:
+            sheet.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class ZODBSheetStorage(object):
+    """
+    Stores the lines of every sheet in a ZODB database, which is written to a
+    temporary file if persist is True.
+
+    """
+
+    def __init__(self, persist=True):
+        self.persist = persist
+        if persist:
+            # Use temp directories in OS agnostic way
+            self.zodb_db_location = (
+                tempfile.gettempdir() + "/flattentool-" + str(uuid.uuid4())
+            )
+            # zlibstorage lowers disk usage by a lot at very small performance cost
+            zodb_storage = zc.zlibstorage.ZlibStorage(
+                ZODB.FileStorage.FileStorage(self.zodb_db_location)
+            )
+            self.db = ZODB.DB(zodb_storage)
+        else:
+            # If None, in memory storage is used.
+            self.db = ZODB.DB(None)
+
+        self.connection = self.db.open()
+
+        # ZODB root, only objects attached here will be persisted
+        root = self.connection.root
+        # OOBTree means a btree with keys and values are objects (including strings)
+        root.sheet_store = BTrees.OOBTree.BTree()
+
+    def create_sheet(self, name):
+        return PersistentSheet(name=name, connection=self.connection)
+
+    def sheet_from(self, sheet):
+        return PersistentSheet.from_sheet(sheet, self.connection)
+
+    def commit(self):
+        transaction.commit()
+
+    def close(self):
+        self.connection.close()
+        self.db.close()
+        if self.persist:
+            os.remove(self.zodb_db_location)
+            os.remove(self.zodb_db_location + ".lock")
+            os.remove(self.zodb_db_location + ".index")
+            os.remove(self.zodb_db_location + ".tmp")
+
+
+SHEET_STORAGES = {"spill": SpillSheetStorage, "zodb": ZODBSheetStorage}
@@ -24,10 +24,14 @@ IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 """
+import hashlib
+import json
+import os
 from collections import OrderedDict
 from warnings import warn
 
 from flattentool.exceptions import FlattenToolWarning
+from flattentool.lib import FLATTENTOOL_VERSION, write_cache_file
 
 try:
     import lxml.etree as ET
@@ -47,6 +51,20 @@ except ImportError:
 namespaces = {"xsd": "http://www.w3.org/2001/XMLSchema"}
 
 
+class SchemaDict(OrderedDict):
+    """
+    An OrderedDict of the names of an element's children, in schema order,
+    with a dict of the position of each name in ``ranks``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ranks = {name: rank for rank, name in enumerate(self)}
+
+
+EMPTY_SCHEMA_DICT = SchemaDict()
+
+
 class XMLSchemaWalker(object):
     """
     Class for traversing one or more XML schemas.
@@ -60,6 +78,18 @@ class XMLSchemaWalker(object):
                   'iati-activities-schema.xsd'
         """
         self.trees = [ET.parse(schema) for schema in schemas]
+        # The top level elements of all the schemas, by tag and name. If more
+        # than one schema has the same element, the first one is used.
+        self.schema_elements = {}
+        for tree in self.trees:
+            for schema_element in tree.getroot():
+                name = schema_element.get("name")
+                if name is not None and isinstance(schema_element.tag, str):
+                    self.schema_elements.setdefault(
+                        (schema_element.tag, name), schema_element
+                    )
+        self.complexType_elements = {}
+        self.schema_dicts = {}
 
     def get_schema_element(self, tag_name, name_attribute):
         """
@@ -71,31 +101,30 @@ class XMLSchemaWalker(object):
                           the name of the element/type etc. being described,
                           e.g. iati-activities
         """
-        for tree in self.trees:
-            schema_element = tree.find(
-                "xsd:{0}[@name='{1}']".format(tag_name, name_attribute),
-                namespaces=namespaces,
-            )
-            if schema_element is not None:
-                return schema_element
-        return schema_element
+        return self.schema_elements.get(
+            ("{%s}%s" % (namespaces["xsd"], tag_name), name_attribute)
+        )
 
     def handle_complexType(self, complexType):
-        type_elements = []
-        if complexType is not None:
+        if complexType is None:
+            return []
+        if complexType not in self.complexType_elements:
+            type_elements = []
+            elements_type = complexType
             extension = complexType.find(
                 "xsd:complexContent/xsd:extension", namespaces=namespaces
             )
-            if extension:
+            # An extension with no children is treated as if there was no
+            # extension
+            if extension is not None and len(extension):
                 base = extension.attrib.get("base")
-                complexType = self.get_schema_element("complexType", base)
-                type_elements = self.handle_complexType(complexType)
-            else:
-                type_elements = []
-            type_elements += complexType.findall(
+                elements_type = self.get_schema_element("complexType", base)
+                type_elements = self.handle_complexType(elements_type)
+            type_elements += elements_type.findall(
                 "xsd:choice/xsd:element", namespaces=namespaces
-            ) + complexType.findall("xsd:sequence/xsd:element", namespaces=namespaces)
-        return type_elements
+            ) + elements_type.findall("xsd:sequence/xsd:element", namespaces=namespaces)
+            self.complexType_elements[complexType] = type_elements
+        return list(self.complexType_elements[complexType])
 
     def element_loop(self, element, path):
         """
@@ -134,37 +163,69 @@ class XMLSchemaWalker(object):
 
     def create_schema_dict(self, parent_name, parent_element=None):
         """
-        Create a nested OrderedDict representing the structure (and order!) of
+        Create a nested SchemaDict representing the structure (and order!) of
         elements in the provided schema.
+
+        The SchemaDict for each schema element is only created once, so the
+        same SchemaDict is used everywhere an element is referenced.
         """
         if parent_element is None:
             parent_element = self.get_schema_element("element", parent_name)
         if parent_element is None:
-            return {}
+            return EMPTY_SCHEMA_DICT
+
+        if parent_element not in self.schema_dicts:
+            self.schema_dicts[parent_element] = SchemaDict(
+                [
+                    (name, self.create_schema_dict(name, element))
+                    for name, element, _, _, _ in self.element_loop(parent_element, "")
+                ]
+            )
+        return self.schema_dicts[parent_element]
 
-        return OrderedDict(
-            [
-                (name, self.create_schema_dict(name, element))
-                for name, element, _, _, _ in self.element_loop(parent_element, "")
-            ]
-        )
+
+def create_schema_dict(schemas, parent_name, cache_dir=None):
+    """
+    Return XMLSchemaWalker(schemas).create_schema_dict(parent_name).
+
+    If ``cache_dir`` is given, the result is stored in that directory, and
+    is loaded from there next time for the same schema files (by content)
+    and ``parent_name``, instead of walking the schemas again.
+    """
+    if cache_dir is None:
+        return XMLSchemaWalker(schemas).create_schema_dict(parent_name)
+
+    key = hashlib.sha256(json.dumps([FLATTENTOOL_VERSION, parent_name]).encode("utf-8"))
+    for schema in schemas:
+        with open(schema, "rb") as fp:
+            key.update(hashlib.sha256(fp.read()).digest())
+    cache_filename = "xml-schema-{}.json".format(key.hexdigest())
+    try:
+        with open(os.path.join(cache_dir, cache_filename), encoding="utf-8") as fp:
+            return json.load(fp, object_pairs_hook=SchemaDict)
+    except (OSError, ValueError):
+        pass
+
+    schema_dict = XMLSchemaWalker(schemas).create_schema_dict(parent_name)
+    write_cache_file(cache_dir, cache_filename, json.dumps(schema_dict).encode("utf-8"))
+    return schema_dict
 
 
 def sort_element(element, schema_subdict):
     """
     Sort the given element's children according to the order of schema_subdict.
     """
+    ranks = getattr(schema_subdict, "ranks", None)
+    if ranks is None:
+        ranks = {name: rank for rank, name in enumerate(schema_subdict)}
+    unknown_rank = len(ranks) + 1
+
     children = list(element)
-    for child in children:
-        element.remove(child)
-    keys = list(schema_subdict.keys())
-
-    def index_key(x):
-        if x.tag in keys:
-            return keys.index(x.tag)
-        else:
-            return len(keys) + 1
-
-    for child in sorted(children, key=index_key):
-        element.append(child)
-        sort_element(child, schema_subdict.get(child.tag, {}))
+    sorted_children = sorted(
+        children, key=lambda child: ranks.get(child.tag, unknown_rank)
+    )
+    if sorted_children != children:
+        element[:] = sorted_children
+
+    for child in sorted_children:
+        sort_element(child, schema_subdict.get(child.tag, EMPTY_SCHEMA_DICT))
@@ -1169,6 +1169,20 @@ def run(sheets, schema=None, source_maps=False):
         ) = spreadsheet_input.fancy_unflatten(
             with_cell_source_map=True, with_heading_source_map=True
         )
+        # Streaming the source maps should give the same items in the same order
+        (
+            _result,
+            cell_source_map_items,
+            streamed_heading_source_map_data,
+        ) = spreadsheet_input.fancy_unflatten(
+            with_cell_source_map=True,
+            with_heading_source_map=True,
+            stream_source_maps=True,
+        )
+        assert list(cell_source_map_items) == list(cell_source_map_data.items())
+        assert list(streamed_heading_source_map_data.items()) == list(
+            heading_source_map_data.items()
+        )
         return result, cell_source_map_data, heading_source_map_data
     else:
         return spreadsheet_input.unflatten(), None, None
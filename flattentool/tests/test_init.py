@@ -2,12 +2,14 @@
 from __future__ import unicode_literals
 
 import datetime
+import io
 import json
 from decimal import Decimal
 
 import pytest
 
-from flattentool import decimal_datetime_default, flatten, unflatten
+from flattentool import decimal_datetime_default, flatten, unflatten, write_json_object
+from flattentool.input import CSVInput
 
 
 def original_cell_and_row_locations(data):
@@ -55,6 +57,10 @@ def original_headings(heading_data):
 def test_decimal_datetime_default():
     assert json.dumps(Decimal("1.2"), default=decimal_datetime_default) == "1.2"
     assert json.dumps(Decimal("42"), default=decimal_datetime_default) == "42"
+    assert json.dumps(Decimal("42.0"), default=decimal_datetime_default) == "42"
+    assert (
+        json.dumps(Decimal("1.2"), default=decimal_datetime_default, indent=4) == "1.2"
+    )
     assert (
         json.dumps(datetime.datetime(2024, 1, 1), default=decimal_datetime_default)
         == '"2024-01-01 00:00:00"'
@@ -1007,6 +1013,270 @@ def test_unflatten_empty(tmpdir):
     )
 
 
+@pytest.mark.parametrize("with_cell_source_map", [True, False])
+def test_unflatten_heading_source_map(tmpdir, with_cell_source_map):
+    """
+    The cell source map is worked out as it is written, and the heading source
+    map is only complete once that has finished, so it must be written after.
+    It should be the same as the one that fancy_unflatten returns when the
+    source maps aren't streamed.
+    """
+    input_dir = tmpdir.ensure("release_input", dir=True)
+    write_grouped_release_input(input_dir)
+    spreadsheet_input = CSVInput(input_name=input_dir.strpath, root_id="ocid")
+    spreadsheet_input.read_sheets()
+    (
+        _,
+        expected_cell_source_map,
+        expected_heading_source_map,
+    ) = spreadsheet_input.fancy_unflatten(True, True)
+    assert expected_heading_source_map
+
+    unflatten(
+        input_dir.strpath,
+        input_format="csv",
+        output_name=tmpdir.join("release.json").strpath,
+        root_id="ocid",
+        cell_source_map=tmpdir.join("cell_source_map.json").strpath
+        if with_cell_source_map
+        else None,
+        heading_source_map=tmpdir.join("heading_source_map.json").strpath,
+    )
+    assert json.load(tmpdir.join("heading_source_map.json")) == json.loads(
+        json.dumps(expected_heading_source_map)
+    )
+    if with_cell_source_map:
+        assert json.load(tmpdir.join("cell_source_map.json")) == json.loads(
+            json.dumps(expected_cell_source_map)
+        )
+
+
+def write_grouped_release_input(input_dir):
+    input_dir.join("main.csv").write(
+        "ocid,id,testA,test/id,test/C\n"
+        "1,2,3,4,5\n"
+        "1,2a,3a,4a,5a\n"
+        ",,,,\n"
+        "6,7,8,9,10\n"
+        "6,7a,8a,9a,10a\n"
+        "11,12,13,14,15\n"
+    )
+    input_dir.join("subsheet.csv").write(
+        "ocid,id,sub/0/id,sub/0/testD,sub/0/test2/E,sub/0/test2/F\n"
+        "1,2,S1,11,12,13\n"
+        "1,2a,S1,14,15,16\n"
+        "1,2,S2,17,18,19\n"
+        "6,7,S1,20,21,22\n"
+        "16,17,S1,20,21,22\n"
+    )
+    input_dir.join("subsubsheet.csv").write(
+        "ocid,id,sub/0/id,sub/0/subsub/0/testG\n" "1,2,S1,23\n" "6,7,S1,24\n"
+    )
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"root_is_list": True},
+        {"base_json": "flattentool/tests/fixtures/tenders_releases_base.json"},
+        {"root_list_path": "releases"},
+        {"json_lines": True},
+    ],
+)
+def test_unflatten_streaming(tmpdir, kwargs):
+    input_dir = tmpdir.ensure("release_input", dir=True)
+    write_grouped_release_input(input_dir)
+    unflatten(
+        input_dir.strpath,
+        input_format="csv",
+        output_name=tmpdir.join("release.json").strpath,
+        root_id="ocid",
+        **kwargs,
+    )
+    unflatten(
+        input_dir.strpath,
+        input_format="csv",
+        output_name=tmpdir.join("release_streaming.json").strpath,
+        root_id="ocid",
+        streaming=True,
+        **kwargs,
+    )
+    assert (
+        tmpdir.join("release_streaming.json").read()
+        == tmpdir.join("release.json").read()
+    )
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"root_is_list": True},
+        {"base_json": "flattentool/tests/fixtures/tenders_releases_base.json"},
+        {"streaming": True},
+    ],
+)
+def test_unflatten_compact(tmpdir, kwargs):
+    input_dir = tmpdir.ensure("release_input", dir=True)
+    write_grouped_release_input(input_dir)
+    unflatten(
+        input_dir.strpath,
+        input_format="csv",
+        output_name=tmpdir.join("release.json").strpath,
+        root_id="ocid",
+        **kwargs,
+    )
+    unflatten(
+        input_dir.strpath,
+        input_format="csv",
+        output_name=tmpdir.join("release_compact.json").strpath,
+        root_id="ocid",
+        compact=True,
+        **kwargs,
+    )
+    compact = tmpdir.join("release_compact.json").read()
+    assert compact == json.dumps(
+        json.loads(tmpdir.join("release.json").read()),
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+
+
+def test_unflatten_streaming_json_lines(tmpdir):
+    input_dir = tmpdir.ensure("release_input", dir=True)
+    write_grouped_release_input(input_dir)
+    unflatten(
+        input_dir.strpath,
+        input_format="csv",
+        output_name=tmpdir.join("release.json").strpath,
+    )
+    unflatten(
+        input_dir.strpath,
+        input_format="csv",
+        output_name=tmpdir.join("release.jsonl").strpath,
+        root_id="ocid",
+        streaming=True,
+        json_lines=True,
+    )
+    lines = tmpdir.join("release.jsonl").read().split("\n")
+    assert lines[-1] == ""
+    assert [json.loads(line) for line in lines[:-1]] == json.load(
+        tmpdir.join("release.json")
+    )["main"]
+
+
+def test_unflatten_streaming_not_grouped(tmpdir, recwarn):
+    input_dir = tmpdir.ensure("release_input", dir=True)
+    input_dir.join("main.csv").write("ocid,id,a\n1,2,3\n4,5,6\n")
+    input_dir.join("subsheet.csv").write("ocid,id,b\n4,5,6\n1,2,3\n")
+    unflatten(
+        input_dir.strpath,
+        input_format="csv",
+        output_name=tmpdir.join("release.json").strpath,
+        root_id="ocid",
+        streaming=True,
+    )
+    assert json.load(tmpdir.join("release.json")) == {
+        "main": [
+            {"ocid": "1", "id": "2", "a": "3"},
+            {"ocid": "4", "id": "5", "a": "6", "b": "6"},
+            {"ocid": "1", "id": "2", "b": "3"},
+        ]
+    }
+    assert [str(w.message) for w in recwarn] == [
+        'The rows for ocid "1" are not grouped together in every sheet, so they have been output as more than one object.'
+    ]
+
+
+def write_ungrouped_release_input(input_dir):
+    input_dir.join("main.csv").write(
+        "ocid,id,testA,test/id,test/C\n"
+        "1,2,3,4,5\n"
+        "6,7,8,9,10\n"
+        "1,2a,3a,4a,5a\n"
+        ",,,,\n"
+        "11,12,13,14,15\n"
+        "6,7a,8a,9a,10a\n"
+    )
+    input_dir.join("subsheet.csv").write(
+        "ocid,id,sub/0/id,sub/0/testD,sub/0/test2/E,sub/0/test2/F\n"
+        "16,17,S1,20,21,22\n"
+        "1,2,S1,11,12,13\n"
+        "6,7,S1,20,21,22\n"
+        "1,2a,S1,14,15,16\n"
+        "1,2,S2,17,18,19\n"
+    )
+    input_dir.join("subsubsheet.csv").write(
+        "ocid,id,sub/0/id,sub/0/subsub/0/testG\n" "6,7,S1,24\n" "1,2,S1,23\n"
+    )
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"root_is_list": True},
+        {"json_lines": True},
+    ],
+)
+@pytest.mark.parametrize("run_size", [1, 2, 10000])
+def test_unflatten_external_sort(tmpdir, monkeypatch, kwargs, run_size):
+    monkeypatch.setattr("flattentool.input.EXTERNAL_SORT_RUN_SIZE", run_size)
+    input_dir = tmpdir.ensure("release_input", dir=True)
+    write_ungrouped_release_input(input_dir)
+    unflatten(
+        input_dir.strpath,
+        input_format="csv",
+        output_name=tmpdir.join("release.json").strpath,
+        root_id="ocid",
+        **kwargs,
+    )
+    unflatten(
+        input_dir.strpath,
+        input_format="csv",
+        output_name=tmpdir.join("release_sorted.json").strpath,
+        root_id="ocid",
+        external_sort=True,
+        **kwargs,
+    )
+    assert (
+        tmpdir.join("release_sorted.json").read() == tmpdir.join("release.json").read()
+    )
+
+
+def test_unflatten_external_sort_many_runs(tmpdir, monkeypatch):
+    resource = pytest.importorskip("resource")
+    monkeypatch.setattr("flattentool.input.EXTERNAL_SORT_RUN_SIZE", 1)
+    input_dir = tmpdir.ensure("release_input", dir=True)
+    input_dir.join("main.csv").write(
+        "ocid,id,a\n" + "".join(f"{i * 7 % 100},{i},{i}\n" for i in range(1000))
+    )
+    unflatten(
+        input_dir.strpath,
+        input_format="csv",
+        output_name=tmpdir.join("release.json").strpath,
+        root_id="ocid",
+    )
+    # Each run is a temporary file, so there are too many runs to have a
+    # file open for each of them at once
+    soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (256, hard_limit))
+    try:
+        unflatten(
+            input_dir.strpath,
+            input_format="csv",
+            output_name=tmpdir.join("release_sorted.json").strpath,
+            root_id="ocid",
+            external_sort=True,
+        )
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft_limit, hard_limit))
+    assert (
+        tmpdir.join("release_sorted.json").read() == tmpdir.join("release.json").read()
+    )
+
+
 def test_unflatten_csv_utf8(tmpdir):
     input_dir = tmpdir.ensure("release_input", dir=True)
     input_dir.join("main.csv").write_text("ocid,id\n1,éαГ😼𝒞人\n", encoding="utf8")
@@ -1462,3 +1732,17 @@ def test_flatten_xml(tmpdir):
         root_list_path="iati-activity",
         xml=True,
     )
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {},
+        {"a": []},
+        {"a/0/b": [["main", "A", 2, "a/0/b"]], "": [], "é": {"c": [1, {}]}},
+    ],
+)
+def test_write_json_object(data):
+    fp = io.StringIO()
+    write_json_object(fp, data.items())
+    assert fp.getvalue() == json.dumps(data, indent=4, ensure_ascii=False)
@@ -11,7 +11,15 @@ import sys
 
 import pytest
 
-from flattentool.input import NullCharacterFilter, path_search
+from flattentool.input import (
+    NullCharacterFilter,
+    compile_path_plan,
+    convert_array,
+    convert_number,
+    convert_untyped,
+    path_search,
+)
+from flattentool.schema import SchemaParser
 
 
 def test_path_search():
@@ -60,3 +68,51 @@ def test_null_character_filter():
         next(csv.reader(NullCharacterFilter(io.StringIO("\0"))))
     except Exception as e:
         pytest.fail(str(e))
+
+
+def test_compile_path_plan():
+    parser = SchemaParser(
+        root_schema_dict={
+            "properties": {
+                "a": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"b": {"type": "number"}},
+                    },
+                },
+                "c": {"type": "string"},
+            }
+        }
+    )
+    parser.parse()
+    assert compile_path_plan(parser, "a/0/b", False) == (
+        False,
+        [
+            ("a", "a", "array", "0", 0, True, False, None, convert_array),
+            ("b", "a/b", "number", "", -1, True, False, None, convert_number),
+        ],
+    )
+    assert compile_path_plan(parser, "a[]/b", True) == (
+        False,
+        [
+            ("a", "a", "array", "b", -1, False, False, None, convert_untyped),
+            ("b", "a/b", "number", "", -1, False, True, None, convert_number),
+        ],
+    )
+    assert compile_path_plan(parser, "0/c/1", False) == (
+        True,
+        [
+            (
+                "c",
+                "c",
+                "array",
+                "1",
+                1,
+                True,
+                False,
+                "There is an array at 'c' when the schema says there should be a 'string'",
+                convert_array,
+            ),
+        ],
+    )
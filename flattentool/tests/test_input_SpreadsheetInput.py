@@ -7,11 +7,16 @@ from __future__ import unicode_literals
 
 import datetime
 import sys
+import zipfile
 from collections import OrderedDict
 from decimal import Decimal
 
+import odf.table
+import odf.text
+import openpyxl
 import pytest
 import pytz
+from odf.opendocument import OpenDocumentSpreadsheet
 
 from flattentool.input import (
     CSVInput,
@@ -20,6 +25,8 @@ from flattentool.input import (
     XLSXInput,
     convert_type,
 )
+from flattentool.ODSReader import ODSReader
+from flattentool.schema import TitleLookup
 
 
 class ListInput(SpreadsheetInput):
@@ -42,6 +49,96 @@ def test_spreadsheetinput_base_fails():
         spreadsheet_input.get_sheet_lines("test")
 
 
+def test_convert_dict_titles():
+    class CountingTitleLookup(TitleLookup):
+        lookups = 0
+
+        def lookup_header(self, title_header):
+            CountingTitleLookup.lookups += 1
+            return super().lookup_header(title_header)
+
+    title_lookup = CountingTitleLookup()
+    title_lookup["Identifier"] = TitleLookup()
+    title_lookup["Identifier"].property_name = "id"
+    spreadsheet_input = SpreadsheetInput()
+    lines = [
+        OrderedDict([("Identifier", 1), ("other", "a")]),
+        OrderedDict([("other", "b"), ("Identifier", 2)]),
+    ]
+    assert list(spreadsheet_input.convert_dict_titles(lines, title_lookup)) == [
+        OrderedDict([("id", 1), ("other", "a")]),
+        OrderedDict([("other", "b"), ("id", 2)]),
+    ]
+    # Each heading is only looked up once
+    assert CountingTitleLookup.lookups == 2
+
+
+@pytest.mark.parametrize("with_source_maps", [True, False])
+def test_fancy_unflatten_stream_result(with_source_maps):
+    def make_input():
+        spreadsheet_input = ListInput(
+            sheets=OrderedDict(
+                [
+                    (
+                        "main",
+                        [
+                            OrderedDict([("ocid", "a"), ("id", "1")]),
+                            OrderedDict([("ocid", "b"), ("id", "2")]),
+                            OrderedDict([("ocid", "a"), ("id", "3")]),
+                        ],
+                    ),
+                    (
+                        "sub",
+                        [OrderedDict([("ocid", "b"), ("id", "2"), ("x/0/y", "z")])],
+                    ),
+                ]
+            ),
+            root_id="ocid",
+        )
+        spreadsheet_input.read_sheets()
+        return spreadsheet_input
+
+    expected = make_input().fancy_unflatten(with_source_maps, with_source_maps)
+    spreadsheet_input = make_input()
+    result, cell_source_map, heading_source_map = spreadsheet_input.fancy_unflatten(
+        with_source_maps, with_source_maps, stream_result=True
+    )
+    assert not isinstance(result, list)
+    # Every sheet has already been read
+    spreadsheet_input.sheets = None
+    assert (
+        list(result)
+        == expected[0]
+        == [
+            OrderedDict([("ocid", "a"), ("id", "1")]),
+            OrderedDict([("ocid", "a"), ("id", "3")]),
+            OrderedDict(
+                [("ocid", "b"), ("id", "2"), ("x", [OrderedDict([("y", "z")])])]
+            ),
+        ]
+    )
+    assert cell_source_map == expected[1]
+    assert heading_source_map == expected[2]
+
+
+@pytest.mark.parametrize("stream_source_maps", [True, False])
+def test_fancy_unflatten_cell_source_map_collision(monkeypatch, stream_source_maps):
+    def iter_cell_source_map(path, cell_trees, heading_source_map=None):
+        yield "main/0/id", [("main", "A", 2, "id")]
+        yield "main/0/id", [("main", "A", 3, "id")]
+
+    monkeypatch.setattr("flattentool.input.iter_cell_source_map", iter_cell_source_map)
+    spreadsheet_input = ListInput(
+        sheets={"main": [OrderedDict([("id", "1")])]}, root_id=""
+    )
+    spreadsheet_input.read_sheets()
+    with pytest.raises(AssertionError, match="Row/cell collision: main/0/id"):
+        _, cell_source_map, _ = spreadsheet_input.fancy_unflatten(
+            True, True, stream_source_maps=stream_source_maps
+        )
+        list(cell_source_map)
+
+
 class TestSuccessfulInput(object):
     def test_csv_input(self, tmpdir):
         main = tmpdir.join("main.csv")
@@ -63,6 +160,43 @@ class TestSuccessfulInput(object):
             {"colC": "cell7", "colD": "cell8"},
         ]
 
+    def test_csv_input_uneven_rows(self, tmpdir):
+        main = tmpdir.join("main.csv")
+        main.write("colA,colB,colA\ncell1\n\ncell3,cell4,cell5,cell6\nce\0ll7,cell8")
+
+        csvinput = CSVInput(input_name=tmpdir.strpath)
+
+        csvinput.read_sheets()
+
+        assert csvinput.get_sheet_headings("main") == ["colA", "colB", "colA"]
+        lines = list(csvinput.get_sheet_lines("main"))
+        assert lines == [
+            {"colA": None, "colB": None},
+            {"colA": "cell5", "colB": "cell4"},
+            {"colA": None, "colB": "cell8"},
+        ]
+        assert [list(line) for line in lines] == [["colA", "colB"]] * 3
+
+    def test_csv_input_configuration(self, tmpdir):
+        main = tmpdir.join("main.csv")
+        main.write(
+            "#,skipRows 1,headerRows 2\nskipped\ncolA,colB\nColumn A,Column B\n"
+            "cell1,cell2"
+        )
+
+        csvinput = CSVInput(input_name=tmpdir.strpath)
+
+        csvinput.read_sheets()
+
+        assert csvinput.sheet_configuration["main"] == {
+            "skipRows": 1,
+            "headerRows": 2,
+        }
+        assert csvinput.get_sheet_headings("main") == ["colA", "colB"]
+        assert list(csvinput.get_sheet_lines("main")) == [
+            {"colA": "cell1", "colB": "cell2"},
+        ]
+
     def test_xlsx_input(self):
         xlsxinput = XLSXInput(input_name="flattentool/tests/fixtures/xlsx/basic.xlsx")
 
@@ -78,6 +212,65 @@ class TestSuccessfulInput(object):
             {"colC": "cell7", "colD": "cell8"},
         ]
 
+    def test_xlsx_input_configuration(self, tmpdir):
+        workbook = openpyxl.Workbook()
+        worksheet = workbook.active
+        worksheet.title = "main"
+        worksheet.append(["#", "skipRows 1", "headerRows 2"])
+        worksheet.append(["skipped"])
+        worksheet.append(["colA", "colB"])
+        worksheet.append(["Column A", "Column B"])
+        worksheet.append(["cell1", "cell2"])
+        worksheet.append(["cell3"])
+        workbook.save(tmpdir.join("test.xlsx").strpath)
+
+        xlsxinput = XLSXInput(input_name=tmpdir.join("test.xlsx").strpath)
+        xlsxinput.read_sheets()
+
+        # The rows are read lazily, rather than loading the whole workbook
+        assert xlsxinput.workbook.read_only
+        assert xlsxinput.sheet_configuration["main"] == {
+            "skipRows": 1,
+            "headerRows": 2,
+        }
+        assert xlsxinput.get_sheet_headings("main") == ["colA", "colB", None]
+        assert list(xlsxinput.get_sheet_lines("main")) == [
+            {"colA": "cell1", "colB": "cell2", None: None},
+            {"colA": "cell3", "colB": None, None: None},
+        ]
+
+    def test_xlsx_input_wrong_dimensions(self, tmpdir):
+        workbook = openpyxl.Workbook()
+        worksheet = workbook.active
+        worksheet.title = "main"
+        worksheet.append(["colA", "colB"])
+        worksheet.append(["cell1", "cell2"])
+        worksheet.append(["cell3"])
+        workbook.save(tmpdir.join("good.xlsx").strpath)
+        # Record the wrong size for the sheet, as some other writers do
+        with zipfile.ZipFile(tmpdir.join("good.xlsx").strpath) as good, zipfile.ZipFile(
+            tmpdir.join("test.xlsx").strpath, "w"
+        ) as bad:
+            for info in good.infolist():
+                data = good.read(info)
+                if info.filename == "xl/worksheets/sheet1.xml":
+                    data = data.replace(
+                        b'<dimension ref="A1:B3"', b'<dimension ref="A1:A1"'
+                    )
+                bad.writestr(info, data)
+
+        xlsxinput = XLSXInput(input_name=tmpdir.join("test.xlsx").strpath)
+        xlsxinput.read_sheets()
+
+        assert xlsxinput.get_sheet_headings("main") == ["colA", "colB"]
+        assert list(xlsxinput.get_sheet_lines("main")) == [
+            {"colA": "cell1", "colB": "cell2"},
+            {"colA": "cell3", "colB": None},
+        ]
+
+        xlsxinput.close()
+        assert xlsxinput.workbook._archive.fp is None
+
     def test_ods_input(self):
         odsinput = ODSInput(input_name="flattentool/tests/fixtures/ods/basic.ods")
 
@@ -111,6 +304,117 @@ class TestSuccessfulInput(object):
             {"colC": "cell7", "colD": "cell8"},
         ]
 
+    def test_ods_input_repeated(self, tmpdir):
+        def row(*cells, repeat=1):
+            table_row = odf.table.TableRow(numberrowsrepeated=repeat)
+            for value, columns in cells:
+                cell = odf.table.TableCell(numbercolumnsrepeated=columns)
+                if value:
+                    cell.addElement(odf.text.P(text=value))
+                table_row.addElement(cell)
+            return table_row
+
+        document = OpenDocumentSpreadsheet()
+        table = odf.table.Table(name="main")
+        table.addElement(row(("colA", 1), ("", 2), ("colB", 1)))
+        table.addElement(row(("cell1", 2), ("", 1024), repeat=2))
+        table.addElement(row(("", 1024), repeat=3))
+        table.addElement(row(("cell2", 1)))
+        # LibreOffice ends sheets with a huge number of repeated empty rows
+        table.addElement(row(("", 1024), repeat=1048570))
+        document.spreadsheet.addElement(table)
+        document.save(tmpdir.join("test.ods").strpath)
+
+        odsinput = ODSInput(input_name=tmpdir.join("test.ods").strpath)
+        odsinput.read_sheets()
+
+        assert odsinput.get_sheet_headings("main") == ["colA", None, None, "colB"]
+        assert odsinput.workbook.getSheet("main") == [
+            ["colA", None, None, "colB"],
+            ["cell1", "cell1"],
+            ["cell1", "cell1"],
+            [],
+            [],
+            [],
+            ["cell2"],
+        ]
+        assert list(odsinput.get_sheet_lines("main")) == [
+            {"colA": "cell1", None: None},
+            {"colA": "cell1", None: None},
+            {"colA": "cell2"},
+        ]
+
+    def test_ods_input_repeated_runs(self, tmpdir):
+        document = OpenDocumentSpreadsheet()
+        table = odf.table.Table(name="main")
+        table.addElement(odf.table.TableRow())
+        # A styled row, repeated a million times, with a repeated cell
+        table_row = odf.table.TableRow(numberrowsrepeated=1000000)
+        cell = odf.table.TableCell(numbercolumnsrepeated=3)
+        cell.addElement(odf.text.P(text="x"))
+        table_row.addElement(cell)
+        table.addElement(table_row)
+        document.spreadsheet.addElement(table)
+        document.save(tmpdir.join("test.ods").strpath)
+
+        reader = ODSReader(tmpdir.join("test.ods").strpath)
+        sheet = reader.SHEETS["main"]
+        # Each run of rows is stored once, with its cells as runs too
+        assert list(reader.iter_row_records(sheet.offset, sheet.record_count)) == [
+            ([], 1),
+            ([("x", 3)], 1000000),
+        ]
+        assert sheet.row_count == 1000001
+        assert sheet.leading_rows == [[], ["x", "x", "x"]]
+        assert sheet.get_row(1000000) == ["x", "x", "x"]
+        with pytest.raises(IndexError):
+            sheet.get_row(1000001)
+
+        # The rows are expanded lazily, as separate lists
+        rows = iter(sheet)
+        assert next(rows) == []
+        row = next(rows)
+        row.append("y")
+        assert next(rows) == ["x", "x", "x"]
+        reader.close()
+
+    def test_ods_input_parsed_once(self, tmpdir, monkeypatch):
+        document = OpenDocumentSpreadsheet()
+        for sheet_name in ("main", "sub1", "sub2"):
+            table = odf.table.Table(name=sheet_name)
+            for value in ("col", sheet_name + "1", sheet_name + "2"):
+                table_row = odf.table.TableRow()
+                cell = odf.table.TableCell()
+                cell.addElement(odf.text.P(text=value))
+                table_row.addElement(cell)
+                table.addElement(table_row)
+            document.spreadsheet.addElement(table)
+        document.save(tmpdir.join("test.ods").strpath)
+
+        iterparse_calls = []
+        iterparse = ODSReader.iterparse
+
+        def counting_iterparse(self):
+            iterparse_calls.append(True)
+            return iterparse(self)
+
+        monkeypatch.setattr(ODSReader, "iterparse", counting_iterparse)
+        odsinput = ODSInput(input_name=tmpdir.join("test.ods").strpath)
+        odsinput.read_sheets()
+
+        # The sheets can be read at the same time
+        assert list(
+            zip(*(odsinput.get_sheet_lines(name) for name in odsinput.sub_sheet_names))
+        ) == [
+            ({"col": "main1"}, {"col": "sub11"}, {"col": "sub21"}),
+            ({"col": "main2"}, {"col": "sub12"}, {"col": "sub22"}),
+        ]
+        assert odsinput.workbook.getSheet("sub2") == [["col"], ["sub21"], ["sub22"]]
+        assert len(iterparse_calls) == 1
+
+        odsinput.close()
+        assert odsinput.workbook.rows_file.closed
+
     def test_ods_vertical(self):
         odsinput = ODSInput(
             input_name="flattentool/tests/fixtures/ods/basic_transpose.ods",
@@ -10,6 +10,7 @@ from collections import OrderedDict
 
 import pytest
 
+from flattentool.input import extract_list_to_error_path, extract_list_to_value
 from flattentool.schema import SchemaParser
 
 from .test_input_SpreadsheetInput import ListInput
@@ -851,6 +852,55 @@ def test_unflatten(
     assert list(spreadsheet_input.unflatten()) == expected_output_list
 
 
+@pytest.mark.parametrize("run_size", [1, 2, 10000])
+@pytest.mark.parametrize("root_id,root_id_kwargs", ROOT_ID_PARAMS)
+@pytest.mark.parametrize(
+    "comment,input_dict,expected_output_list,warning_messages,reversible",
+    testdata_multiplesheets,
+)
+def test_unflatten_external_sort(
+    run_size,
+    root_id,
+    root_id_kwargs,
+    input_dict,
+    expected_output_list,
+    recwarn,
+    comment,
+    warning_messages,
+    reversible,
+):
+    """
+    do_sorted_unflatten should produce the same cell trees as do_unflatten,
+    including the locations used for source maps, even when the rows for each
+    root id are not together.
+    """
+    sheets = OrderedDict(
+        [
+            (
+                sheet_name,
+                [inject_root_id(root_id, line) for line in reversed(lines)],
+            )
+            for sheet_name, lines in input_dict.items()
+        ]
+    )
+    spreadsheet_input = ListInput(sheets=sheets, **root_id_kwargs)
+    spreadsheet_input.read_sheets()
+    parser = SchemaParser(
+        root_schema_dict=create_schema(root_id),
+        root_id=root_id,
+        rollup=True,
+    )
+    parser.parse()
+    spreadsheet_input.parser = parser
+
+    expected = spreadsheet_input.do_unflatten()
+    actual = list(spreadsheet_input.do_sorted_unflatten(run_size=run_size))
+    assert extract_list_to_value(actual) == extract_list_to_value(expected)
+    assert extract_list_to_error_path([], actual) == extract_list_to_error_path(
+        [], expected
+    )
+
+
 @pytest.mark.parametrize("convert_titles", [True, False])
 @pytest.mark.parametrize("root_id,root_id_kwargs", ROOT_ID_PARAMS)
 @pytest.mark.parametrize(
@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import functools
+import gzip
+import json
 import os
+import warnings
 from collections import OrderedDict
 from decimal import Decimal
 
@@ -1057,3 +1061,181 @@ def test_parse_geojson_wkt_off():
             "c/0/d/coordinates": "-0.173,5.626;-0.178,5.807;-0.112,5.971;-0.211,5.963;-0.321,6.17;-0.488,6.29;-0.560,6.421;-0.752,6.533;-0.867,6.607;-1.101,6.585;-1.304,6.623;-1.461,6.727;-1.628,6.713",
         },
     ]
+
+
+@pytest.mark.parametrize("use_schema", [False, True])
+@pytest.mark.parametrize("selective", [False, True])
+@pytest.mark.parametrize("json_lines", [False, True])
+def test_parse_parallel_same_as_serial(
+    use_schema, selective, json_lines, recwarn, tmpdir
+):
+    root_json_dict = [
+        OrderedDict(
+            [
+                ("ocid", "ocid{}".format(i // 3)),
+                ("id", str(i)),
+                ("testA", str(i)),
+                (
+                    "testB",
+                    [
+                        OrderedDict([("id", "1"), ("testC" + str(i % 4), i)]),
+                        OrderedDict([("id", "2"), ("testD", {"testE": i})]),
+                    ],
+                ),
+            ]
+        )
+        for i in range(20)
+    ]
+    root_json_dict.insert(7, "not an object")
+
+    def parse(**kwargs):
+        if use_schema:
+            schema_parser = SchemaParser(
+                root_schema_dict={
+                    "properties": {
+                        "id": {"type": "string"},
+                        "testB": {
+                            "type": "array",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "id": {"type": "string"},
+                                    "testC0": {"type": "number"},
+                                },
+                            },
+                        },
+                    }
+                }
+            )
+            schema_parser.parse()
+        else:
+            schema_parser = None
+        if json_lines:
+            # Each worker reads its own range of lines from the file
+            test_jsonl = tmpdir.join("test.jsonl")
+            test_jsonl.write(
+                "".join(json.dumps(item) + "\n" for item in root_json_dict)
+            )
+            kwargs.update(json_filename=test_jsonl.strpath, json_lines=True)
+        else:
+            kwargs.update(root_json_dict=root_json_dict)
+        return JSONParser(schema_parser=schema_parser, root_id="ocid", **kwargs)
+
+    if selective:
+        preserve_fields = tmpdir.join("preserve_fields.txt")
+        preserve_fields.write("testA\ntestB/testD/testE\ntestB/testC1\n")
+        parse = functools.partial(
+            parse,
+            filter_field="ocid",
+            filter_value="ocid2",
+            preserve_fields=preserve_fields.strpath,
+        )
+
+    # Warnings from the same line aren't repeated by default
+    warnings.simplefilter("always")
+    serial = parse()
+    serial_warnings = [str(w.message) for w in recwarn]
+    recwarn.clear()
+    parallel = parse(workers=2, chunk_size=3)
+    assert [str(w.message) for w in recwarn] == serial_warnings
+    assert "The value at index 7 is not a JSON object" in serial_warnings
+
+    assert list(parallel.main_sheet) == list(serial.main_sheet)
+    assert list(parallel.main_sheet.lines) == list(serial.main_sheet.lines)
+    assert list(parallel.sub_sheets) == list(serial.sub_sheets)
+    for sheet_name, sheet in serial.sub_sheets.items():
+        assert list(parallel.sub_sheets[sheet_name]) == list(sheet)
+        assert list(parallel.sub_sheets[sheet_name].lines) == list(sheet.lines)
+    assert parallel.seen_paths == serial.seen_paths
+
+
+def test_preserve_fields(tmpdir):
+    preserve_fields = tmpdir.join("preserve_fields.txt")
+    preserve_fields.write("id\na/b/c\nd\nd/e\nf/g\n")
+    parser = JSONParser(
+        root_json_dict=[
+            {
+                "id": 1,
+                "title": "not preserved",
+                "c": "not preserved",
+                "a": {"b": {"c": 2, "x": 3}, "y": 4},
+                "d": {"e": 5, "z": 6},
+                "f": [{"id": "f1", "g": 7, "h": 8}],
+            }
+        ],
+        preserve_fields=preserve_fields.strpath,
+        root_id="",
+    )
+    assert list(parser.main_sheet) == ["id", "a/b/c", "d/e"]
+    assert list(parser.main_sheet.lines) == [{"id": 1, "a/b/c": 2, "d/e": 5}]
+    assert list(parser.sub_sheets["f"]) == ["id", "f/0/id", "f/0/g"]
+    assert list(parser.sub_sheets["f"].lines) == [{"id": 1, "f/0/g": 7}]
+
+
+@pytest.mark.parametrize("sheet_storage", ["spill", "zodb"])
+def test_sheet_storage(sheet_storage, tmpdir):
+    test_json = tmpdir.join("test.json")
+    test_json.write(
+        '[{"a": "b", "c": [{"d": 1.5}, {"d": 2}]}, {"a": "e", "f": true}, {}]'
+    )
+    with JSONParser(
+        json_filename=test_json.strpath, persist=True, sheet_storage=sheet_storage
+    ) as parser:
+        assert list(parser.main_sheet) == ["a", "f"]
+        assert list(parser.main_sheet.lines) == [{"a": "b"}, {"a": "e", "f": True}, {}]
+        # Lines can be read more than once
+        assert list(parser.main_sheet.lines) == [{"a": "b"}, {"a": "e", "f": True}, {}]
+        assert list(parser.sub_sheets["c"].lines) == [
+            {"c/0/d": Decimal("1.5")},
+            {"c/0/d": 2},
+        ]
+        # Rows are in the order of the given header, with None for missing
+        # values, and values for keys that aren't in the header are left out
+        assert list(parser.main_sheet.rows(["f", "x", "a"])) == [
+            [None, None, "b"],
+            [True, None, "e"],
+            [None, None, None],
+        ]
+
+
+def test_sheet_storage_invalid(tmpdir):
+    test_json = tmpdir.join("test.json")
+    test_json.write("[]")
+    with pytest.raises(ValueError):
+        JSONParser(
+            json_filename=test_json.strpath, persist=True, sheet_storage="invalid"
+        )
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_json_lines(compressed, tmpdir):
+    json_lines = '{"id": 1, "a": {"b": 2}}\n\n{"id": 3, "c": [{"d": 4.5}]}\n'
+    if compressed:
+        test_jsonl = tmpdir.join("test.jsonl.gz")
+        with gzip.open(test_jsonl.strpath, "wt") as fp:
+            fp.write(json_lines)
+    else:
+        test_jsonl = tmpdir.join("test.jsonl")
+        test_jsonl.write(json_lines)
+    parser = JSONParser(json_filename=test_jsonl.strpath, json_lines=True, root_id="")
+    assert list(parser.main_sheet) == ["id", "a/b"]
+    assert list(parser.main_sheet.lines) == [{"id": 1, "a/b": 2}, {"id": 3}]
+    assert listify(parser.sub_sheets) == {"c": ["id", "c/0/d"]}
+    assert list(parser.sub_sheets["c"].lines) == [{"id": 3, "c/0/d": Decimal("4.5")}]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+@pytest.mark.parametrize(
+    "json_lines",
+    [
+        b'{"a": "b"}\n{"a": "b",}\n',
+        # Only "\n" separates lines
+        b'{"a": "b"}\n{"a": "b"}\r{"a": "b"}\n',
+    ],
+)
+def test_json_lines_bad_json(json_lines, workers, tmpdir):
+    test_jsonl = tmpdir.join("test.jsonl")
+    test_jsonl.write_binary(json_lines)
+    with pytest.raises(BadlyFormedJSONError) as excinfo:
+        JSONParser(json_filename=test_jsonl.strpath, json_lines=True, workers=workers)
+    assert "Line 2 of the JSON Lines input is not valid JSON" in str(excinfo.value)
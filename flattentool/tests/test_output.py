@@ -2,10 +2,16 @@
 from __future__ import unicode_literals
 
 import os
+import subprocess
 import sys
+import zipfile
 
+import odf.opendocument
+import odf.table
+import odf.text
 import openpyxl
 import pytest
+from odf.opendocument import OpenDocumentSpreadsheet
 
 from flattentool import output
 from flattentool.ODSReader import ODSReader
@@ -56,7 +62,7 @@ def test_blank_sheets(tmpdir):
     # Check ODS is empty
     odswb = ODSReader(tmpdir.join("release.ods").strpath)
     ods_rows = odswb.getSheet("release")
-    assert ods_rows == [[]]
+    assert ods_rows == []
 
 
 def test_populated_header(tmpdir):
@@ -246,3 +252,196 @@ def test_utf8(tmpdir):
     assert [x for x in ods_rows[0]] == ["é"]
     assert [x for x in ods_rows[1]] == ["éαГ😼𝒞人"]
     assert [x for x in ods_rows[2]] == ["cell2"]
+
+
+def test_ods_cell_types(tmpdir):
+    parser = MockParser(["a", "b", "c", "d"], {})
+    parser.main_sheet._lines = [
+        {"a": "1.5", "b": "x<y&z", "c": None, "d": 12},
+        {"a": "", "b": "'quoted\"", "c": "text", "d": "1e5"},
+    ]
+    output.ODSOutput(
+        parser=parser,
+        main_sheet_name="a-sheet-name-that-is-longer-than-31-characters",
+        output_name=tmpdir.join("release.ods").strpath,
+    ).write_sheets()
+
+    odswb = ODSReader(tmpdir.join("release.ods").strpath)
+    assert list(odswb.SHEETS) == ["a-sheet-name-that-is-longer-tha"]
+    assert odswb.getSheet("a-sheet-name-that-is-longer-tha") == [
+        ["a", "b", "c", "d"],
+        [1.5, "x<y&z", None, 12],
+        [None, "'quoted\"", "text", 100000.0],
+    ]
+
+
+ODS_CELL_TYPES_LINES = [
+    {"a": "1.5", "b": "x<y&z", "c": None, "d": 12},
+    {"a": "", "b": "'quoted\"", "c": "text", "d": 0},
+]
+
+
+def write_odfpy_ods(output_name):
+    """
+    Write the lines of ODS_CELL_TYPES_LINES with odfpy's DOM and save(), as
+    ODSOutput did before it streamed content.xml.
+
+    """
+    workbook = OpenDocumentSpreadsheet()
+    table = odf.table.Table(name="release")
+    for values in [["a", "b", "c", "d"]] + [
+        [line[key] for key in "abcd"] for line in ODS_CELL_TYPES_LINES
+    ]:
+        row = odf.table.TableRow()
+        for value in values:
+            if value:
+                try:
+                    cell = odf.table.TableCell(valuetype="float", value=float(value))
+                except ValueError:
+                    cell = odf.table.TableCell(valuetype="string")
+            else:
+                cell = odf.table.TableCell(valuetype="Nonetype")
+            cell.addElement(odf.text.P(text=value))
+            row.addElement(cell)
+        table.addElement(row)
+    workbook.spreadsheet.addElement(table)
+    workbook.save(output_name)
+
+
+def write_streamed_ods(output_name):
+    parser = MockParser(["a", "b", "c", "d"], {})
+    parser.main_sheet._lines = ODS_CELL_TYPES_LINES
+    output.ODSOutput(
+        parser=parser, main_sheet_name="release", output_name=output_name
+    ).write_sheets()
+
+
+def read_zip_entries(filename):
+    with zipfile.ZipFile(filename) as zip_file:
+        return [
+            (zip_info.filename, zip_info.compress_type, zip_file.read(zip_info))
+            for zip_info in zip_file.infolist()
+        ]
+
+
+def test_ods_output_matches_odfpy_save(tmpdir):
+    # odfpy declares every namespace it has seen so far in the process on each
+    # part's root element, so write each file in a new process.
+    for name in ("write_odfpy_ods", "write_streamed_ods"):
+        subprocess.check_call(
+            [
+                sys.executable,
+                "-c",
+                "import sys; from flattentool.tests import test_output; "
+                "test_output.{}(sys.argv[1])".format(name),
+                tmpdir.join(name + ".ods").strpath,
+            ]
+        )
+    assert read_zip_entries(tmpdir.join("write_streamed_ods.ods").strpath) == (
+        read_zip_entries(tmpdir.join("write_odfpy_ods.ods").strpath)
+    )
+
+    # And in this process, after other documents have been written
+    write_odfpy_ods(tmpdir.join("odfpy.ods").strpath)
+    write_streamed_ods(tmpdir.join("streamed.ods").strpath)
+    assert read_zip_entries(tmpdir.join("streamed.ods").strpath) == (
+        read_zip_entries(tmpdir.join("odfpy.ods").strpath)
+    )
+
+    document = odf.opendocument.load(tmpdir.join("streamed.ods").strpath)
+    odfpy_document = odf.opendocument.load(tmpdir.join("odfpy.ods").strpath)
+    assert document.mimetype == "application/vnd.oasis.opendocument.spreadsheet"
+    assert document.stylesxml() == odfpy_document.stylesxml()
+    assert document.metaxml() == odfpy_document.metaxml()
+    assert [
+        table.getAttribute("name")
+        for table in document.spreadsheet.getElementsByType(odf.table.Table)
+    ] == ["release"]
+
+
+def test_ods_output_error(tmpdir):
+    class BrokenSheet(Sheet):
+        def rows(self, header):
+            yield ["cell1"]
+            raise ValueError("Broken sheet")
+
+    parser = MockParser([], {})
+    parser.main_sheet = BrokenSheet(["a"])
+    ods_output = output.ODSOutput(
+        parser=parser, output_name=tmpdir.join("release.ods").strpath
+    )
+    with pytest.raises(ValueError):
+        ods_output.write_sheets()
+
+    # A truncated file isn't left behind, or open
+    assert not tmpdir.join("release.ods").exists()
+    assert ods_output.zip_file.fp is None
+
+
+def test_multiple_outputs(tmpdir):
+    class CountingSheet(Sheet):
+        lines_read = 0
+
+        @property
+        def lines(self):
+            CountingSheet.lines_read += 1
+            return self._lines
+
+    parser = MockParser([], {})
+    parser.main_sheet = CountingSheet(["a"])
+    parser.main_sheet._lines = [{"a": "cell1"}, {"a": "cell2"}]
+    spreadsheet_output = output.MultipleSpreadsheetOutput(
+        [
+            spreadsheet_output_class(
+                parser=parser,
+                main_sheet_name="release",
+                output_name=os.path.join(
+                    tmpdir.strpath, "release" + output.FORMATS_SUFFIX[format_name]
+                ),
+            )
+            for format_name, spreadsheet_output_class in output.FORMATS.items()
+        ]
+    )
+    spreadsheet_output.write_sheets()
+
+    # The lines are only read once for all the formats
+    assert CountingSheet.lines_read == 1
+
+    wb = openpyxl.load_workbook(tmpdir.join("release.xlsx").strpath)
+    assert [[x.value for x in row] for row in wb["release"].rows] == [
+        ["a"],
+        ["cell1"],
+        ["cell2"],
+    ]
+    assert (
+        tmpdir.join("release", "release.csv").read().strip("\r\n").replace("\r", "")
+        == "a\ncell1\ncell2"
+    )
+    odswb = ODSReader(tmpdir.join("release.ods").strpath)
+    assert odswb.getSheet("release") == [["a"], ["cell1"], ["cell2"]]
+
+
+def test_sheet_columns():
+    sheet = Sheet(["b", "a"], root_id="ocid")
+    sheet.add_field("id", id_field=True)
+    for column in ["c", "a", "id", "d"]:
+        if column not in sheet:
+            sheet.append(column)
+    assert list(sheet) == ["ocid", "id", "b", "a", "c", "d"]
+    assert sheet.columns == ("b", "a", "c", "d")
+    assert sheet.id_columns == ("id",)
+    # The columns can't be changed in place
+    with pytest.raises(AttributeError):
+        sheet.columns.append("e")
+    assert "ocid" in sheet
+    assert "e" not in sheet
+
+    copied_sheet = Sheet()
+    copied_sheet.copy_columns_from(sheet)
+    copied_sheet.append("e")
+    assert list(copied_sheet) == ["ocid", "id", "b", "a", "c", "d", "e"]
+    assert "e" not in sheet
+
+    sheet.columns = []
+    assert list(sheet) == ["ocid", "id"]
+    assert "a" not in sheet
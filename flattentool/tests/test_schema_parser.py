@@ -1,7 +1,10 @@
+import json
 from collections import OrderedDict
 
+import jsonref
 import pytest
 
+from flattentool.exceptions import FlattenToolWarning
 from flattentool.schema import SchemaParser, get_property_type_set, is_ref_local
 from flattentool.sheet import Sheet
 
@@ -751,6 +754,251 @@ def test_schema_from_uri(httpserver):
     assert parser.root_schema_dict["a"] == "c"
 
 
+def test_schema_cache(tmpdir, recwarn, monkeypatch):
+    schema_file = tmpdir.join("schema.json")
+    schema_file.write(
+        """{
+        "properties": {
+            "id": {"type": "string", "title": "Identifier"},
+            "Atest": {
+                "type": "array",
+                "title": "ATitle",
+                "rollUp": ["Btest", "Dtest"],
+                "items": {
+                    "type": "object",
+                    "properties": {"Btest": {"type": "string", "title": "BTitle"}}
+                }
+            }
+        }
+    }"""
+    )
+    cache_dir = tmpdir.join("cache")
+
+    def parse(**kwargs):
+        parser = SchemaParser(
+            schema_filename=schema_file.strpath,
+            rollup=True,
+            root_id="ocid",
+            cache_dir=cache_dir.strpath,
+            **kwargs
+        )
+        parser.parse()
+        return parser
+
+    def parsed_state(parser):
+        return (
+            parser.flattened,
+            list(parser.main_sheet),
+            {
+                name: (list(sheet), sheet.titles, sorted(sheet.title_lookup.data))
+                for name, sheet in parser.sub_sheets.items()
+            },
+            parser.sub_sheet_titles,
+            sorted(parser.title_lookup.data),
+            parser.rollup,
+        )
+
+    parser = parse()
+    assert "Dtest in rollUp but not in schema" in str(recwarn.pop(UserWarning).message)
+    assert len(cache_dir.listdir()) == 1
+    # The cache is stored as JSON
+    assert json.load(cache_dir.listdir()[0])["rollup"] == ["Atest/0/Btest"]
+
+    # The schema isn't loaded again, but the warnings are repeated
+    def fail(*args, **kwargs):
+        raise AssertionError
+
+    monkeypatch.setattr("jsonref.loads", fail)
+    cached_parser = parse()
+    assert "Dtest in rollUp but not in schema" in str(
+        recwarn.pop(FlattenToolWarning).message
+    )
+    assert cached_parser.root_schema_dict is None
+    assert parsed_state(cached_parser) == parsed_state(parser)
+    assert cached_parser.title_lookup.lookup_header("ATitle:BTitle") == "Atest/Btest"
+    monkeypatch.undo()
+
+    # Options that affect parsing are part of the cache key
+    titles_parser = parse(use_titles=True)
+    assert len(cache_dir.listdir()) == 2
+    assert parsed_state(titles_parser) != parsed_state(parser)
+
+    # So is the content of the schema
+    schema_file.write('{"properties": {"id": {"type": "string"}}}')
+    assert list(parse().main_sheet) == ["id"]
+    assert len(cache_dir.listdir()) == 3
+
+    # And the version of flattentool
+    monkeypatch.setattr("flattentool.schema.FLATTENTOOL_VERSION", "0.0.0")
+    assert list(parse().main_sheet) == ["id"]
+    assert len(cache_dir.listdir()) == 4
+
+    # A cache file that can't be loaded, for example because it was written by
+    # another version, is rebuilt
+    for bad_cache in (b"{", b"{}", b"[]"):
+        for cache_file in cache_dir.listdir():
+            cache_file.write_binary(bad_cache)
+        assert list(parse().main_sheet) == ["id"]
+
+
+def test_schema_cache_local_refs(tmpdir, monkeypatch):
+    tmpdir.join("schema.json").write(
+        '{"properties": {"address": {"$ref": "address.json", "title": "Address"}}}'
+    )
+    address_file = tmpdir.join("address.json")
+    address_file.write('{"type": "object", "properties": {"street": {}}}')
+    cache_dir = tmpdir.join("cache")
+    loads = []
+    jsonloader = jsonref.jsonloader
+
+    def recording_jsonloader(uri, **kwargs):
+        loads.append(uri)
+        return jsonloader(uri, **kwargs)
+
+    monkeypatch.setattr("jsonref.jsonloader", recording_jsonloader)
+
+    def parse():
+        parser = SchemaParser(
+            schema_filename=tmpdir.join("schema.json").strpath,
+            cache_dir=cache_dir.strpath,
+        )
+        parser.parse()
+        return list(parser.main_sheet)
+
+    assert parse() == ["address/street"]
+    assert len(loads) == 1
+    assert parse() == ["address/street"]
+    assert len(loads) == 1
+
+    # The cache isn't used if a file that the schema references changes
+    address_file.write('{"type": "object", "properties": {"locality": {}}}')
+    assert parse() == ["address/locality"]
+    assert len(loads) == 2
+    assert parse() == ["address/locality"]
+    assert len(loads) == 2
+    assert len(cache_dir.listdir()) == 1
+
+    # Or is removed
+    address_file.remove()
+    with pytest.raises(jsonref.JsonRefError):
+        parse()
+
+
+def test_referenced_subschema_reused(tmpdir, monkeypatch):
+    schema_file = tmpdir.join("schema.json")
+    schema_file.write(
+        """{
+        "properties": {
+            "value": {"$ref": "#/definitions/Value", "title": "Value"},
+            "tender": {
+                "type": "object",
+                "title": "Tender",
+                "properties": {
+                    "value": {"$ref": "#/definitions/Value", "title": "Value"},
+                    "minValue": {"$ref": "#/definitions/Value", "title": "Min"},
+                    "buyer": {"$ref": "#/definitions/Party", "title": "Buyer"}
+                }
+            },
+            "supplier": {"$ref": "#/definitions/Party", "title": "Supplier"}
+        },
+        "definitions": {
+            "Value": {
+                "type": "object",
+                "properties": {
+                    "amount": {"type": "number", "title": "Amount"},
+                    "currency": {"type": "string", "title": "Currency"}
+                }
+            },
+            "Party": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string", "title": "Name"},
+                    "contacts": {
+                        "type": "array",
+                        "title": "Contacts",
+                        "items": {
+                            "type": "object",
+                            "properties": {"email": {"type": "string"}}
+                        }
+                    }
+                }
+            }
+        }
+    }"""
+    )
+    parsed_paths = []
+    parse_schema_dict = SchemaParser.parse_schema_dict
+
+    def recording_parse_schema_dict(self, parent_path, *args, **kwargs):
+        parsed_paths.append(parent_path)
+        return parse_schema_dict(self, parent_path, *args, **kwargs)
+
+    monkeypatch.setattr(SchemaParser, "parse_schema_dict", recording_parse_schema_dict)
+    parser = SchemaParser(schema_filename=schema_file.strpath, root_id="ocid")
+    parser.parse()
+
+    # Value is parsed once with no parent path, and then reused. Party has a
+    # sub sheet, so it is parsed where it is used.
+    assert parsed_paths == [
+        "",
+        "",
+        "tender",
+        "tender/buyer",
+        "tender/buyer/contacts/0",
+        "supplier",
+        "supplier/contacts/0",
+    ]
+    assert list(parser.main_sheet) == [
+        "value/amount",
+        "value/currency",
+        "tender/value/amount",
+        "tender/value/currency",
+        "tender/minValue/amount",
+        "tender/minValue/currency",
+        "tender/buyer/name",
+        "supplier/name",
+    ]
+    assert parser.flattened == {
+        "value": "object",
+        "value/amount": "number",
+        "value/currency": "string",
+        "tender": "object",
+        "tender/value": "object",
+        "tender/value/amount": "number",
+        "tender/value/currency": "string",
+        "tender/minValue": "object",
+        "tender/minValue/amount": "number",
+        "tender/minValue/currency": "string",
+        "tender/buyer": "object",
+        "tender/buyer/name": "string",
+        "tender/buyer/contacts": "array",
+        "tender/buyer/contacts/email": "string",
+        "supplier": "object",
+        "supplier/name": "string",
+        "supplier/contacts": "array",
+        "supplier/contacts/email": "string",
+    }
+    assert parser.title_lookup.lookup_header("Tender:Min:Amount") == (
+        "tender/minValue/amount"
+    )
+    assert parser.title_lookup.lookup_header("Value:Currency") == "value/currency"
+    # Each use of a subschema has its own title lookups
+    assert parser.title_lookup["Value"] is not parser.title_lookup["Tender"]["Value"]
+    assert (
+        parser.title_lookup["Value"]["Amount"]
+        is not parser.title_lookup["Tender"]["Value"]["Amount"]
+    )
+    # Subschemas with sub sheets aren't reused
+    assert list(parser.sub_sheets["ten_buy_contacts"]) == [
+        "ocid",
+        "tender/buyer/contacts/0/email",
+    ]
+    assert list(parser.sub_sheets["sup_contacts"]) == [
+        "ocid",
+        "supplier/contacts/0/email",
+    ]
+
+
 test_json_loader_local_refs_disabled_is_ref_local_data_returns_true = [
     (
         "file:///home/odsc/work/flatten-tool/examples/create-template/refs/definitions.json#/definition/address"
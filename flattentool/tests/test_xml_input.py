@@ -1,6 +1,13 @@
+from xml.parsers import expat
+
+import xmltodict
+
 from flattentool.json_input import (
     JSONParser,
+    XMLRootListHandler,
     dicts_to_list_of_dicts,
+    iter_consistent_xml_items,
+    iter_xml_items,
     list_dict_consistency,
     lists_of_dicts_paths,
 )
@@ -250,6 +257,59 @@ def test_list_dict_consistency():
     assert xml_dict == {"c": [{"a": [{"b": [{"d": "str1"}]}, {"b": [{"d": "str2"}]}]}]}
 
 
+def test_iter_xml_items(tmpdir):
+    xml_file = tmpdir.join("test.xml")
+    xml_file.write(
+        "<c><other>x</other>"
+        '<a id="1"><b><d>str1</d></b></a>'
+        "<a><b><d>str2</d></b><b><d>str3</d></b></a>"
+        "<a/></c>"
+    )
+
+    assert list(iter_xml_items(xml_file.strpath, "a", read_size=10)) == [
+        {"@id": "1", "b": {"d": {"#text": "str1"}}},
+        {"b": [{"d": {"#text": "str2"}}, {"d": {"#text": "str3"}}]},
+        None,
+    ]
+    # The same list/dict consistency as list_dict_consistency, without
+    # holding the whole file in memory
+    assert list(iter_consistent_xml_items(xml_file.strpath, "a")) == [
+        {"@id": "1", "b": [{"d": {"#text": "str1"}}]},
+        {"b": [{"d": {"#text": "str2"}}, {"d": {"#text": "str3"}}]},
+        None,
+    ]
+
+
+def test_iter_xml_items_same_as_xmltodict(tmpdir):
+    xml = (
+        '<c xmlns:x="http://example.com/x" version="2">\n'
+        '  <a id="1" x:lang="en"> text <b>1</b><b/><b>3</b><x:e>ns</x:e></a>\n'
+        "  <!-- comment -->\n"
+        "  <a><![CDATA[<cdata>]]><a>nested</a><f><a/></f></a>\n"
+        "  <g><a>not an item</a></g>\n"
+        '  <a><b c="d"/> <b> </b></a>\n'
+        "</c>"
+    )
+    xml_file = tmpdir.join("test.xml")
+    xml_file.write(xml)
+    expected = xmltodict.parse(xml, force_list=("a",), force_cdata=True)["c"]["a"]
+    assert list(iter_xml_items(xml_file.strpath, "a", read_size=7)) == expected
+
+
+def test_xml_root_list_handler_memory():
+    handler = XMLRootListHandler("a")
+    parser = expat.ParserCreate()
+    parser.ordered_attributes = True
+    parser.StartElementHandler = handler.start_element
+    parser.EndElementHandler = handler.end_element
+    parser.CharacterDataHandler = handler.characters
+    parser.Parse("<c>\n  <a>1</a>\n  <a>2</a>\n  <b>x</b>\n", False)
+    assert list(handler.items) == [{"#text": "1"}, {"#text": "2"}]
+    # Nothing outside the items is kept, such as the whitespace between them
+    assert handler.stack == []
+    assert handler.path == ["c"]
+
+
 def test_xml_whitespace():
     try:
         parser = JSONParser(
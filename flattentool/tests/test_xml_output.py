@@ -0,0 +1,104 @@
+import io
+from collections import OrderedDict
+
+from flattentool import sort_xml
+from flattentool.sort_xml import create_schema_dict
+from flattentool.xml_output import toxml, write_xml
+
+
+def test_write_xml_iterator():
+    def activities():
+        yield OrderedDict(
+            [("@xmlns:a", "http://example.com/2"), ("a:b", {"text()": "one"})]
+        )
+        yield OrderedDict([("iati-identifier", {"text()": "two"})])
+
+    data = OrderedDict(
+        [
+            ("@xmlns:a", "http://example.com/1"),
+            ("@version", "2.03"),
+            ("iati-activity", activities()),
+        ]
+    )
+    fp = io.BytesIO()
+    write_xml(fp, data, "iati-activities")
+    # Namespaces declared by the activities are declared on the root element,
+    # as if the whole document had been built before it was serialised
+    assert fp.getvalue() == (
+        b"<?xml version='1.0' encoding='utf-8'?>\n"
+        b'<iati-activities xmlns:a="http://example.com/2" version="2.03">\n'
+        b"  <!--XML generated by flatten-tool-->\n"
+        b"  <iati-activity>\n"
+        b"    <a:b>one</a:b>\n"
+        b"  </iati-activity>\n"
+        b"  <iati-activity>\n"
+        b"    <iati-identifier>two</iati-identifier>\n"
+        b"  </iati-activity>\n"
+        b"</iati-activities>\n"
+    )
+
+    data["iati-activity"] = list(activities())
+    assert toxml(data, "iati-activities") == fp.getvalue()
+
+
+def test_write_xml_namespace_declarations():
+    data = OrderedDict(
+        [
+            (
+                "iati-activity",
+                [
+                    OrderedDict(
+                        [
+                            ("@xmlns:a", "http://example.com/1"),
+                            ("a:b", {"text()": "one"}),
+                        ]
+                    ),
+                    OrderedDict(
+                        [
+                            ("@xmlns:a", "http://example.com/2"),
+                            ("a:b", {"text()": "two"}),
+                        ]
+                    ),
+                ],
+            ),
+        ]
+    )
+    assert toxml(data, "iati-activities", xml_comment="A comment") == (
+        b"<?xml version='1.0' encoding='utf-8'?>\n"
+        b'<iati-activities xmlns:a="http://example.com/2">\n'
+        b"  <!--A comment-->\n"
+        b'  <iati-activity xmlns:a="http://example.com/1">\n'
+        b"    <a:b>one</a:b>\n"
+        b"  </iati-activity>\n"
+        b"  <iati-activity>\n"
+        b"    <a:b>two</a:b>\n"
+        b"  </iati-activity>\n"
+        b"</iati-activities>\n"
+    )
+
+
+def test_create_schema_dict_cache(tmpdir, monkeypatch):
+    schemas = [
+        "examples/iati/iati-activities-schema.xsd",
+        "examples/iati/iati-common.xsd",
+    ]
+    schema_dict = create_schema_dict(schemas, "iati-activity")
+    assert list(schema_dict)[:3] == ["iati-identifier", "reporting-org", "title"]
+    assert schema_dict.ranks["reporting-org"] == 1
+
+    cache_dir = tmpdir.join("cache")
+    assert create_schema_dict(schemas, "iati-activity", cache_dir.strpath) == (
+        schema_dict
+    )
+    assert len(cache_dir.listdir()) == 1
+
+    # The schemas aren't walked again
+    def fail(schemas):
+        raise AssertionError
+
+    monkeypatch.setattr(sort_xml, "XMLSchemaWalker", fail)
+    cached_schema_dict = create_schema_dict(schemas, "iati-activity", cache_dir.strpath)
+    assert cached_schema_dict == schema_dict
+    assert cached_schema_dict["reporting-org"].ranks == (
+        schema_dict["reporting-org"].ranks
+    )
@@ -1,4 +1,10 @@
+import io
+import re
+import shutil
+import tempfile
+from array import array
 from collections import OrderedDict
+from collections.abc import Iterator
 from warnings import warn
 
 from flattentool.exceptions import (
@@ -6,7 +12,7 @@ from flattentool.exceptions import (
     FlattenToolError,
     FlattenToolWarning,
 )
-from flattentool.sort_xml import XMLSchemaWalker, sort_element
+from flattentool.sort_xml import create_schema_dict, sort_element
 
 try:
     import lxml.etree as ET
@@ -113,29 +119,164 @@ def dict_to_xml(data, tagname, toplevel=True, nsmap=None):
     return el
 
 
-def toxml(
+def serialise_root_child(element, nsmap):
+    """
+    Serialise an element that's a child of the root element, with the same
+    indentation as pretty printing the whole document, but without declaring
+    any of the namespaces in ``nsmap`` on the element itself.
+
+    """
+    parent = ET.Element("root", nsmap=nsmap)
+    parent.append(element)
+    xml = ET.tostring(parent, pretty_print=True, encoding="utf-8")
+    return xml[xml.index(b">\n") + 2 : xml.rindex(b"</")]
+
+
+def namespace_declarations(nsmap):
+    """
+    Return the serialised xmlns attributes for the namespaces in ``nsmap``.
+
+    """
+    return ET.tostring(ET.Element("x", nsmap=nsmap))[2:-2]
+
+
+def write_xml(
+    fp,
     data,
     xml_root_tag,
     xml_schemas=None,
     root_list_path="iati-activity",
     xml_comment=None,
+    schema_cache_dir=None,
 ):
+    """
+    Write ``data`` to the binary file ``fp`` as XML. The value of
+    ``root_list_path`` can be an iterator, and each element is serialised as
+    soon as it is built.
+
+    The output is the same as building the whole document, then pretty
+    printing it. The namespace declarations on the root element aren't known
+    until every element has been built, so the elements are written to a
+    temporary file first.
+
+    If ``schema_cache_dir`` is given, the order of elements worked out from
+    ``xml_schemas`` is cached in that directory.
+
+    """
     nsmap = {
         # This is "bound by definition" - see https://www.w3.org/XML/1998/namespace
         "xml": "http://www.w3.org/XML/1998/namespace"
     }
-    root = dict_to_xml(data, xml_root_tag, nsmap=nsmap)
-    if xml_schemas is not None:
-        schema_dict = XMLSchemaWalker(xml_schemas).create_schema_dict(root_list_path)
-        for element in root:
-            sort_element(element, schema_dict)
     if xml_comment is None:
         xml_comment = "XML generated by flatten-tool"
-    comment = ET.Comment(xml_comment)
-    root.insert(0, comment)
-    if USING_LXML:
-        return ET.tostring(
+
+    if not USING_LXML:
+        data = OrderedDict(
+            (k, list(v) if isinstance(v, Iterator) else v) for k, v in data.items()
+        )
+        root = dict_to_xml(data, xml_root_tag, nsmap=nsmap)
+        if xml_schemas is not None:
+            schema_dict = create_schema_dict(
+                xml_schemas, root_list_path, cache_dir=schema_cache_dir
+            )
+            for element in root:
+                sort_element(element, schema_dict)
+        root.insert(0, ET.Comment(xml_comment))
+        fp.write(ET.tostring(root))
+        return
+
+    schema_dict = None
+    if xml_schemas is not None:
+        schema_dict = create_schema_dict(
+            xml_schemas, root_list_path, cache_dir=schema_cache_dir
+        )
+
+    # The root tag's namespace is looked up before any of its attributes
+    root_tag = dict_to_xml(OrderedDict(), xml_root_tag, nsmap=nsmap).tag
+    attrib = {}
+    text = None
+    # The length of each serialised child of the root element, and the
+    # namespaces in scope for each child, whenever they change
+    lengths = array("Q")
+    child_nsmaps = []
+    with tempfile.TemporaryFile() as children_file:
+        for k, v in sort_attributes(data).items():
+            if type(v) == list or isinstance(v, Iterator):
+                values = v
+            else:
+                values = [v]
+            for value in values:
+                child_elements = []
+                t = child_to_xml(child_elements, attrib, k, value, nsmap=nsmap)
+                if t:
+                    text = t
+                for element in child_elements:
+                    if schema_dict is not None:
+                        sort_element(element, schema_dict)
+                    if not child_nsmaps or child_nsmaps[-1][1] != nsmap:
+                        child_nsmaps.append((len(lengths), dict(nsmap)))
+                    xml = serialise_root_child(element, nsmap)
+                    children_file.write(xml)
+                    lengths.append(len(xml))
+
+        root = ET.Element(root_tag, attrib=attrib, nsmap=nsmap)
+        if text:
+            root.text = text
+        root.append(ET.Comment(xml_comment))
+        document = ET.tostring(
             root, pretty_print=True, xml_declaration=True, encoding="utf-8"
         )
-    else:
-        return ET.tostring(root)
+        split = document.rindex(b"</")
+        fp.write(document[:split])
+
+        # Namespaces that are in scope for a child, but not declared on the
+        # root element, are declared on the child
+        declarations = [
+            (
+                index,
+                namespace_declarations(
+                    {
+                        prefix: uri
+                        for prefix, uri in child_nsmap.items()
+                        if nsmap.get(prefix) != uri
+                    }
+                ),
+            )
+            for index, child_nsmap in child_nsmaps
+        ]
+        children_file.seek(0)
+        if not any(declaration for index, declaration in declarations):
+            shutil.copyfileobj(children_file, fp)
+        else:
+            declaration = b""
+            for index, length in enumerate(lengths):
+                if declarations and declarations[0][0] == index:
+                    declaration = declarations.pop(0)[1]
+                xml = children_file.read(length)
+                if declaration:
+                    tag_end = re.match(rb"\s*<[^\s/>]+", xml).end()
+                    xml = xml[:tag_end] + declaration + xml[tag_end:]
+                fp.write(xml)
+
+        fp.write(document[split:])
+
+
+def toxml(
+    data,
+    xml_root_tag,
+    xml_schemas=None,
+    root_list_path="iati-activity",
+    xml_comment=None,
+    schema_cache_dir=None,
+):
+    xml = io.BytesIO()
+    write_xml(
+        xml,
+        data,
+        xml_root_tag,
+        xml_schemas=xml_schemas,
+        root_list_path=root_list_path,
+        xml_comment=xml_comment,
+        schema_cache_dir=schema_cache_dir,
+    )
+    return xml.getvalue()